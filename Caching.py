@@ -0,0 +1,228 @@
+import json
+import time
+import asyncio
+import inspect
+import logging
+from collections import OrderedDict
+from collections.abc import Coroutine
+from Fluxon.Protocol import FLAG_RAW
+from Fluxon.Codecs import Codec, CodecError, Raw, Encoded
+from Fluxon.Metrics import Stats
+
+# View response cache, opted into per view with the cache_response decorator.
+# Responses are stored encoded with the connection's codec, a hit skips both the view and the codec.
+# Single-flight (single_flight decorator) shares one execution between identical concurrent calls.
+# NOTE keep this module free of server imports, Routing.py depends on it
+
+def canonical_payload(payload) -> str:
+    """Same payload, same string (key order doesn't matter), None when it can't be canonicalized."""
+    try:
+        return json.dumps(payload, sort_keys=True, separators=(",", ":"), default=repr)
+    except (TypeError, ValueError): # mixed key types, ...
+        return None
+
+class CachePolicy:
+    __slots__ = ("ttl", "per_user", "tags")
+
+    def __init__(self, ttl:float, per_user:bool, tags):
+        self.ttl = ttl
+        self.per_user = per_user # responses depend on the logged in user, the user id is part of the key
+        self.tags = tags # tag names, or a callable (request) -> tag names
+
+    def tags_for(self, request) -> tuple:
+        return tuple(self.tags(request) if callable(self.tags) else self.tags)
+
+def cache_response(ttl:float=60, per_user:bool=False, tags=()):
+    """
+    View decorator, responses are cached for `ttl` seconds keyed by view name + payload (+ user id with per_user).
+    `tags` (names, or a callable taking the request) let write paths drop them with ResponseCache.invalidate.
+    NOTE the view must be a pure read of its payload (and user), middlewares still run on cache hits
+    """
+    def decorator(view):
+        view.response_cache = CachePolicy(ttl, per_user, tags)
+        return view
+    return decorator
+
+class ResponseCache:
+    """
+    Encoded view responses, least recently used ones are evicted past `max_bytes`.
+    A response computed while an invalidation happened isn't stored, see `generation`.
+    """
+    def __init__(self, max_bytes:int=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0 # bytes held
+        self.entries = OrderedDict() # key -> (Encoded, expires, tags)
+        self.tags = dict() # tag -> keys
+        self.generation = 0 # bumped by every invalidation
+        self.stats = Stats()
+
+    @staticmethod
+    def key(view_name:str, request, policy:CachePolicy):
+        payload = canonical_payload(request.payload)
+        if payload is None: # not cached
+            return None
+        return (view_name, request.connection.codec.name, request.userid if policy.per_user else None, payload)
+
+    def get(self, key) -> Encoded:
+        self.stats.incr("lookups")
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        encoded, expires, _ = entry
+        if expires < time.monotonic():
+            self.drop(key)
+            self.stats.incr("expired")
+            return None
+        self.entries.move_to_end(key)
+        self.stats.incr("hits")
+        return encoded
+
+    def put(self, key, encoded:Encoded, ttl:float, tags:tuple, generation:int):
+        size = len(encoded.data) + len(key[3])
+        if generation != self.generation or size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.drop(key)
+        self.entries[key] = (encoded, time.monotonic() + ttl, tags)
+        self.size += size
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(key)
+        self.stats.incr("stores")
+        while self.size > self.max_bytes:
+            self.drop(next(iter(self.entries)))
+            self.stats.incr("evictions")
+
+    def drop(self, key):
+        encoded, _, tags = self.entries.pop(key)
+        self.size -= len(encoded.data) + len(key[3])
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def invalidate(self, *tags):
+        """Drops the responses stored under any of `tags`, every response when no tag is given."""
+        self.generation += 1
+        self.stats.incr("invalidations")
+        if not tags:
+            self.entries.clear()
+            self.tags.clear()
+            self.size = 0
+            return
+        for tag in tags:
+            for key in list(self.tags.get(tag, ())):
+                self.drop(key)
+
+    @staticmethod
+    def encode(response, codec:Codec) -> Encoded:
+        if isinstance(response, Encoded):
+            return response
+        if isinstance(response, Raw):
+            return Encoded(bytes(response.data), FLAG_RAW)
+        try:
+            return Encoded(codec.encode(response))
+        except CodecError: # left to the server's error response
+            return None
+
+    def wrap(self, view_name:str, view, policy:CachePolicy):
+        """Call chain terminal of a cached view, answers hits without running the view."""
+        async def cached_view(request):
+            key = self.key(view_name, request, policy)
+            if key is not None:
+                encoded = self.get(key)
+                if encoded is not None:
+                    return encoded
+                generation = self.generation
+            response = view(request)
+            if isinstance(response, Coroutine):
+                response = await response
+            if key is None or inspect.isasyncgen(response): # streaming views aren't cached
+                return response
+            encoded = self.encode(response, request.connection.codec)
+            if encoded is None:
+                return response
+            self.put(key, encoded, policy.ttl, policy.tags_for(request), generation)
+            return encoded
+        return cached_view
+
+    def snapshot(self) -> dict:
+        snapshot = self.stats.snapshot()
+        snapshot.update(entries=len(self.entries), bytes=self.size, hit_rate=self.stats.ratio("hits", "lookups"))
+        return snapshot
+
+def single_flight(per_user:bool=False):
+    """
+    View decorator, identical concurrent calls (view name + payload, + user id with per_user) share one execution
+    and all get its result or its error, it's cancelled once every caller went away.
+    Calls arriving after it completed run the view again (see cache_response).
+    NOTE the view runs with the first caller's request, it must only depend on its payload (and user)
+    """
+    def decorator(view):
+        view.single_flight = per_user
+        return view
+    return decorator
+
+class SingleFlight:
+    def __init__(self):
+        self.inflight = dict() # key -> asyncio.Task running the view
+        self.waiters = dict() # asyncio.Task -> callers awaiting it, cancelled when the last one goes away
+        self.stats = Stats()
+        self.logger = logging.getLogger("main_logger")
+
+    def wrap(self, view_name:str, view, per_user:bool):
+        """Call chain terminal of a single-flight view (inside the response cache when the view has both)."""
+        if inspect.isasyncgenfunction(view):
+            self.logger.warning(f"[SingleFlight] Streaming view '{view_name}' can't share its output, single-flight ignored")
+            return view
+
+        async def run(request):
+            response = view(request)
+            if isinstance(response, Coroutine):
+                response = await response
+            return response
+
+        async def shared_view(request):
+            payload = canonical_payload(request.payload)
+            if payload is None:
+                return await run(request)
+            key = (view_name, request.userid if per_user else None, payload)
+            self.stats.incr("calls")
+            task = self.inflight.get(key)
+            if task is None:
+                self.stats.incr("executions")
+                # NOTE a task of its own, the first caller going away doesn't cancel the others
+                task = self.inflight[key] = asyncio.ensure_future(run(request))
+                task.add_done_callback(lambda task: self.completed(key, task))
+            else:
+                self.stats.incr("suppressed")
+            self.waiters[task] = self.waiters.get(task, 0) + 1
+            try:
+                return await asyncio.shield(task)
+            finally:
+                self.left(key, task)
+        return shared_view
+
+    def left(self, key, task:asyncio.Task):
+        # a caller got its result or went away (deadline, dropped connection)
+        self.waiters[task] -= 1
+        if self.waiters[task]:
+            return
+        del self.waiters[task]
+        if not task.done(): # nobody waits for it anymore
+            if self.inflight.get(key) is task: # later calls start over rather than join a cancelled run
+                del self.inflight[key]
+            task.cancel()
+            self.stats.incr("abandoned")
+
+    def completed(self, key, task:asyncio.Task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        if not task.cancelled():
+            task.exception() # retrieved, even if every caller went away
+
+    def snapshot(self) -> dict:
+        snapshot = self.stats.snapshot()
+        snapshot.update(inflight=len(self.inflight), suppression_rate=self.stats.ratio("suppressed", "calls"))
+        return snapshot
@@ -0,0 +1,332 @@
+import struct
+import json
+import zlib
+from datetime import datetime, date, timedelta, timezone
+
+# Payload codecs, negotiated once per connection during the handshake.
+# NOTE keep this module free of server imports, Connect.py depends on it
+
+try:
+    import orjson # optional fast JSON backend
+except ImportError:
+    orjson = None
+
+class CodecError(Exception):
+    """Raised when a payload can't be encoded or decoded by the connection codec."""
+    pass
+
+class Raw:
+    """
+    Wraps a view response that is already serialized.
+    The bytes are written to the wire as they are (no codec pass) and flagged so the client skips decoding.
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            raise TypeError(f"Raw response should be bytes-like not {type(data).__name__}")
+        self.data = data
+
+class Encoded:
+    """A view response already encoded with the connection's codec (response cache), written out as it is."""
+    __slots__ = ("data", "flags")
+
+    def __init__(self, data:bytes, flags:int=0):
+        self.data = data
+        self.flags = flags # frame flags (FLAG_RAW for Raw responses)
+
+class Codec: # abstract class
+    name: str
+    def encode(self, obj) -> bytes: ...
+    def decode(self, data): ...
+
+class JSONCodec(Codec):
+    name = "json"
+    def encode(self, obj) -> bytes:
+        try:
+            return json.dumps(obj).encode('utf-8')
+        except (TypeError, ValueError) as e:
+            raise CodecError(f"NonSerializable: {e}") from e
+
+    def decode(self, data):
+        try:
+            return json.loads(bytes(data))
+        except ValueError as e:
+            raise CodecError(f"InvalidPayload: {e}") from e
+
+class FastJSONCodec(Codec):
+    # same wire format as JSONCodec, only registered when orjson is importable
+    name = "fastjson"
+    def encode(self, obj) -> bytes:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError as e:
+            raise CodecError(f"NonSerializable: {e}") from e
+
+    def decode(self, data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            raise CodecError(f"InvalidPayload: {e}") from e
+
+class RawCodec(Codec):
+    # bytes in, bytes out, for clients that serialize on their own
+    name = "raw"
+    def encode(self, obj) -> bytes:
+        if isinstance(obj, (bytes, bytearray, memoryview)):
+            return bytes(obj)
+        raise CodecError(f"NonSerializable: raw codec only carries bytes not {type(obj).__name__}")
+
+    def decode(self, data):
+        return bytes(data)
+
+class BinaryCodec(Codec):
+    """
+    Compact tagged binary format (MessagePack-style).
+    Every value is a one byte tag followed by a fixed-width body or a length-prefixed one,
+    so bytes travel as they are (no base64) and strings need no escaping.
+    """
+    name = "binary"
+    # tags
+    NONE, FALSE, TRUE, INT32, INT64, BIGINT, FLOAT, STR8, STR, BYTES, LIST, DICT, DATETIME, DATE = range(14)
+    U8 = struct.Struct("!B")
+    U32 = struct.Struct("!I")
+    I32 = struct.Struct("!i")
+    I64 = struct.Struct("!q")
+    F64 = struct.Struct("!d")
+    DATETIME_BODY = struct.Struct("!qh") # microseconds since epoch | utc offset in minutes
+    DATE_BODY = struct.Struct("!i") # proleptic gregorian ordinal
+    NAIVE = -32768 # utc offset marker for naive datetimes
+    MAX_DEPTH = 256 # nested lists/dicts, deeper payloads are rejected rather than running out of stack
+    EPOCH = datetime(1970, 1, 1)
+    EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+    def encode(self, obj) -> bytes:
+        parts = []
+        try:
+            self.encode_value(obj, parts.append)
+        except (TypeError, ValueError, OverflowError, struct.error) as e:
+            raise CodecError(f"NonSerializable: {e}") from e
+        return b''.join(parts)
+
+    def encode_value(self, obj, write):
+        # exact type checks first, they cover nearly every payload
+        kind = type(obj)
+        if kind is str:
+            body = obj.encode('utf-8')
+            if len(body) < 256:
+                write(bytes((self.STR8, len(body))))
+            else:
+                write(b'\x08' + self.U32.pack(len(body)))
+            write(body)
+        elif kind is int:
+            if -0x80000000 <= obj <= 0x7FFFFFFF:
+                write(b'\x03' + self.I32.pack(obj))
+            elif -0x8000000000000000 <= obj <= 0x7FFFFFFFFFFFFFFF:
+                write(b'\x04' + self.I64.pack(obj))
+            else:
+                body = obj.to_bytes((obj.bit_length() + 8) // 8, 'big', signed=True)
+                write(b'\x05' + self.U32.pack(len(body)))
+                write(body)
+        elif kind is dict:
+            write(b'\x0b' + self.U32.pack(len(obj)))
+            for key, value in obj.items():
+                self.encode_value(key, write)
+                self.encode_value(value, write)
+        elif kind is list or kind is tuple:
+            write(b'\x0a' + self.U32.pack(len(obj)))
+            for item in obj:
+                self.encode_value(item, write)
+        elif kind is float:
+            write(b'\x06' + self.F64.pack(obj))
+        elif obj is None:
+            write(b'\x00')
+        elif kind is bool:
+            write(b'\x02' if obj else b'\x01')
+        elif kind in (bytes, bytearray, memoryview):
+            write(b'\x09' + self.U32.pack(len(obj)))
+            write(bytes(obj))
+        elif isinstance(obj, datetime): # before date, datetime is a date subclass
+            if obj.tzinfo is None:
+                microseconds, offset = (obj - self.EPOCH) // timedelta(microseconds=1), self.NAIVE
+            else:
+                microseconds = (obj - self.EPOCH_UTC) // timedelta(microseconds=1)
+                offset = obj.utcoffset() // timedelta(minutes=1)
+            write(b'\x0c' + self.DATETIME_BODY.pack(microseconds, offset))
+        elif isinstance(obj, date):
+            write(b'\x0d' + self.DATE_BODY.pack(obj.toordinal()))
+        # subclasses (IntEnum, OrderedDict, namedtuple, ...) go through their base type
+        elif isinstance(obj, int):
+            self.encode_value(int(obj), write)
+        elif isinstance(obj, float):
+            self.encode_value(float(obj), write)
+        elif isinstance(obj, str):
+            self.encode_value(str(obj), write)
+        elif isinstance(obj, (list, tuple)):
+            self.encode_value(list(obj), write)
+        elif isinstance(obj, dict):
+            self.encode_value(dict(obj), write)
+        else:
+            raise TypeError(f"Object of type {kind.__name__} is not serializable")
+
+    def decode(self, data):
+        view = memoryview(data)
+        try:
+            value, offset = self.decode_value(view, 0)
+        # NOTE TypeError: unhashable dict key, OverflowError: datetime out of range
+        except (IndexError, ValueError, TypeError, OverflowError, struct.error) as e:
+            raise CodecError(f"InvalidPayload: {e}") from e
+        if offset != len(view):
+            raise CodecError(f"InvalidPayload: {len(view) - offset} trailing bytes")
+        return value
+
+    def decode_value(self, view:memoryview, offset:int, depth:int=0):
+        tag = view[offset]
+        offset += 1
+        if tag == 7: # STR8
+            end = offset + 1 + view[offset]
+            if end > len(view):
+                raise ValueError("truncated value")
+            return str(view[offset + 1:end], 'utf-8'), end
+        elif tag == 3: # INT32
+            return self.I32.unpack_from(view, offset)[0], offset + 4
+        elif tag == 11: # DICT
+            if depth >= self.MAX_DEPTH:
+                raise ValueError(f"nested deeper than {self.MAX_DEPTH}")
+            count, = self.U32.unpack_from(view, offset)
+            offset += 4
+            items = {}
+            decode_value = self.decode_value
+            depth += 1
+            for _ in range(count):
+                key, offset = decode_value(view, offset, depth)
+                items[key], offset = decode_value(view, offset, depth)
+            return items, offset
+        elif tag == 10: # LIST
+            if depth >= self.MAX_DEPTH:
+                raise ValueError(f"nested deeper than {self.MAX_DEPTH}")
+            count, = self.U32.unpack_from(view, offset)
+            offset += 4
+            items = []
+            decode_value = self.decode_value
+            depth += 1
+            for _ in range(count):
+                item, offset = decode_value(view, offset, depth)
+                items.append(item)
+            return items, offset
+        elif tag == 6: # FLOAT
+            return self.F64.unpack_from(view, offset)[0], offset + 8
+        elif tag <= 2: # NONE, FALSE, TRUE
+            return (None, False, True)[tag], offset
+        elif tag == 4: # INT64
+            return self.I64.unpack_from(view, offset)[0], offset + 8
+        elif tag in (8, 9, 5): # STR, BYTES, BIGINT
+            length, = self.U32.unpack_from(view, offset)
+            offset += 4
+            end = offset + length
+            if end > len(view):
+                raise ValueError("truncated value")
+            if tag == 8:
+                return str(view[offset:end], 'utf-8'), end
+            elif tag == 9:
+                return bytes(view[offset:end]), end
+            return int.from_bytes(view[offset:end], 'big', signed=True), end
+        elif tag == 12: # DATETIME
+            microseconds, offset_minutes = self.DATETIME_BODY.unpack_from(view, offset)
+            if offset_minutes == self.NAIVE:
+                value = self.EPOCH + timedelta(microseconds=microseconds)
+            else:
+                value = (self.EPOCH_UTC + timedelta(microseconds=microseconds)).astimezone(timezone(timedelta(minutes=offset_minutes)))
+            return value, offset + self.DATETIME_BODY.size
+        elif tag == 13: # DATE
+            return date.fromordinal(self.DATE_BODY.unpack_from(view, offset)[0]), offset + self.DATE_BODY.size
+        raise ValueError(f"unknown tag {tag}")
+
+# codecs registry
+
+CODECS = dict()
+
+def register_codec(codec:Codec):
+    CODECS[codec.name] = codec
+
+register_codec(JSONCodec())
+register_codec(BinaryCodec())
+register_codec(RawCodec())
+if orjson:
+    register_codec(FastJSONCodec())
+
+JSON_CODEC = CODECS["json"] # legacy connections and un-negotiated ones
+# NOTE binary is pure python, it's opt-in for payloads carrying bytes/datetimes, JSON stays faster for plain data
+DEFAULT_PREFERENCES = ("fastjson", "json")
+
+def negotiate_codec(preferences) -> Codec:
+    """Picks the first codec of the peer's preference list this side supports, JSON otherwise."""
+    if isinstance(preferences, list):
+        for name in preferences:
+            if isinstance(name, str) and name in CODECS:
+                return CODECS[name]
+    return JSON_CODEC
+
+def supported_codecs(preferences=DEFAULT_PREFERENCES) -> list:
+    return [name for name in preferences if name in CODECS]
+
+# frame compression
+
+class Compression: # abstract class
+    name: str
+    def context(self, streaming:bool, max_size:int=None): ...
+
+class ZlibContext:
+    """
+    Compression state of one connection.
+    Streaming contexts keep one compressor/decompressor pair for the connection's lifetime, so keys
+    repeated across frames compress against the shared window (frames must be inflated in wire order).
+    """
+    def __init__(self, level:int, streaming:bool, max_size:int=None):
+        self.level = level
+        self.streaming = streaming
+        self.max_size = max_size # bytes a frame may inflate to (None = no limit), checked while inflating
+        if streaming:
+            self.compressor = zlib.compressobj(level)
+            self.decompressor = zlib.decompressobj()
+
+    def compress(self, data) -> bytes:
+        if self.streaming:
+            return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data) -> bytes:
+        # NOTE capped output, a few KB of zeros inflate to gigabytes before any size check could run
+        decompressor = self.decompressor if self.streaming else zlib.decompressobj()
+        try:
+            inflated = decompressor.decompress(data, self.max_size + 1 if self.max_size else 0)
+        except zlib.error as e:
+            raise CodecError(f"InvalidPayload: {e}") from e
+        if decompressor.unconsumed_tail or self.max_size and len(inflated) > self.max_size:
+            raise CodecError(f"FrameTooLarge: payload inflates past {self.max_size} bytes")
+        if not self.streaming and not decompressor.eof:
+            raise CodecError("InvalidPayload: incomplete or truncated stream")
+        return inflated
+
+class ZlibCompression(Compression):
+    name = "zlib"
+    def __init__(self, level:int=6):
+        self.level = level
+
+    def context(self, streaming:bool=False, max_size:int=None) -> ZlibContext:
+        return ZlibContext(self.level, streaming, max_size)
+
+COMPRESSIONS = dict()
+
+def register_compression(compression:Compression):
+    COMPRESSIONS[compression.name] = compression
+
+register_compression(ZlibCompression())
+
+def negotiate_compression(preferences) -> Compression:
+    """Picks the first compression of the peer's preference list this side supports, None for no compression."""
+    if isinstance(preferences, list):
+        for name in preferences:
+            if isinstance(name, str) and name in COMPRESSIONS:
+                return COMPRESSIONS[name]
+    return None
@@ -5,30 +5,62 @@ import traceback
 import threading
 import time
 import sys
+from concurrent.futures import Future
+from Fluxon.Protocol import (
+    recv_frame, frame_message, handshake_options, FrameError,
+    FRAME_VERSION, FRAME_REQUEST, FRAME_HANDSHAKE, FRAME_BUSY, FRAME_BATCH, FRAME_BODY, MAX_REQUEST_ID,
+    FLAGS_NONE, FLAG_RAW, FLAG_COMPRESSED, FLAG_STREAM, FLAG_END, RETRY_AFTER, MAX_FRAME_PAYLOAD
+)
+from Fluxon.Codecs import Codec, CODECS, COMPRESSIONS, JSON_CODEC, DEFAULT_PREFERENCES, supported_codecs
 
 def content_length(num, padding=5):
     return ("0"*(padding-len(str(num)))+str(num)).encode()
 
+class ServerBusy(Exception):
+    """Raised when the server sheds a request, retry after `retry_after_ms`."""
+    def __init__(self, retry_after_ms:int):
+        super().__init__(f"ServerBusy: retry after {retry_after_ms} ms")
+        self.retry_after_ms = retry_after_ms
+
+class BatchCallError(Exception):
+    """Stands in for the response of a batch call that failed on the server (returned, not raised)."""
+    pass
+
+class StreamError(Exception):
+    """Raised by ConnectionInterface.stream when the streaming view failed on the server."""
+    pass
+
+def iter_chunks(body, chunk_size:int):
+    # bytes, binary file objects and iterables of bytes chunks
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        view = memoryview(body)
+        for offset in range(0, len(view), chunk_size):
+            yield view[offset:offset + chunk_size]
+    elif hasattr(body, "read"):
+        while chunk := body.read(chunk_size):
+            yield chunk
+    else:
+        yield from body
+
+END_OF_STREAM = object() # decode_response result for the frame ending a stream
+
+def check_busy(frame):
+    if frame.frame_type == FRAME_BUSY:
+        raise ServerBusy(RETRY_AFTER.unpack_from(frame.payload)[0])
+    return frame
+
 class ConnectionInterface:
     def receive_package(self, buffer_size_limit:int=65536, timeout:int=120, sock=None):
-        request_content = b''
         if not sock: sock = self.main_sock
         try:
-            content_length = sock.recv(5)
-            if len(content_length) != 5:
-                print(f"[receive-package] Failed to read content length")
-                return None
-            if not content_length.decode('utf-8').isdigit():
-                print(f"[receive-package] Invalid request format")
+            frame = recv_frame(sock, buffer_size_limit)
+            if frame is None:
+                print(f"[receive-package] Connection closed unexpectedly")
                 return None
-            content_length = int(content_length)
-            while len(request_content) < content_length:
-                chunk = sock.recv(min(content_length - len(request_content), buffer_size_limit))
-                if not chunk:
-                    print(f"[receive-package] Connection closed unexpectedly")
-                    return None
-                request_content += chunk
-            return request_content
+            return frame
+        except FrameError as e:
+            print(f"[receive-package] Invalid request format ({e})")
+            return None
         except TimeoutError:
             traceback.print_exc()
             print(f"[receive-package] Timeout after {timeout} seconds while reading from")
@@ -38,11 +70,31 @@ class ConnectionInterface:
             print(f"[receive-package] Error: {str(e)}")
             return None
 
-    def handel_request(self, request):
+    def frame(self, message:bytes, frame_type:int=FRAME_REQUEST):
+        return frame_message(message, self.frame_version, frame_type)
+
+    @staticmethod
+    def decode_payload(serialized_payload, flags:int, codec:Codec):
+        if flags & FLAG_RAW: # serialized by the view itself, handed over as bytes
+            return serialized_payload
+        return codec.decode(serialized_payload)
+
+    def decode_response(self, frame, codec:Codec):
+        """Decodes a response frame, END_OF_STREAM for the frame that ends a stream (StreamError when the view failed)."""
+        sessionid, serialized_payload = frame.payload.split(b'|', 1)
+        self.sessionid = sessionid.decode('utf-8')
+        if frame.flags & FLAG_END:
+            if serialized_payload:
+                error = self.decode_payload(serialized_payload, frame.flags, codec)
+                raise StreamError(error.get("error") if isinstance(error, dict) else error)
+            return END_OF_STREAM
+        return self.decode_payload(serialized_payload, frame.flags, codec)
+
+    def handel_request(self, request, flags:int=FLAGS_NONE):
         try:
             view, serialized_data = request.split(b"|", 1)
             view = view.decode()
-            data = json.loads(serialized_data)
+            data = self.decode_payload(serialized_data, flags, self.codec)
             if view in self.mapping:
                 self.mapping[view](**data)
             else:
@@ -66,17 +118,58 @@ class ConnectionInterface:
                 return self.establish_connection(dump)
         else:
             try:
-                self.main_sock = socket(AF_INET, SOCK_STREAM)
-                # secure a session
-                self.main_sock.connect((self.host, self.port))
-                self.main_sock.send(b"00003_||")
-                self.sessionid = self.main_sock.recv(int(self.main_sock.recv(5))).decode('utf-8')
+                frame = self.main_handshake()
+                while frame.frame_type == FRAME_BUSY: # over the server's connection caps
+                    retry_after_ms = RETRY_AFTER.unpack_from(frame.payload)[0]
+                    print(f"[Establish_Connection] Server busy; re-establish connection in {retry_after_ms} ms")
+                    self.main_sock.close()
+                    time.sleep(retry_after_ms / 1000)
+                    frame = self.main_handshake()
+                if frame.version >= FRAME_VERSION: # server upgraded the connection
+                    sessionid, options = frame.payload.split(b'|', 1)
+                    self.frame_version, self.codec, self.compression_context = self.negotiated(json.loads(options))
+                else: # legacy server
+                    sessionid = frame.payload
+                    self.frame_version, self.codec, self.compression_context = 1, JSON_CODEC, None
+                self.sessionid = sessionid.decode('utf-8')
                 print("[Establish_Connection] Connection Stable", "sessionid:", self.sessionid)
             except (ConnectionAbortedError, ConnectionError, ConnectionRefusedError, ConnectionResetError):
                 print("[Establish_Connection] Failed to connect with the server; re-establish connection in one second")
                 time.sleep(1)
                 self.establish_connection()
 
+    def main_handshake(self):
+        self.main_sock = socket(AF_INET, SOCK_STREAM)
+        # secure a session
+        self.main_sock.connect((self.host, self.port))
+        # NOTE a session id from before (reconnecting, server restarted) is kept if its signature still holds
+        handshake = b"_|" + self.sessionid.encode('utf-8') + b"|" + self.handshake_options()
+        self.main_sock.send(content_length(len(handshake))+handshake)
+        return recv_frame(self.main_sock)
+
+    def handshake_options(self):
+        return handshake_options(
+            frame_version=FRAME_VERSION, codecs=supported_codecs(self.codecs),
+            compression=[name for name in self.compression if name in COMPRESSIONS], compression_stream=True
+        )
+
+    def negotiated(self, options:dict):
+        """Returns (frame_version, codec, compression context) from the server's handshake reply."""
+        compression = COMPRESSIONS.get(options.get("compression"))
+        if compression:
+            self.compression_threshold = options.get("compression_threshold", self.compression_threshold)
+            compression = compression.context(options.get("compression_stream", False), MAX_FRAME_PAYLOAD)
+        return options.get("frame_version", 1), CODECS.get(options.get("codec"), JSON_CODEC), compression
+
+    @staticmethod
+    def inflate(frame, compression):
+        # NOTE streaming contexts share state across frames, call this in the order frames were received
+        if frame.flags & FLAG_COMPRESSED:
+            if compression is None:
+                raise FrameError("InvalidFrame: compressed frame on a connection without compression")
+            frame.payload = compression.decompress(frame.payload)
+        return frame
+
     def receiver(self):
         while True:
             if not self.main_sock:
@@ -90,7 +183,8 @@ class ConnectionInterface:
                     request = self.receive_package()
                     if request:
                         print("[Receiver] Server-side request detected")
-                        self.handel_request(request)
+                        self.inflate(request, self.compression_context)
+                        self.handel_request(request.payload, request.flags)
                     else:
                         print("[Receiver] Empty package passed to the receiver; re-establish connection")
                         self.establish_connection()
@@ -98,27 +192,149 @@ class ConnectionInterface:
                 traceback.print_exc()
                 print("[Receiver] Unexpected Error")
 
-    def recv_response(self, sock):
+    def recv_response(self, sock, codec:Codec=JSON_CODEC, compression=None):
         try:
-            data = self.receive_package(sock=sock)
-            if data:
-                sessionid, serialized_payload = data.split(b'|', 1)
-                return sessionid.decode('utf-8'), json.loads(serialized_payload)
+            frame = self.receive_package(sock=sock)
+            if frame:
+                check_busy(frame)
+                response = self.decode_response(self.inflate(frame, compression), codec)
+                if frame.flags & FLAG_STREAM: # streaming view, collect its items
+                    items = []
+                    while response is not END_OF_STREAM:
+                        items.append(response)
+                        frame = self.receive_package(sock=sock)
+                        if frame is None:
+                            raise ConnectionError("stream connection closed")
+                        response = self.decode_response(self.inflate(frame, compression), codec)
+                    response = items
+                return self.sessionid, response
             else:
                 print("- Server connection closed")
                 return self.sessionid, None
+        except (ServerBusy, StreamError):
+            raise
         except:
             traceback.print_exc()
 
-    def send_request(self, view_name, payload=''):
+    def open_negotiated(self):
+        """Opens a socket and negotiates its codec & compression, without registering it as a receiver."""
+        sock = self.establish_connection(dump=True)
+        sock.sendall(frame_message(self.handshake_options(), FRAME_VERSION, FRAME_HANDSHAKE))
         try:
-            serialized_data = json.dumps(payload).encode('utf-8')
-            message = f"{view_name}|{self.sessionid}|".encode()+serialized_data
-            sock = self.establish_connection(dump=True)
-            sock.send(content_length(len(message))+message)
-            self.sessionid, payload = self.recv_response(sock)
+            frame = check_busy(recv_frame(sock))
+        except ServerBusy:
+            sock.close()
+            raise
+        _, codec, compression = self.negotiated(json.loads(frame.payload))
+        return sock, codec, compression
+
+    def open_pipeline(self):
+        # one long-lived socket shared by every pipelined request, responses are matched by request id
+        sock, self.pipeline_codec, self.pipeline_compression = self.open_negotiated()
+        self.pipeline_sock = sock
+        thread = threading.Thread(target=self.pipeline_receiver, args=(sock,), daemon=True)
+        thread.start()
+        return sock
+
+    def pipeline_receiver(self, sock):
+        streamed = dict() # request id -> items received so far, for streaming views
+        try:
+            while True:
+                frame = recv_frame(sock)
+                if frame is None:
+                    print("[Pipeline] Server connection closed")
+                    break
+                self.inflate(frame, self.pipeline_compression)
+                with self.pipeline_lock:
+                    if frame.flags & FLAG_STREAM and not frame.flags & FLAG_END: # more frames to come
+                        future = self.pending_requests.get(frame.request_id)
+                    else:
+                        future = self.pending_requests.pop(frame.request_id, None)
+                if future is None:
+                    print(f"[Pipeline] Response for unknown request {frame.request_id} dropped")
+                    continue
+                try:
+                    check_busy(frame)
+                    response = self.decode_response(frame, self.pipeline_codec)
+                    if frame.flags & FLAG_STREAM: # streaming view, resolved with all of its items
+                        if response is not END_OF_STREAM:
+                            streamed.setdefault(frame.request_id, []).append(response)
+                            continue
+                        response = streamed.pop(frame.request_id, [])
+                    future.set_result(response)
+                except Exception as e:
+                    streamed.pop(frame.request_id, None)
+                    future.set_exception(e)
+        except Exception:
+            traceback.print_exc()
+            print("[Pipeline] Unexpected error")
+        finally:
+            # fail whatever was still waiting on this socket, the next submit opens a new one
+            with self.pipeline_lock:
+                if self.pipeline_sock is sock:
+                    self.pipeline_sock = None
+                pending, self.pending_requests = self.pending_requests, dict()
+            for future in pending.values():
+                future.set_exception(ConnectionError("pipeline connection closed"))
+            sock.close()
+
+    def submit(self, view_name, payload='', deadline:float=None) -> Future:
+        """
+        Sends a pipelined request and returns a future resolved with its response.
+        With a `deadline` (seconds) the server cancels the view once it passes, nobody waits for it anymore.
+        """
+        return self.pipeline_send(f"{view_name}|{self.sessionid}|", payload, deadline=deadline)
+
+    def submit_batch(self, calls:list, deadline:float=None) -> Future:
+        """Sends a pipelined batch frame and returns a future resolved with its raw result items."""
+        return self.pipeline_send(f"{self.sessionid}|", calls, FRAME_BATCH, deadline)
+
+    def pipeline_send(self, head:str, payload, frame_type:int=FRAME_REQUEST, deadline:float=None) -> Future:
+        future = Future()
+        with self.pipeline_lock:
+            sock = self.pipeline_sock or self.open_pipeline()
+            serialized_data = self.pipeline_codec.encode(payload)
+            self.request_counter = (self.request_counter + 1) % (MAX_REQUEST_ID + 1)
+            request_id = self.request_counter
+            self.pending_requests[request_id] = future
+            message = head.encode()+serialized_data
+            flags = FLAGS_NONE
+            if self.pipeline_compression and len(message) >= self.compression_threshold:
+                message, flags = self.pipeline_compression.compress(message), FLAG_COMPRESSED
+            deadline_ms = int(deadline * 1000) if deadline is not None else None
+            sock.sendall(frame_message(message, FRAME_VERSION, frame_type, flags, request_id, deadline_ms))
+        return future
+
+    def dump_request(self, message:bytes, frame_type:int=FRAME_REQUEST):
+        # one request on a socket of its own (not pipelined)
+        sock = self.establish_connection(dump=True)
+        try:
+            sock.sendall(self.frame(message, frame_type))
+            self.sessionid, response = self.recv_response(sock)
+        finally:
             sock.close()
-            return payload
+        return response
+
+    def retry_busy(self, send):
+        for attempt in range(self.busy_retries + 1):
+            try:
+                return send()
+            except ServerBusy as e: # shed by the server, back off as told
+                if attempt == self.busy_retries:
+                    raise
+                time.sleep(e.retry_after_ms / 1000)
+
+    def send_request(self, view_name, payload='', timeout:float=None):
+        def send():
+            if self.pipelined and self.frame_version >= FRAME_VERSION:
+                return self.submit(view_name, payload, timeout).result(timeout)
+            serialized_data = json.dumps(payload).encode('utf-8')
+            return self.dump_request(f"{view_name}|{self.sessionid}|".encode()+serialized_data)
+        try:
+            return self.retry_busy(send)
+        except ServerBusy as e:
+            print(f"[Send-Request] {e} (gave up after {self.busy_retries} retries)")
+            return None
         except KeyboardInterrupt:
             print("[Send-Request] KeyboardInterrupt detected; exiting gracefully...")
             sys.exit(0)
@@ -127,9 +343,121 @@ class ConnectionInterface:
             traceback.print_exc()
             print("[Send-Request] Unexpected error")
 
-    def __init__(self, host, port):
+    def stream(self, view_name, payload=''):
+        """
+        Iterates over the items a streaming view yields, as they arrive.
+        The stream gets a socket of its own that is only read as fast as the caller consumes,
+        so a slow consumer slows the view down (TCP backpressure) instead of buffering the result.
+        """
+        if self.frame_version < FRAME_VERSION: # legacy server, the whole output in one response
+            yield from self.send_request(view_name, payload) or ()
+            return
+        sock, codec, compression = self.retry_busy(self.open_negotiated)
+        try:
+            request = frame_message(f"{view_name}|{self.sessionid}|".encode()+codec.encode(payload), FRAME_VERSION, FRAME_REQUEST)
+            for attempt in range(self.busy_retries + 1):
+                sock.sendall(request)
+                frame = recv_frame(sock)
+                if frame is None or frame.frame_type != FRAME_BUSY:
+                    break
+                if attempt == self.busy_retries:
+                    check_busy(frame)
+                time.sleep(RETRY_AFTER.unpack_from(frame.payload)[0] / 1000)
+            while True:
+                if frame is None:
+                    raise ConnectionError("stream connection closed")
+                item = self.decode_response(self.inflate(frame, compression), codec)
+                if item is END_OF_STREAM:
+                    return
+                yield item
+                if not frame.flags & FLAG_STREAM: # not a streaming view, its response is the only item
+                    return
+                frame = recv_frame(sock)
+        finally:
+            sock.close()
+
+    def upload(self, view_name, body, payload='', chunk_size:int=65536):
+        """
+        Calls a view with a streamed request body, read on the server side from `request.body` as it arrives.
+        `body` is bytes, a binary file object or an iterable of bytes chunks, sent `chunk_size` bytes per frame.
+        NOTE the body can't be replayed, a request the server sheds raises ServerBusy instead of being retried
+        """
+        if self.frame_version < FRAME_VERSION:
+            print("[Upload] Error: streamed request bodies need a v2 server")
+            return None
+        try:
+            sock, codec, compression = self.retry_busy(self.open_negotiated)
+            try:
+                def send(message, frame_type:int, flags:int=FLAGS_NONE):
+                    if compression and len(message) >= self.compression_threshold:
+                        message, flags = compression.compress(message), flags | FLAG_COMPRESSED
+                    sock.sendall(frame_message(message, FRAME_VERSION, frame_type, flags))
+                send(f"{view_name}|{self.sessionid}|".encode()+codec.encode(payload), FRAME_REQUEST, FLAG_STREAM)
+                for chunk in iter_chunks(body, chunk_size):
+                    if chunk:
+                        send(chunk, FRAME_BODY)
+                send(b'', FRAME_BODY, FLAG_END)
+                self.sessionid, response = self.recv_response(sock, codec, compression)
+                return response
+            finally:
+                sock.close()
+        except ServerBusy:
+            raise
+        except KeyboardInterrupt:
+            print("[Upload] KeyboardInterrupt detected; exiting gracefully...")
+            sys.exit(0)
+        except Exception as e:
+            print(f"[Upload] Error: {str(e)}")
+            traceback.print_exc()
+            print("[Upload] Unexpected error")
+
+    def send_batch(self, calls, timeout:float=None):
+        """
+        Runs several views in one round trip, `calls` is a list of (view_name, payload) pairs.
+        Returns their responses in order, a call that failed on the server comes back as a BatchCallError.
+        """
+        calls = [[view_name, payload] for view_name, payload in calls]
+        if self.frame_version < FRAME_VERSION: # legacy server, no batch frames
+            return [self.send_request(view_name, payload, timeout) for view_name, payload in calls]
+        def send():
+            if self.pipelined:
+                return self.submit_batch(calls, timeout).result(timeout)
+            return self.dump_request(f"{self.sessionid}|".encode()+json.dumps(calls).encode('utf-8'), FRAME_BATCH)
+        try:
+            response = self.retry_busy(send)
+            if not isinstance(response, list): # rejected as a whole (too large, invalid)
+                print(f"[Send-Batch] Error: {response.get('response') if isinstance(response, dict) else response}")
+                return None
+            return [item["response"] if "response" in item else BatchCallError(item.get("error")) for item in response]
+        except ServerBusy as e:
+            print(f"[Send-Batch] {e} (gave up after {self.busy_retries} retries)")
+            return None
+        except KeyboardInterrupt:
+            print("[Send-Batch] KeyboardInterrupt detected; exiting gracefully...")
+            sys.exit(0)
+        except Exception as e:
+            print(f"[Send-Batch] Error: {str(e)}")
+            traceback.print_exc()
+            print("[Send-Batch] Unexpected error")
+
+    def __init__(self, host, port, pipelined:bool=True, codecs=DEFAULT_PREFERENCES, compression=("zlib",), busy_retries:int=3):
         try:
             self.sessionid = ''
+            self.frame_version = 1 # negotiated during the handshake
+            self.codecs = codecs # codec preferences, first one the server supports wins
+            self.codec = JSON_CODEC
+            self.pipeline_codec = JSON_CODEC
+            self.compression = compression # compression preferences, empty to disable
+            self.compression_context = None # per socket, streaming contexts can't be shared
+            self.pipeline_compression = None
+            self.compression_threshold = 1024
+            self.busy_retries = busy_retries # retries of requests the server shed (ServerBusy)
+            # pipelining (v2 servers only): requests share one socket instead of a socket per call
+            self.pipelined = pipelined
+            self.pipeline_sock = None
+            self.pipeline_lock = threading.Lock()
+            self.pending_requests = dict() # request id -> Future
+            self.request_counter = 0
             self.mapping = dict()
             self.main_sock = None
             if host == 'localhost':
@@ -1,6 +1,7 @@
 from datetime import date, time, datetime
 import sqlite3, aiosqlite
-from asyncio import Queue
+from asyncio import Queue, CancelledError
+from contextlib import asynccontextmanager
 import mysql.connector
 import logging
 import types
@@ -343,7 +344,7 @@ class AsyncTableSQLite(TableSQLite):
         if isinstance(fetch, int): L = f'LIMIT {fetch}'
         else: L = ''
         conn:aiosqlite.Connection = await self.db_obj.pool.get_connection()
-        async with conn.cursor() as cursor:
+        async with self.db_obj.pool.cursor(conn) as cursor:
             try:
                 await cursor.execute(f"""SELECT {', '.join(columns)} FROM {table}\n{W}\n{L};""")
                 if fetch:
@@ -352,6 +353,9 @@ class AsyncTableSQLite(TableSQLite):
                 else:
                     response = bool(await cursor.fetchone())
                     return response
+            except CancelledError: # caller gave up (deadline, client gone), stop the query instead of finishing it
+                await conn.interrupt()
+                raise
             finally:
                 await self.db_obj.pool.release_connection(conn)
     
@@ -371,7 +375,7 @@ class AsyncTableSQLite(TableSQLite):
         key = ", ".join(data_keys)
         val = list(data.values())
         conn:aiosqlite.Connection = await self.db_obj.pool.get_connection()
-        async with conn.cursor() as cursor:
+        async with self.db_obj.pool.cursor(conn) as cursor:
             try:
                 await cursor.execute(f"""INSERT INTO {table} ({key}) VALUES ({", ".join(['?'] * len(val))});""", tuple(val))
                 await conn.commit()
@@ -379,6 +383,9 @@ class AsyncTableSQLite(TableSQLite):
                 return inserted_id
             except aiosqlite.Error:
                 return False  # Insertion failed
+            except CancelledError: # caller gave up (deadline, client gone), stop the query instead of finishing it
+                await conn.interrupt()
+                raise
             finally:
                 await self.db_obj.pool.release_connection(conn)
 
@@ -387,13 +394,16 @@ class AsyncTableSQLite(TableSQLite):
         if where: query = f'DELETE FROM {table} WHERE {where};'
         else: query = f'DELETE FROM {table};'
         conn:aiosqlite.Connection = await self.db_obj.pool.get_connection()
-        async with conn.cursor() as cursor:
+        async with self.db_obj.pool.cursor(conn) as cursor:
             try:
                 await cursor.execute(query)
                 await conn.commit()
                 return True
             except aiosqlite.Error:
                 return False # signal error
+            except CancelledError: # caller gave up (deadline, client gone), stop the query instead of finishing it
+                await conn.interrupt()
+                raise
             finally:
                 await self.db_obj.pool.release_connection(conn)
 
@@ -406,18 +416,21 @@ class AsyncTableSQLite(TableSQLite):
         W = f'WHERE {where}' if where else ''
         query = f"UPDATE {table} SET {S} {W};"
         conn:aiosqlite.Connection = await self.db_obj.pool.get_connection()
-        async with conn.cursor() as cursor:
+        async with self.db_obj.pool.cursor(conn) as cursor:
             try:
                 await cursor.execute(query, tuple(params))
                 await conn.commit()
             except aiosqlite.Error:
                 return False # signal error
+            except CancelledError: # caller gave up (deadline, client gone), stop the query instead of finishing it
+                await conn.interrupt()
+                raise
             finally:
                 await self.db_obj.pool.release_connection(conn)
     
     async def ExecScript(self, script:str, params:tuple) -> bool:
         conn:aiosqlite.Connection = await self.db_obj.pool.get_connection()
-        async with conn.cursor() as cursor:
+        async with self.db_obj.pool.cursor(conn) as cursor:
             try:
                 await cursor.execute(script, params)
                 await conn.commit()
@@ -425,6 +438,9 @@ class AsyncTableSQLite(TableSQLite):
                 return inserted_id
             except aiosqlite.Error as e:
                 return False  # Insertion failed
+            except CancelledError: # caller gave up (deadline, client gone), stop the query instead of finishing it
+                await conn.interrupt()
+                raise
             finally:
                 await self.db_obj.pool.release_connection(conn)
 
@@ -458,6 +474,17 @@ class SQLiteConnectionPool(ConnectionPool):
             conn = await self.pool.get()
         return conn
 
+    @asynccontextmanager
+    async def cursor(self, conn:aiosqlite.Connection):
+        # same as conn.cursor(), except a caller cancelled before its own try block still gives the connection back
+        try:
+            cursor = await conn.cursor()
+        except CancelledError:
+            await self.release_connection(conn)
+            raise
+        async with cursor:
+            yield cursor
+
     async def release_connection(self, conn:aiosqlite.Connection):
         if self.pool.full() and (conn in self.temp_conns):
             self.temp_conns.remove(conn)
@@ -2,16 +2,81 @@ import asyncio
 import threading
 import logging
 import json
+import time
+import inspect
+import traceback
 from socket import gethostname, gethostbyname
-from Fluxon.Routing import Setup
+from Fluxon.Routing import Setup, SESSIONS, SESSION_TOKENS, USER_CACHE, RESPONSE_CACHE, SINGLE_FLIGHT, VIEW_EXECUTORS, VIEW_SCHEDULER
 from Fluxon.Database.db_core_interface import AsyncSQLiteDatabase
-from Endpoint.server_utils import content_length
+from Fluxon.Endpoint.session_snapshot import SnapshotError
+from Fluxon.Protocol import (
+    Frame, FrameError, frame_message, negotiate_frame_version, handshake_options, split_request,
+    FRAME_VERSION, FRAME_RESPONSE, FRAME_HANDSHAKE, FRAME_BUSY, FRAME_BATCH, FRAME_BODY,
+    FLAGS_NONE, FLAG_RAW, FLAG_COMPRESSED, FLAG_STREAM, FLAG_END, RETRY_AFTER, MAX_FRAME_PAYLOAD
+)
+from Fluxon.Codecs import Codec, CodecError, Raw, Encoded, negotiate_codec, negotiate_compression, JSON_CODEC
+from Fluxon.Metrics import Stats
+from Endpoint.timer_wheel import TimerWheel, TimerEntry
 from Endpoint.async_server import AsyncServer
 
+DEADLINE_EXCEEDED = object() # within_deadline result of a view cancelled past the client's deadline
+DEADLINE_EXCEEDED_RESPONSE = {"response": "DeadlineExceeded: the view was cancelled, the client's deadline passed"}
+
+class DeadlineExceeded(Exception):
+    """Ends a streaming view still producing past the client's deadline."""
+    pass
+
+class RequestBody:
+    """
+    Streamed request body (`request.body`), an async iterator of bytes chunks.
+    Chunks are read off the connection only as the view asks for them, so the upload is never held as a whole
+    and a view that stops reading stops the client (flow control) instead of filling the server's memory.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.done = False
+        self.received = 0 # bytes
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        while not self.done:
+            frame = await self.connection.read_frame()
+            if frame is None:
+                self.done = True
+                raise ConnectionResetError("Connection lost in the middle of a request body")
+            if frame.frame_type != FRAME_BODY:
+                self.done = True
+                raise FrameError(f"InvalidFrame: frame type {frame.frame_type} in the middle of a request body")
+            if frame.flags & FLAG_COMPRESSED:
+                self.connection.server.inflate_frame(frame, self.connection)
+            self.done = bool(frame.flags & FLAG_END)
+            if frame.payload:
+                self.received += len(frame.payload)
+                return bytes(frame.payload)
+        raise StopAsyncIteration
+
+    async def lines(self):
+        """Iterates over the body line by line (NDJSON/CSV imports), only the current chunk and a partial line are held."""
+        pending = b''
+        async for chunk in self:
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line
+        if pending:
+            yield pending
+
+    async def discard(self):
+        # skip whatever the view left unread, the next frame starts right after the body
+        async for _ in self:
+            pass
+
 class Server:
     async def stop_server(self): ...
     # FIXME redis all those lookup tables soon as you hop yo ass off that windows
-    SESSION_CONNECTION_LOOKUP = dict()
+    sessions = SESSIONS # session -> connections here, session <-> user for the router (same registry)
     shutdown_event: threading.Event
 
     class AsyncConnection:
@@ -22,62 +87,549 @@ class Server:
             self.server: Server = server
             self.is_receiver_socket = False
             self.sessionid = ''
+            self.frame_version = 1 # upgraded during the `_` handshake
+            self.codec: Codec = JSON_CODEC # negotiated once per connection
+            self.compression = None # negotiated compression context (Codecs.ZlibContext, ...)
+            self.inflight: asyncio.Semaphore = None # pipelined requests cap, created on the first numbered frame
+            self.tasks = set() # pipelined requests in flight
+            # task answering the in-order frames (set by the transport) and whether it is running a view right now
+            self.handler: asyncio.Task = None
+            self.in_view = False
+            self.gone = False # the client dropped (eof or reset)
+            # outgoing frames produced in the same loop iteration, flushed with a single writelines
+            self.outbox = []
+            self.outbox_size = 0
+            self.flush_scheduled = False
+            # admission control (Server.admit_connection)
+            self.admitted = server.admit_connection(peername)
+            # reads the connection's next frame while a view consumes a streamed request body (set by the transport)
+            self.read_frame = None
+            # read/idle/request deadline, tracked by the server's timer wheel
+            self.deadline = TimerEntry(self.timed_out)
+            self.request_started = None # loop time the frame being received started at
+
+        def timed_out(self, reason:str):
+            if reason == "idle" and self.tasks: # pipelined requests still running, not idle
+                self.server.timers.arm(self.deadline, self.server.idle_timeout, "idle")
+                return
+            self.server.stats.incr(f"reaped_{reason}")
+            self.server.logger.debug(f"[Server] Closing {self} | {reason} timeout")
+            self.writer.transport.abort()
+
+        def await_frame(self):
+            # between frames, receiver sockets idle on their own timeout
+            self.request_started = None
+            idle_timeout = self.server.receiver_idle_timeout if self.is_receiver_socket else self.server.idle_timeout
+            self.server.timers.arm(self.deadline, idle_timeout, "idle")
+
+        def frame_progress(self):
+            # called whenever bytes of a frame arrive, pushes the read deadline forward (no reslotting, see TimerWheel)
+            server = self.server
+            now = server.timers.now()
+            if self.request_started is None:
+                self.request_started = now
+            timeout, reason = server.read_timeout, "read"
+            if server.request_timeout is not None:
+                remaining = self.request_started + server.request_timeout - now
+                if timeout is None or remaining < timeout:
+                    timeout, reason = remaining, "request"
+            server.timers.arm(self.deadline, timeout, reason)
+
+        def frame_complete(self):
+            # no deadline while the view runs, await_frame re-arms the idle one afterwards
+            self.request_started = None
+            self.server.timers.disarm(self.deadline)
+
+        def send(self, data:bytes):
+            self.outbox.append(data)
+            self.outbox_size += len(data)
+            if not self.flush_scheduled:
+                self.flush_scheduled = True
+                asyncio.get_running_loop().call_soon(self.flush)
+
+        def flush(self):
+            self.flush_scheduled = False
+            if not self.outbox:
+                return
+            outbox, self.outbox, self.outbox_size = self.outbox, [], 0
+            if self.writer.is_closing():
+                return # connection_lost already ran, nothing to flush to
+            if len(outbox) == 1:
+                self.writer.write(outbox[0])
+            else:
+                self.writer.writelines(outbox)
+            self.server.stats.incr("frames_sent", len(outbox))
+            self.server.stats.incr("write_calls")
+
+        async def drain(self):
+            # NOTE only wait on the socket past the high watermark, the transport resumes us under the low one
+            if self.outbox_size + self.writer.transport.get_write_buffer_size() > self.server.write_high_watermark:
+                self.flush()
+                await self.writer.drain()
 
         def close(self):
-            if self.sessionid in self.server.SESSION_CONNECTION_LOOKUP:
-                if self in self.server.SESSION_CONNECTION_LOOKUP[self.sessionid]:
-                    self.server.SESSION_CONNECTION_LOOKUP[self.sessionid].remove(self)
-                    if not self.server.SESSION_CONNECTION_LOOKUP[self.sessionid]:
-                        del self.server.SESSION_CONNECTION_LOOKUP[self.sessionid]
-                        if self.sessionid in self.server.router.SESSION_USER_LOOKUP:
-                            del self.server.router.SESSION_USER_LOOKUP[self.sessionid]
+            if self.server.sessions.remove_connection(self.sessionid, self): # the session's last connection
+                # logged out once idle for the session idle ttl
+                # NOTE with workers other processes may still serve the session, only its receiver socket ends it
+                logout = self.server.worker_id is None or self.is_receiver_socket
+                self.server.sessions.release(self.sessionid, logout)
+
+        def dropped(self):
+            # client went away, nobody waits for the views still running on its behalf anymore
+            if self.gone:
+                return
+            self.gone = True
+            cancelled = 0
+            for task in self.tasks:
+                cancelled += task.cancel()
+            if self.in_view and self.handler is not None:
+                cancelled += self.handler.cancel()
+            if cancelled:
+                self.server.stats.incr("dropped_views", cancelled)
 
         def __str__(self):
             return f"{self.peername}/{self.sessionid}"
 
-    async def generate_response_async(self, request: bytes, connection:AsyncConnection):
-        view, session, serialized_data = request.split(b"|", 2)
+    def frame_response(self, message:bytes, connection:AsyncConnection, frame:Frame=None, frame_type:int=FRAME_RESPONSE, flags:int=FLAGS_NONE):
+        # answer in the framing the request came in, fall back to the negotiated one
+        version = frame.version if frame else connection.frame_version
+        request_id = frame.request_id if frame else None # pipelined responses echo the request id
+        if version >= FRAME_VERSION and frame_type != FRAME_HANDSHAKE: # handshake replies always go out plain
+            message, flags = self.compress_payload(message, connection, flags)
+        try:
+            return frame_message(message, version, frame_type, flags, request_id)
+        except FrameError as e:
+            self.logger.error(f"[Server] Response to {connection} dropped | {e}")
+            serialized_response = connection.sessionid.encode('utf-8') + b"|" + self.serialize_payload(
+                {"response": "ServerSideError: Response too large for a legacy frame"}, connection.codec
+            )[0]
+            return frame_message(serialized_response, version, frame_type, request_id=request_id)
+
+    def compress_payload(self, message, connection:AsyncConnection, flags:int=FLAGS_NONE):
+        """Compresses payloads above `compression_threshold` on connections that negotiated compression."""
+        if connection.compression is None or len(message) < self.compression_threshold:
+            return message, flags
+        started = time.thread_time()
+        compressed = connection.compression.compress(message)
+        self.stats.observe("compression_cpu", time.thread_time() - started)
+        self.stats.incr("compressed_frames")
+        self.stats.incr("compression_bytes_in", len(message))
+        self.stats.incr("compression_bytes_out", len(compressed))
+        return compressed, flags | FLAG_COMPRESSED
+
+    def inflate_frame(self, frame:Frame, connection:AsyncConnection):
+        # NOTE called in wire order (before pipelined requests fan out), streaming contexts depend on it
+        if connection.compression is None:
+            raise CodecError("InvalidPayload: compressed frame on a connection without compression")
+        started = time.thread_time()
+        frame.payload = connection.compression.decompress(frame.payload)
+        frame.flags &= ~FLAG_COMPRESSED
+        self.stats.observe("decompression_cpu", time.thread_time() - started)
+
+    def stats_snapshot(self) -> dict:
+        snapshot = self.stats.snapshot()
+        snapshot["compression_ratio"] = self.stats.ratio("compression_bytes_out", "compression_bytes_in")
+        snapshot["frames_per_write"] = self.stats.ratio("frames_sent", "write_calls")
+        snapshot.update(connections=self.connections_count, inflight_requests=self.inflight_requests)
+        snapshot["user_cache"] = USER_CACHE.snapshot()
+        snapshot["response_cache"] = RESPONSE_CACHE.snapshot()
+        snapshot["single_flight"] = SINGLE_FLIGHT.snapshot()
+        snapshot["executors"] = VIEW_EXECUTORS.snapshot()
+        snapshot["scheduler"] = VIEW_SCHEDULER.snapshot()
+        snapshot["sessions"] = SESSIONS.snapshot()
+        snapshot["session_tokens"] = SESSION_TOKENS.snapshot()
+        if self.router is not None and self.router.session_snapshot is not None:
+            snapshot["session_snapshot"] = self.router.session_snapshot.snapshot()
+        if self.router is not None and self.router.middlewares:
+            snapshot["middleware"] = self.router.middleware_report()
+        return snapshot
+
+    # session expiry
+
+    def sweep_sessions(self):
+        try:
+            self.sessions.sweep(self.session_sweep_batch)
+        except Exception as e:
+            self.logger.error(f"[Server] Session sweep failed: {e}\nTraceback: {traceback.format_exc()}")
+            print(f"[Server] Session sweep failed: {e}")
+        self.session_sweeper = asyncio.get_running_loop().call_later(self.session_sweep_interval, self.sweep_sessions)
+
+    # session snapshots (Setup.session_snapshot), warm restarts keep clients logged in
+
+    def restore_sessions(self):
+        snapshot = self.router.session_snapshot
+        if snapshot is None or not snapshot.attach(self.sessions.store):
+            return
+        started = time.perf_counter()
+        try:
+            restored = snapshot.load()
+        except (OSError, SnapshotError) as e:
+            self.logger.error(f"[Server] Failed to restore sessions from {snapshot.path}: {e}")
+            print(f"[Server] Failed to restore sessions from {snapshot.path}: {e}")
+        else:
+            # NOTE the snapshot doesn't keep when sessions went idle, the restart counts as their last activity
+            self.sessions.release_restored(list(snapshot.store.users))
+            self.logger.info(f"[Server] Restored {restored} sessions from {snapshot.path} in {(time.perf_counter() - started) * 1000:.1f} ms")
+            print(f"[Server] Restored {restored} sessions from {snapshot.path} in {(time.perf_counter() - started) * 1000:.1f} ms")
+        self.session_snapshotter = asyncio.get_running_loop().call_later(snapshot.interval, self.snapshot_sessions)
+
+    def snapshot_sessions(self):
+        snapshot = self.router.session_snapshot
+        try:
+            snapshot.flush()
+            if self.session_compaction is None and snapshot.journal_size() > snapshot.compact_bytes:
+                # NOTE the copy is taken here, only the file is written by the executor
+                self.session_compaction = asyncio.get_running_loop().run_in_executor(None, snapshot.write, snapshot.capture())
+                self.session_compaction.add_done_callback(self.sessions_compacted)
+        except Exception as e:
+            self.logger.error(f"[Server] Session snapshot failed: {e}\nTraceback: {traceback.format_exc()}")
+            print(f"[Server] Session snapshot failed: {e}")
+        self.session_snapshotter = asyncio.get_running_loop().call_later(snapshot.interval, self.snapshot_sessions)
+
+    def sessions_compacted(self, future:asyncio.Future):
+        self.session_compaction = None
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error(f"[Server] Session snapshot failed: {future.exception()}")
+            print(f"[Server] Session snapshot failed: {future.exception()}")
+
+    async def save_sessions(self):
+        snapshot = self.router.session_snapshot
+        if snapshot is None or snapshot.store is None:
+            return
+        if self.session_snapshotter is not None:
+            self.session_snapshotter.cancel()
+        if self.session_compaction is not None: # an older snapshot mustn't land after this one
+            await asyncio.gather(self.session_compaction, return_exceptions=True)
+        try:
+            saved = snapshot.save()
+        except OSError as e:
+            self.logger.error(f"[Server] Failed to save sessions to {snapshot.path}: {e}")
+            print(f"[Server] Failed to save sessions to {snapshot.path}: {e}")
+        else:
+            self.logger.info(f"[Server] Saved {saved} sessions to {snapshot.path}")
+            print(f"[Server] Saved {saved} sessions to {snapshot.path}")
+
+    # admission control & load shedding
+
+    def admit_connection(self, peername) -> bool:
+        ip = peername[0] if peername else None
+        if self.max_connections is not None and self.connections_count >= self.max_connections:
+            self.stats.incr("shed_connections")
+            return False
+        if self.max_connections_per_ip is not None and self.connections_per_ip.get(ip, 0) >= self.max_connections_per_ip:
+            self.stats.incr("shed_connections_per_ip")
+            return False
+        self.connections_count += 1
+        self.connections_per_ip[ip] = self.connections_per_ip.get(ip, 0) + 1
+        return True
+
+    def release_connection(self, connection:AsyncConnection):
+        self.timers.cancel(connection.deadline)
+        if not connection.admitted:
+            return
+        connection.admitted = False # idempotent, closing paths overlap
+        ip = connection.peername[0] if connection.peername else None
+        self.connections_count -= 1
+        self.connections_per_ip[ip] -= 1
+        if not self.connections_per_ip[ip]:
+            del self.connections_per_ip[ip]
+
+    def is_overloaded(self, frame:Frame) -> bool:
+        if self.max_inflight is None or self.inflight_requests < self.max_inflight:
+            return False
+        # handshakes don't run views, never shed them
+        return frame.frame_type != FRAME_HANDSHAKE and bytes(frame.payload[:2]) != b"_|"
+
+    def busy_response(self, connection:AsyncConnection, frame:Frame=None) -> bytes:
+        version = frame.version if frame else connection.frame_version
+        if frame is not None and version < FRAME_VERSION and bytes(frame.payload[:2]) == b"_|":
+            # receiver handshake (always legacy framed), answer in the framing the client asked for
+            try:
+                version = negotiate_frame_version(json.loads(bytes(split_request(frame.payload)[2])))
+            except ValueError:
+                pass
+        if version >= FRAME_VERSION:
+            return frame_message(
+                RETRY_AFTER.pack(self.retry_after_ms), version, FRAME_BUSY,
+                request_id=frame.request_id if frame else None
+            )
+        # legacy peers get an ordinary error response
+        serialized_response = connection.sessionid.encode('utf-8') + b"|" + JSON_CODEC.encode(
+            {"response": "ServerBusy", "retry_after_ms": self.retry_after_ms}
+        )
+        return frame_message(serialized_response, version)
+
+    def deadline_for(self, writer) -> TimerEntry:
+        # standalone deadline for streams without an AsyncConnection (cloud storage)
+        def timed_out(reason:str):
+            self.stats.incr(f"reaped_{reason}")
+            writer.transport.abort()
+        return TimerEntry(timed_out)
+
+    def configure_transport(self, transport:asyncio.Transport):
+        transport.set_write_buffer_limits(high=self.write_high_watermark, low=self.write_low_watermark)
+
+    def serialize_payload(self, payload, codec:Codec):
+        """Returns (body, frame flags) for a view response."""
+        if isinstance(payload, Raw): # already serialized by the view
+            return payload.data, FLAG_RAW
+        if isinstance(payload, Encoded): # response cache hit, encoded with this connection's codec
+            return payload.data, payload.flags
+        try:
+            return codec.encode(payload), FLAGS_NONE
+        except CodecError:
+            self.logger.error(f"NonSerializableResponseError: Failed to serialize {payload}")
+            try:
+                return codec.encode({"response": "ServerSideError: Invalid response"}), FLAGS_NONE
+            except CodecError: # codecs that only carry bytes (raw)
+                return JSON_CODEC.encode({"response": "ServerSideError: Invalid response"}), FLAG_RAW
+
+    async def within_deadline(self, call, deadline:float):
+        """Awaits a view call, cancelled once `deadline` passes (up to a timer wheel tick late), DEADLINE_EXCEEDED then."""
+        remaining = deadline - self.timers.now()
+        if remaining <= 0: # spent its whole budget queued, don't even start it
+            call.close()
+            self.stats.incr("deadline_exceeded")
+            return DEADLINE_EXCEEDED
+        task = asyncio.ensure_future(call)
+        expired = False
+        def timed_out(reason:str):
+            nonlocal expired
+            expired = True
+            task.cancel()
+        entry = TimerEntry(timed_out)
+        self.timers.arm(entry, remaining, "deadline")
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not expired: # client dropped or the server is stopping, nobody to answer
+                raise
+            self.stats.incr("deadline_exceeded")
+            return DEADLINE_EXCEEDED
+        finally:
+            self.timers.cancel(entry)
+
+    async def stream_response(self, stream, connection:AsyncConnection, frame:Frame, deadline:float=None, body:RequestBody=None) -> bytes:
+        """Sends the items of a streaming view (async generator) as they are produced, returns the end of stream frame."""
+        # NOTE backpressure: connection.drain() waits on the socket past write_high_watermark,
+        # so the generator is only resumed once the client caught up (memory tracks the chunk size)
+        self.stats.incr("streams")
+        sessionid = connection.sessionid.encode('utf-8')
+        trailer, flags = b'', FLAGS_NONE
+        try:
+            async for item in stream:
+                serialized_item, item_flags = self.serialize_payload(item, connection.codec)
+                connection.send(self.frame_response(sessionid + b"|" + serialized_item, connection, frame, flags=item_flags | FLAG_STREAM))
+                self.stats.incr("stream_chunks")
+                await connection.drain()
+                if deadline is not None and self.timers.now() > deadline:
+                    self.stats.incr("deadline_exceeded")
+                    raise DeadlineExceeded("the client's deadline passed before the stream ended")
+        except (OSError, ConnectionResetError):
+            raise # client went away, nobody to send the end of stream to
+        except Exception as e:
+            self.logger.error(f"Streaming view failed on connection {connection}: {e}\nTraceback: {traceback.format_exc()}")
+            trailer, flags = self.serialize_payload({"error": f"{type(e).__name__}: {e}"}, connection.codec)
+        finally:
+            await stream.aclose()
+        if body:
+            await body.discard()
+        # NOTE no await past this point, a streaming compressor needs frames written in the order they were compressed
+        return self.frame_response(sessionid + b"|" + trailer, connection, frame, flags=flags | FLAG_STREAM | FLAG_END)
+
+    def serialize_batch(self, results:list, codec:Codec):
+        """Same as serialize_payload for a batch, items that can't be serialized are replaced by an error item."""
+        for index, item in enumerate(results):
+            response = item.get("response")
+            if isinstance(response, Raw): # no frame flag per item, carried as bytes (binary/raw codecs)
+                results[index] = {"response": response.data}
+            elif isinstance(response, Encoded): # cached response, the batch is encoded as a whole
+                results[index] = {"response": response.data if response.flags & FLAG_RAW else codec.decode(response.data)}
+        try:
+            return codec.encode(results), FLAGS_NONE
+        except CodecError:
+            for index, item in enumerate(results):
+                try:
+                    codec.encode(item)
+                except CodecError:
+                    self.logger.error(f"NonSerializableResponseError: Failed to serialize batch item {item}")
+                    results[index] = {"error": "ServerSideError: Invalid response"}
+            return self.serialize_payload(results, codec)
+
+    async def respond_batch(self, request, connection:AsyncConnection, frame:Frame, deadline:float=None):
+        try:
+            session, serialized_calls = bytes(request).split(b"|", 1)
+            calls = connection.codec.decode(serialized_calls)
+        except (ValueError, CodecError):
+            calls = None
+        if not isinstance(calls, list):
+            self.logger.warning(f"Suspicious batch received: {connection} | {bytes(request[:200])}")
+            serialized_payload, flags = self.serialize_payload({"response": "Invalid payload"}, connection.codec)
+        elif len(calls) > self.max_batch_size:
+            serialized_payload, flags = self.serialize_payload(
+                {"response": f"BatchTooLarge: {len(calls)} calls exceeds the batch limit ({self.max_batch_size})"}, connection.codec
+            )
+        else:
+            self.stats.incr("batches")
+            self.stats.incr("batch_calls", len(calls))
+            call = self.router.respond_batch(
+                calls, connection=connection,
+                sessionid=session.decode('utf-8'),
+                concurrency=self.batch_concurrency,
+                deadline=deadline
+            )
+            results = await (self.within_deadline(call, deadline) if deadline is not None else call)
+            if results is DEADLINE_EXCEEDED:
+                serialized_payload, flags = self.serialize_payload(DEADLINE_EXCEEDED_RESPONSE, connection.codec)
+            else:
+                serialized_payload, flags = self.serialize_batch(results, connection.codec)
+        serialized_response = connection.sessionid.encode('utf-8') + b"|" + serialized_payload
+        return self.frame_response(serialized_response, connection, frame, flags=flags)
+
+    def negotiate(self, connection:AsyncConnection, options) -> dict:
+        """Settles the connection's frame version and payload codec from the peer's handshake options."""
+        if not isinstance(options, dict):
+            options = dict()
+        connection.frame_version = negotiate_frame_version(options)
+        negotiated = {"frame_version": connection.frame_version}
+        if connection.frame_version >= FRAME_VERSION: # legacy frames can't flag raw payloads, they stick to JSON
+            connection.codec = negotiate_codec(options.get("codecs"))
+            negotiated["codec"] = connection.codec.name
+            compression = negotiate_compression(options.get("compression")) if self.compression else None
+            if compression:
+                streaming = self.compression_stream and options.get("compression_stream") is True
+                connection.compression = compression.context(streaming, self.max_inflated_size)
+                negotiated.update(
+                    compression=compression.name,
+                    compression_stream=streaming,
+                    compression_threshold=self.compression_threshold
+                )
+        return negotiated
+
+    async def generate_response_async(self, request: bytes, connection:AsyncConnection, frame:Frame=None):
+        if frame and frame.frame_type == FRAME_HANDSHAKE: # negotiation without becoming a receiver socket
+            try:
+                options = json.loads(bytes(request))
+            except json.JSONDecodeError:
+                options = None
+            return self.frame_response(handshake_options(**self.negotiate(connection, options)), connection, frame, FRAME_HANDSHAKE)
+        # NOTE relative to when the frame got here, so time spent in the client's socket buffers isn't counted
+        deadline = self.timers.now() + frame.deadline / 1000 if frame and frame.deadline is not None else None
+        if frame and frame.frame_type == FRAME_BATCH:
+            return await self.respond_batch(request, connection, frame, deadline)
+        view, session, serialized_data = split_request(request)
         if view == b'_': # receiver socket; not a request
             connection.is_receiver_socket = True
             returned_sessionid = ''
-            if connection.sessionid: # look it up
-                if connection.sessionid in self.SESSION_CONNECTION_LOOKUP: # let the dude in
-                    returned_sessionid = connection.sessionid
-                    self.SESSION_CONNECTION_LOOKUP[connection.sessionid].append(connection)
-                else: # make a him a session
-                    returned_sessionid = connection.sessionid
-                    self.SESSION_CONNECTION_LOOKUP[connection.sessionid] = [connection]
+            if connection.sessionid: # let the dude in (his session is made if it isn't there)
+                returned_sessionid = connection.sessionid
+                self.sessions.add_connection(connection.sessionid, connection)
+            elif session and self.router.session_tokens.verify(session.decode('utf-8')): # reconnecting, keeps his session
+                returned_sessionid = connection.sessionid = session.decode('utf-8')
+                self.sessions.add_connection(returned_sessionid, connection)
             else: # make him a sessionid
-                returned_sessionid = self.router.generate_signed_sessionid(connection, self.router.private_key)
+                returned_sessionid = self.router.generate_signed_sessionid(connection, self.router.session_tokens)
             returned_sessionid_ = returned_sessionid.encode('utf-8')
-            return content_length(len(returned_sessionid_))+returned_sessionid_
+            if serialized_data: # handshake options (frame version & codec negotiation)
+                try:
+                    options = json.loads(bytes(serialized_data))
+                except json.JSONDecodeError:
+                    options = None
+                negotiated = self.negotiate(connection, options)
+                if connection.frame_version >= FRAME_VERSION:
+                    return self.frame_response(
+                        returned_sessionid_ + b"|" + handshake_options(**negotiated),
+                        connection, frame_type=FRAME_HANDSHAKE
+                    )
+            return self.frame_response(returned_sessionid_, connection, frame)
         else:
             try:
-                data = json.loads(serialized_data)
-            except json.JSONDecodeError:
-                self.logger.warning(f"Suspicious request received: {connection} | {serialized_data[:200]}") # connection.__str__ returns "ipaddress:port/sessionid" of the far host
-                serialized_payload = json.dumps({"response": "Invalid JSON payload"})
+                data = connection.codec.decode(serialized_data)
+            except CodecError:
+                self.logger.warning(f"Suspicious request received: {connection} | {bytes(serialized_data[:200])}") # connection.__str__ returns "ipaddress:port/sessionid" of the far host
+                serialized_payload, flags = self.serialize_payload({"response": "Invalid payload"}, connection.codec)
                 serialized_response = connection.sessionid.encode('utf-8') + b"|" + serialized_payload
-                return content_length(len(serialized_response))+serialized_response
+                return self.frame_response(serialized_response, connection, frame, flags=flags)
 
-            payload = await self.router.respond(
+            body = RequestBody(connection) if frame and frame.flags & FLAG_STREAM else None
+            call = self.router.respond(
                 view=view.decode('utf-8'), payload=data,
                 connection=connection,
-                sessionid=session.decode('utf-8')
+                sessionid=session.decode('utf-8'),
+                body=body, deadline=deadline
             )
-            try:
-                serialized_payload = json.dumps(payload).encode('utf-8')
-            except:
-                serialized_payload = json.dumps({"response": "ServerSideError: Invalid JSON response"})
-                self.logger.error(f"NonSerializableResponseError: Failed to serialize {payload}")
+            payload = await (self.within_deadline(call, deadline) if deadline is not None else call)
+            if payload is DEADLINE_EXCEEDED:
+                payload = DEADLINE_EXCEEDED_RESPONSE
+            if body:
+                self.stats.incr("streamed_bodies")
+            if inspect.isasyncgen(payload): # streaming view
+                if (frame.version if frame else connection.frame_version) >= FRAME_VERSION:
+                    # NOTE Connect.upload only reads once the whole body is sent, a view streaming a large response
+                    # before it consumed its body stalls on both ends
+                    return await self.stream_response(payload, connection, frame, deadline, body)
+                payload = [item async for item in payload] # legacy frames can't be flagged, send the whole thing
+            if body:
+                await body.discard()
+            serialized_payload, flags = self.serialize_payload(payload, connection.codec)
             serialized_response = connection.sessionid.encode('utf-8') + b"|" + serialized_payload
-            return content_length(len(serialized_response))+serialized_response
+            return self.frame_response(serialized_response, connection, frame, flags=flags)
 
-    def __init__(self, port:int, secure:bool, setup:Setup=None, cloud_storage=None, host:str=gethostbyname(gethostname())):
+    def __init__(self, port:int, secure:bool, setup:Setup=None, cloud_storage=None, host:str=gethostbyname(gethostname()), transport:str="stream", pipeline_limit:int=32,
+                 max_frame_size:int=16*1024*1024,
+                 compression:bool=True, compression_threshold:int=1024, compression_stream:bool=True, max_inflated_size:int=None,
+                 write_high_watermark:int=256*1024, write_low_watermark:int=64*1024,
+                 max_connections:int=None, max_connections_per_ip:int=None, max_inflight:int=None, retry_after_ms:int=100,
+                 idle_timeout:float=60, receiver_idle_timeout:float=None, read_timeout:float=60, request_timeout:float=None,
+                 timer_resolution:float=0.5, max_batch_size:int=64, batch_concurrency:int=8,
+                 session_sweep_interval:float=1.0, session_sweep_batch:int=1000):
         self.port = port
         self.host = host
         self.secure = secure
         self.router = setup
+        if transport not in ("stream", "buffered"):
+            raise ValueError(f"[Server] transport should be 'stream' or 'buffered' not {transport!r}")
+        self.transport = transport
+        self.pipeline_limit = pipeline_limit # max concurrent pipelined requests per connection
+        # bytes a received frame may declare (extensions included), larger ones get the connection closed before any of it is read
+        # NOTE larger uploads go through streamed request bodies (FLAG_STREAM), one frame per chunk
+        self.max_frame_size = min(max_frame_size, MAX_FRAME_PAYLOAD)
+        # batch frames (FRAME_BATCH), calls per batch and calls of one batch running at once
+        self.max_batch_size = max_batch_size
+        self.batch_concurrency = batch_concurrency
+        # frame compression (v2 connections that ask for it during the handshake)
+        self.compression = compression
+        self.compression_threshold = compression_threshold # bytes, smaller payloads go out as they are
+        self.compression_stream = compression_stream # one compressor per connection, shared across frames
+        # bytes a compressed frame may inflate to, max_frame_size by default
+        self.max_inflated_size = min(max_inflated_size or self.max_frame_size, MAX_FRAME_PAYLOAD)
+        # writes are coalesced per connection, drain only kicks in past the high watermark (bytes)
+        if write_low_watermark > write_high_watermark:
+            raise ValueError(f"[Server] write_low_watermark ({write_low_watermark}) should not exceed write_high_watermark ({write_high_watermark})")
+        self.write_high_watermark = write_high_watermark
+        self.write_low_watermark = write_low_watermark
+        self.stats = Stats()
+        # admission control (None = unlimited), over a cap requests are answered "busy" right away instead of queueing
+        self.max_connections = max_connections
+        self.max_connections_per_ip = max_connections_per_ip
+        self.max_inflight = max_inflight # view executions across all connections
+        self.retry_after_ms = retry_after_ms
+        self.connections_count = 0
+        self.connections_per_ip = dict()
+        self.inflight_requests = 0
+        # connection deadlines (seconds, None = no limit), all served by one timer wheel
+        self.idle_timeout = idle_timeout # between frames
+        self.receiver_idle_timeout = receiver_idle_timeout # between frames on receiver sockets (reverse requests)
+        self.read_timeout = read_timeout # without progress while a frame is being received
+        self.request_timeout = request_timeout # to receive a whole frame
+        self.timers = TimerWheel(timer_resolution)
+        # session expiry (idle & absolute ttl), at most `session_sweep_batch` sessions every `session_sweep_interval` seconds
+        self.session_sweep_interval = session_sweep_interval
+        self.session_sweep_batch = session_sweep_batch
+        self.session_sweeper = None
+        self.session_snapshotter = None
+        self.session_compaction = None # snapshot being written off the loop
+        self.worker_id = None # set in worker processes (server_utils.run_server(server, workers=N))
         if isinstance(self, AsyncServer):
             if cloud_storage:
                 self.cloud_storage = cloud_storage
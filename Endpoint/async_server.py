@@ -8,62 +8,196 @@ import os
 import ssl
 from Endpoint.abstract_server import Server
 from Endpoint.cloud_storage_server import CloudStorageServer
-from Endpoint.server_utils import content_length
+from Endpoint.frame_protocol import FrameProtocol
+from Fluxon.Protocol import (
+    Frame, FrameError, frame_message, unpack_header, parse_legacy_header, extensions_size, read_extensions,
+    FRAME_MAGIC, FRAME_VERSION, FRAME_HEADER_SIZE, LEGACY_HEADER_SIZE,
+    FRAME_REQUEST, FRAME_REVERSE, FRAME_BODY, FLAGS_NONE, FLAG_COMPRESSED, FLAG_STREAM
+)
+from Fluxon.Codecs import CodecError
+
+class StreamProtocol(asyncio.StreamReaderProtocol):
+    # StreamReaderProtocol noticing the client going away even while nothing reads the socket (a view is running)
+    # NOTE not on eof, a client that half-closed after its last request still reads the responses
+    connection = None
+
+    def connection_lost(self, exc):
+        if self.connection:
+            self.connection.dropped()
+        super().connection_lost(exc)
 
 # TODO add an http server, nobody using ts gang 💔🥀
 class AsyncServer(Server):
     cloud_storage: CloudStorageServer
     shutdown_event = threading.Event()
-    async def receive_request(self, reader, peername, buffer_size_limit:int=65536, timeout:int=60):
-        request_content = b''
+    async def receive_request(self, reader, peername, buffer_size_limit:int=65536, connection:Server.AsyncConnection=None):
+        # NOTE no per-read wait_for, the connection's deadline (timer wheel) aborts the transport when it passes
         try:
-            content_length = await asyncio.wait_for(reader.read(5), timeout=timeout)
-            if len(content_length) != 5:
-                return None # corrupted request or a receiver request
-            if not content_length.decode('utf-8').strip().isdigit():
-                self.logger.warning(f"Invalid request format from {peername}")
-                return None
-            content_length = int(content_length)
-            while len(request_content) < content_length:
-                chunk = await asyncio.wait_for(
-                    reader.read(min(content_length - len(request_content), buffer_size_limit)),
-                    timeout=timeout
-                )
-                if not chunk:
-                    self.logger.warning(f"Connection closed unexpectedly by {peername}")
+            if connection:
+                connection.await_frame()
+            first_byte = await reader.read(1)
+            if not first_byte:
+                return None # connection closed or a receiver request
+            if connection:
+                connection.frame_progress()
+            if first_byte[0] == FRAME_MAGIC: # v2 binary header
+                header = first_byte + await reader.readexactly(FRAME_HEADER_SIZE - 1)
+                try:
+                    flags, frame_type, content_length = unpack_header(header) # NOTE rejects lengths shorter than the extensions
+                except FrameError as e:
+                    self.logger.warning(f"Invalid request format from {peername} | {e}")
+                    return 2 # hang up, there's no telling where the next frame starts
+                if content_length > self.max_frame_size:
+                    self.logger.warning(f"Invalid request format from {peername} | FrameTooLarge: {content_length} bytes exceeds max_frame_size ({self.max_frame_size})")
+                    return 2 # hang up, the payload isn't read
+                frame = Frame(b'', FRAME_VERSION, frame_type, flags)
+                extensions_length = extensions_size(flags)
+                if extensions_length:
+                    read_extensions(frame, await reader.readexactly(extensions_length))
+                    content_length -= extensions_length
+            else: # legacy 5-digit header
+                header = first_byte + await reader.readexactly(LEGACY_HEADER_SIZE - 1)
+                content_length = parse_legacy_header(header)
+                if content_length < 0:
+                    self.logger.warning(f"Invalid request format from {peername}")
                     return None
-                request_content += chunk
-            return request_content
-        except asyncio.TimeoutError:
+                frame = Frame(b'', 1, FRAME_REQUEST, FLAGS_NONE)
+            frame.payload = await self.read_payload(reader, peername, content_length, buffer_size_limit, connection)
+            if frame.payload is None:
+                return None
+            if connection:
+                connection.frame_complete()
+            return frame
+        except asyncio.IncompleteReadError:
+            self.logger.warning(f"Connection closed unexpectedly by {peername}")
             return None
         except (OSError, ConnectionResetError):
             return 2
 
+    async def read_payload(self, reader, peername, content_length:int, buffer_size_limit:int=65536, connection:Server.AsyncConnection=None):
+        chunks = []
+        received = 0
+        while received < content_length:
+            chunk = await reader.read(min(content_length - received, buffer_size_limit))
+            if not chunk:
+                self.logger.warning(f"Connection closed unexpectedly by {peername}")
+                return None
+            if connection:
+                connection.frame_progress()
+            chunks.append(chunk)
+            received += len(chunk)
+        return b''.join(chunks)
+
+    async def read_frame(self, reader, connection:Server.AsyncConnection):
+        # next frame of the connection, read by the view itself (streamed request bodies)
+        frame = await self.receive_request(reader, connection.peername, connection=connection)
+        return frame if isinstance(frame, Frame) else None
+
+    async def process_frame(self, frame:Frame, connection:Server.AsyncConnection):
+        generated_response = await self.generate_response_async(frame.payload, connection, frame)
+        if generated_response:
+            connection.send(generated_response)
+            await connection.drain()
+        else:
+            self.logger.warning(f"[AsyncServer] Unable to generate an appropriate response for {connection.peername[0]}")
+            print(f"[AsyncServer] Unable to generate an appropriate response for {connection.peername[0]}")
+
+    async def shed_frame(self, frame:Frame, connection:Server.AsyncConnection, release=None):
+        connection.send(self.busy_response(connection, frame))
+        if release:
+            release(frame)
+        if not connection.admitted: # over a connection cap, answer the first frame and hang up
+            connection.flush()
+            connection.writer.close()
+        await connection.drain()
+
+    async def process_pipelined(self, frame:Frame, connection:Server.AsyncConnection, release=None):
+        try:
+            await self.process_frame(frame, connection)
+        except (OSError, ConnectionResetError):
+            pass # connection dropped while the view was running
+        except Exception as e:
+            # unexpected error handling
+            exception_details = traceback.format_exc()
+            self.logger.error(f"Error while handling pipelined request {frame.request_id} on connection {connection}: {str(e)}\nTraceback: {exception_details}")
+            print(f"UnexpectedError: Error while handling pipelined request {frame.request_id} on connection {connection}: {e}", exception_details, sep="\n")
+        finally:
+            self.inflight_requests -= 1
+            connection.inflight.release()
+            if release:
+                release(frame)
+
+    async def dispatch_frame(self, frame:Frame, connection:Server.AsyncConnection, release=None):
+        # frames without a request id are answered in order, numbered (pipelined) ones run
+        # concurrently up to `pipeline_limit` per connection and are answered as they complete
+        if frame.flags & FLAG_COMPRESSED:
+            try:
+                self.inflate_frame(frame, connection)
+            except CodecError as e:
+                self.logger.warning(f"Invalid request format from {connection} | {e}")
+                if release:
+                    release(frame)
+                return
+        if frame.frame_type == FRAME_BODY: # body of a request that was shed, nobody reads it
+            if release:
+                release(frame)
+            return
+        if not connection.admitted:
+            self.stats.incr("shed_requests")
+            return await self.shed_frame(frame, connection, release)
+        if frame.request_id is None or frame.flags & FLAG_STREAM: # streamed bodies follow their request, handled in order
+            if self.is_overloaded(frame):
+                self.stats.incr("shed_requests")
+                return await self.shed_frame(frame, connection, release)
+            self.inflight_requests += 1
+            connection.in_view = True # cancelled along with the handler if the client drops meanwhile
+            try:
+                await self.process_frame(frame, connection)
+            finally:
+                connection.in_view = False
+                self.inflight_requests -= 1
+                if release:
+                    release(frame)
+            return
+        if connection.inflight is None:
+            connection.inflight = asyncio.Semaphore(self.pipeline_limit)
+        await connection.inflight.acquire() # stop reading new frames while the connection is at its cap
+        if self.is_overloaded(frame):
+            connection.inflight.release()
+            self.stats.incr("shed_requests")
+            return await self.shed_frame(frame, connection, release)
+        self.inflight_requests += 1
+        task = asyncio.create_task(self.process_pipelined(frame, connection, release))
+        connection.tasks.add(task)
+        task.add_done_callback(connection.tasks.discard)
+
     async def handle_request(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
         try:
             far_host_peername = writer.get_extra_info('peername')
+            self.configure_transport(writer.transport)
             connection = self.AsyncConnection(
                 peername=far_host_peername,
                 reader=reader, writer=writer,
                 server=self
             )
+            connection.read_frame = lambda: self.read_frame(reader, connection)
+            connection.handler = asyncio.current_task()
+            if isinstance(writer.transport.get_protocol(), StreamProtocol):
+                writer.transport.get_protocol().connection = connection
             while True:
                 if reader.at_eof():
                     connection.close()
                     break
-                request = await self.receive_request(reader, far_host_peername)
+                request = await self.receive_request(reader, far_host_peername, connection=connection)
                 if request == 2:
                     connection.close()
                     break
-                elif request:
-                    generated_response = await self.generate_response_async(request, connection)
-                    if generated_response:
-                        writer.write(generated_response)
-                        await writer.drain()
-                    else:
-                        self.logger.warning(f"[AsyncServer] Unable to generate an appropriate response for {writer.get_extra_info('peername')[0]}")
-                        print(f"[AsyncServer] Unable to generate an appropriate response for {writer.get_extra_info('peername')[0]}")
+                elif request and request.payload:
+                    await self.dispatch_frame(request, connection)
 
+        except asyncio.CancelledError:
+            if not getattr(locals().get("connection"), "gone", False): # not cancelled by AsyncConnection.dropped
+                raise
         except Exception as e:
             # unexpected error handling
             connection_info = locals().get("connection", "(connection was never initialized)")
@@ -74,6 +208,12 @@ class AsyncServer(Server):
         finally: # edge cases safe (FIXED)
             connection = locals().get("connection", "(connection was never initialized)")
             try:
+                if isinstance(connection, Server.AsyncConnection):
+                    self.release_connection(connection)
+                if getattr(connection, 'tasks', None): # cancelled already if the client dropped, let the others answer
+                    await asyncio.gather(*connection.tasks, return_exceptions=True)
+                if getattr(connection, 'outbox', None):
+                    connection.flush()
                 writer.close()
                 await writer.wait_closed()
                 if hasattr(connection, 'is_receiver_socket'):
@@ -89,34 +229,37 @@ class AsyncServer(Server):
                 print(f"UnexpectedError: Error while closing the connection: {e}", exception_details , sep="\n")
 
     async def stop_server(self):
+        self.timers.close()
+        if self.session_sweeper is not None:
+            self.session_sweeper.cancel()
+        await self.save_sessions()
+        await asyncio.get_running_loop().run_in_executor(None, self.sessions.store.flush) # session writes still in flight
+        self.router.executors.shutdown()
         self.server_stream.close()
         await self.server_stream.wait_closed()
         self.logger.info(f"[AsyncServer] Closing server...")
         print(f"[AsyncServer] Closing server...")
 
     def get_session_by_userid(self, userid):
-        if userid in self.router.SESSION_USER_LOOKUP.values():
-            for key, value in self.router.SESSION_USER_LOOKUP.items():
-                if value == userid:
-                    return key
-        return None
+        return self.sessions.session_of(userid)
 
     async def reverse_request(self, userid, view, data=None):
         try:
             sessionid = self.get_session_by_userid(userid)
             if sessionid:
-                connection = self.SESSION_CONNECTION_LOOKUP[sessionid]
+                connection = self.sessions.first_connection(sessionid) # FIXME receiver sockets held by another worker aren't reachable
                 if connection:
-                    reverse_connection:Server.AsyncConnection = connection[0]
+                    reverse_connection:Server.AsyncConnection = connection
                     # sending reverse request
+                    serialized_data, flags = self.serialize_payload(data, reverse_connection.codec)
+                    message, flags = self.compress_payload(f"{view}|".encode()+serialized_data, reverse_connection, flags)
                     try:
-                        serialized_data = json.dumps(data).encode('utf-8')
-                    except:
-                        serialized_data = json.dumps({"response": "ServerSideError: Invalid response"})
-                        self.logger.error(f"NonSerializableResponseError: Failed to serialize {data}")
-                    message = f"{view}|".encode()+serialized_data
-                    reverse_connection.writer.write(content_length(len(message))+message)
-                    await reverse_connection.writer.drain()
+                        framed_message = frame_message(message, reverse_connection.frame_version, FRAME_REVERSE, flags)
+                    except FrameError as e:
+                        self.logger.error(f"[AsyncServer] Reverse request {view} to {userid} dropped | {e}")
+                        return False
+                    reverse_connection.send(framed_message)
+                    await reverse_connection.drain()
                     return True
                 else:
                     return False
@@ -148,14 +291,24 @@ class AsyncServer(Server):
                     certfile=self.certificatePath, 
                     keyfile=self.privateKeyPath
                 )
-                self.server_stream = await asyncio.start_server(
-                    self.handle_request, self.host,
-                    self.port, ssl=self.context
+            else:
+                self.context = None
+            self.restore_sessions() # before the first client gets in
+            if self.transport == "buffered": # zero-copy frame reassembly (Endpoint.frame_protocol)
+                self.server_stream = await asyncio.get_running_loop().create_server(
+                    lambda: FrameProtocol(self), self.host,
+                    self.port, ssl=self.context,
+                    reuse_port=self.worker_id is not None # workers share the port, the kernel balances connections
                 )
             else:
-                self.server_stream = await asyncio.start_server(
-                    self.handle_request, self.host, self.port
+                loop = asyncio.get_running_loop()
+                self.server_stream = await loop.create_server( # asyncio.start_server, with the drop aware protocol
+                    lambda: StreamProtocol(asyncio.StreamReader(loop=loop), self.handle_request, loop=loop), self.host,
+                    self.port, ssl=self.context,
+                    reuse_port=self.worker_id is not None
                 )
+            if self.session_sweep_interval:
+                self.session_sweeper = asyncio.get_running_loop().call_later(self.session_sweep_interval, self.sweep_sessions)
             self.logger.info(f"[AsyncServer] Server running on {self.host}:{self.port}")
             print(f"[AsyncServer] Server running on {self.host}:{self.port}")
             try: # catches CancelledError when server closed outside the event loop (remotely from "terminate" command)
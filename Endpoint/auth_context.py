@@ -2,20 +2,171 @@ import uuid
 import hmac
 import hashlib
 import base64
+import re
+import time
+from collections import OrderedDict
+from collections.abc import Coroutine
+from Fluxon.Metrics import Stats
 
-def generate_signed_sessionid(connection, private_key):
-    session_id = str(uuid.uuid4())
-    signature = hmac.new(private_key.encode(), session_id.encode(), hashlib.sha256).digest()
-    encoded_signature = base64.urlsafe_b64encode(signature).decode('utf-8').rstrip("=")
-    signed_sessionid = f"{session_id}.{encoded_signature}"
+class SessionTokens:
+    """
+    Signed session ids, "<uuid>.<issued at>.<expires>.<signature>" (unix seconds in hex, HMAC-SHA256 of the rest
+    with the server's private key). Their validity is in the id itself: no session lookup to verify one, and they
+    stay valid across restarts and every worker sharing the key until they expire.
+    Malformed (unsigned) and expired ids are rejected before the HMAC is computed, recently verified ones are
+    remembered (LRU of `cache_size`) so a client's next connections skip it.
+    """
+    def __init__(self, private_key:str=None, ttl:float=7 * 24 * 3600, cache_size:int=10000):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.verified = OrderedDict() # token -> expires
+        self.stats = Stats()
+        self.use_key(private_key)
+
+    def use_key(self, private_key:str):
+        self.key = private_key.encode() if private_key else None
+        self.verified.clear()
+
+    def sign(self, body:str) -> str:
+        signature = hmac.new(self.key, body.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(signature).decode('utf-8').rstrip("=")
+
+    def issue(self) -> str:
+        issued = int(time.time())
+        body = f"{uuid.uuid4()}.{issued:x}.{issued + int(self.ttl):x}"
+        token = f"{body}.{self.sign(body)}"
+        self.remember(token, issued + int(self.ttl))
+        self.stats.incr("issued")
+        return token
+
+    @staticmethod
+    def expires_at(token:str):
+        """Expiry (unix seconds) a token claims, None when it isn't shaped like one. NOTE says nothing about its signature"""
+        parts = token.split(".") if isinstance(token, str) and len(token) <= 128 else ()
+        if len(parts) != 4:
+            return None
+        try:
+            return int(parts[2], 16)
+        except ValueError:
+            return None
+
+    def verify(self, token:str) -> bool:
+        expires = self.expires_at(token)
+        if expires is None:
+            self.stats.incr("rejected_unsigned")
+            return False
+        if expires <= time.time():
+            self.verified.pop(token, None)
+            self.stats.incr("rejected_expired")
+            return False
+        if token in self.verified:
+            self.verified.move_to_end(token)
+            self.stats.incr("cache_hits")
+            return True
+        body, _, signature = token.rpartition(".")
+        if self.key is None or not hmac.compare_digest(self.sign(body), signature):
+            self.stats.incr("rejected_forged")
+            return False
+        self.remember(token, expires)
+        self.stats.incr("verified")
+        return True
+
+    def remember(self, token:str, expires:int):
+        if not self.cache_size:
+            return
+        self.verified[token] = expires
+        while len(self.verified) > self.cache_size:
+            self.verified.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        snapshot = self.stats.snapshot()
+        snapshot.update(cached=len(self.verified), ttl=self.ttl)
+        return snapshot
+
+def generate_signed_sessionid(connection, tokens:SessionTokens):
+    signed_sessionid = tokens.issue()
     # Make sure the sessionid is not already registered
-    if signed_sessionid in connection.server.SESSION_CONNECTION_LOOKUP:
-        return generate_signed_sessionid(connection, private_key)
+    if connection.server.sessions.has_session(signed_sessionid):
+        return generate_signed_sessionid(connection, tokens)
     else:
-        connection.server.SESSION_CONNECTION_LOOKUP[signed_sessionid] = [connection]
+        connection.server.sessions.add_connection(signed_sessionid, connection)
         connection.sessionid = signed_sessionid
         return signed_sessionid
 
+ID_CONDITION = re.compile(r"\s*id\s*=\s*(\d+)\s*")
+
+class UserCache:
+    """
+    Bounded cache of AuthenticatedUser objects keyed by user id, least recently used ones are evicted first
+    and entries expire `ttl` seconds after their lookup.
+    A lookup that started before an invalidation doesn't store its (possibly stale) result, see `generation`.
+    NOTE per process, with workers an Update in one of them reaches the others' caches through the ttl only
+    """
+    def __init__(self, max_size:int=10000, ttl:float=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict() # user id -> (AuthenticatedUser, expires)
+        self.generation = 0 # bumped by every invalidation
+        self.stats = Stats()
+
+    def get(self, userid):
+        self.stats.incr("lookups")
+        entry = self.entries.get(userid)
+        if entry is None:
+            return None
+        user, expires = entry
+        if expires < time.monotonic():
+            del self.entries[userid]
+            self.stats.incr("expired")
+            return None
+        self.entries.move_to_end(userid)
+        self.stats.incr("hits")
+        return user
+
+    def put(self, userid, user, generation:int):
+        if generation != self.generation or not self.max_size:
+            return
+        self.entries[userid] = (user, time.monotonic() + self.ttl)
+        self.entries.move_to_end(userid)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats.incr("evictions")
+
+    def invalidate(self, userid=None):
+        """Drops one user, all of them when `userid` is None."""
+        self.generation += 1
+        self.stats.incr("invalidations")
+        if userid is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(userid, None)
+
+    def invalidate_where(self, where):
+        # `id = 5` conditions drop that user, anything else (or no condition) drops them all
+        match = ID_CONDITION.fullmatch(where) if isinstance(where, str) else None
+        self.invalidate(int(match.group(1)) if match else None)
+
+    def invalidating(self, write):
+        """Wraps the user model's Update/Delete, the users a write touches are dropped once it's done."""
+        def invalidating_write(*args, **kwargs):
+            where = kwargs.get("where", args[0] if args else None)
+            result = write(*args, **kwargs)
+            if isinstance(result, Coroutine): # async database APIs
+                async def invalidate_after():
+                    try:
+                        return await result
+                    finally:
+                        self.invalidate_where(where)
+                return invalidate_after()
+            self.invalidate_where(where)
+            return result
+        return invalidating_write
+
+    def snapshot(self) -> dict:
+        snapshot = self.stats.snapshot()
+        snapshot.update(size=len(self.entries), hit_rate=self.stats.ratio("hits", "lookups"))
+        return snapshot
+
 # abstract user class
 class AuthenticatedUser:
     def __init__(
@@ -68,21 +68,16 @@ class CloudStorageServer(Server):
                 await writer.drain()
     
     async def write_file(self, reader, writer, operation_path, file_data, content_length_count, far_host_peername):
+        deadline = self.deadline_for(writer) # the transport is aborted if the upload stalls past read_timeout
         try:
             async with aiofiles.open(operation_path, 'wb') as file:
                 if file_data:
                     await file.write(file_data)
                 while content_length_count < content_length:
-                    try:
-                        chunk = await asyncio.wait_for(
-                            reader.read(min(content_length - content_length_count, self.buffer_size_limit)),
-                            timeout=self.timeout
-                        )
-                    except asyncio.TimeoutError:
-                        self.logger.error(f"Timeout while reading data from {far_host_peername}")
-                        return None
+                    self.timers.arm(deadline, self.read_timeout, "read")
+                    chunk = await reader.read(min(content_length - content_length_count, self.buffer_size_limit))
                     if not chunk:
-                        self.logger.warning(f"Connection closed unexpectedly by {far_host_peername}")
+                        self.logger.warning(f"Connection closed unexpectedly (or timed out) by {far_host_peername}")
                         return None
                     content_length_count += len(chunk)
                     await file.write(chunk)
@@ -91,6 +86,8 @@ class CloudStorageServer(Server):
             writer.write(b"[CloudStorage] Unable to write file")
             await writer.drain()
             return None
+        finally:
+            self.timers.cancel(deadline)
     
     async def delete_item(
         self,
@@ -266,12 +263,14 @@ class CloudStorageServer(Server):
             )
 
     async def handle_cloud_request(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        deadline = self.deadline_for(writer)
         try:
             # connection details
             far_host_peername = writer.get_extra_info('peername')
             content_length_count = 0
             headers_length = 0
-            content_length = await asyncio.wait_for(reader.read(10), timeout=self.timeout)
+            self.timers.arm(deadline, self.read_timeout, "read")
+            content_length = await reader.read(10)
             if len(content_length) != 10:
                 self.logger.warning(f"Failed to read content length from {far_host_peername}")
                 return None
@@ -280,10 +279,8 @@ class CloudStorageServer(Server):
                 return None
             content_length = int(content_length)
             # read the header chunk
-            header_chunk = await asyncio.wait_for(
-                reader.read(min(content_length - content_length_count, self.buffer_size_limit)),
-                timeout=self.timeout
-            )
+            self.timers.arm(deadline, self.read_timeout, "read")
+            header_chunk = await reader.read(min(content_length - content_length_count, self.buffer_size_limit))
             if not header_chunk:
                 self.logger.warning(f"Connection closed unexpectedly by {far_host_peername}")
                 return None
@@ -303,7 +300,7 @@ class CloudStorageServer(Server):
             print("validation point...")
             # validation & operation id retrieval
             if operation_id := self.cloud_auth_model._validate_operation(
-                user_id=self.main_server.router.SESSION_USER_LOOKUP[session_id], operation=operation
+                user_id=self.main_server.router.sessions.user_of(session_id), operation=operation
             ):
                 print("authenticated...")
                 operation_path = pathlib.Path(self.cloud_folder) / cloud_relative_path
@@ -320,8 +317,6 @@ class CloudStorageServer(Server):
             else:
                 print("authentication error...")
                 writer.write(b"[CloudStorage] AccessDenied:")
-        except asyncio.TimeoutError:
-            return None
         except (OSError, ConnectionResetError):
             self.logger.warning(f"Connection closed unexpectedly by {far_host_peername}")
             return None
@@ -333,6 +328,7 @@ class CloudStorageServer(Server):
             print(f"UnexpectedError: Error while handling request from {far_host_peername}: {e}", exception_details, sep="\n")
         finally:
             # close connection
+            self.timers.cancel(deadline)
             writer.close()
             await writer.wait_closed()
     
@@ -357,7 +353,6 @@ class CloudStorageServer(Server):
 
     async def start_server(self):
         try:
-            self.timeout = 60
             self.buffer_size_limit = 65536
             if self.secure:
                 self.certificatePath = os.path.join(pathlib.Path(__file__).parent, 'Certificates/ssl_tls_certificate.pem')
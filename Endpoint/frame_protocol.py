@@ -0,0 +1,257 @@
+import asyncio
+import collections
+import traceback
+from Fluxon.Protocol import (
+    Frame, FrameError, unpack_header_from, parse_legacy_header, read_extensions,
+    FRAME_MAGIC, FRAME_VERSION, FRAME_HEADER_SIZE, LEGACY_HEADER_SIZE,
+    FRAME_REQUEST, FLAGS_NONE
+)
+
+# Alternate transport for AsyncServer (transport="buffered").
+# Frames are parsed straight out of a preallocated receive buffer and their payloads are handed
+# over as memoryview slices, so a request is never copied or concatenated on its way to the view.
+
+class TransportWriter:
+    """Minimal asyncio.StreamWriter facade, so connections don't care which transport they run on."""
+    def __init__(self, transport:asyncio.Transport, protocol):
+        self.transport = transport
+        self.protocol: FrameProtocol = protocol
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def writelines(self, data):
+        self.transport.writelines(data)
+
+    async def drain(self):
+        await self.protocol.drain()
+
+    def is_closing(self):
+        return self.transport.is_closing()
+
+    def close(self):
+        self.transport.close()
+
+    async def wait_closed(self):
+        await self.protocol.closed
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+class FrameProtocol(asyncio.BufferedProtocol):
+    min_read_size = 4096
+    max_reserve = 1024 * 1024 # bytes reserved ahead of the data received, a declared frame length is only a claim
+    max_queued_frames = 32 # reading pauses past this many unprocessed frames
+
+    def __init__(self, server, buffer_size:int=65536):
+        self.server = server
+        self.buffer = bytearray(buffer_size)
+        self.start = 0 # first unparsed byte
+        self.end = 0 # end of received data
+        self.needed = 0 # size of the frame currently being received (0 when unknown)
+        self.exported = 0 # payload views handed out and not released yet
+        self.frames = collections.deque()
+        self.frames_ready = asyncio.Event()
+        self.reading_paused = False
+        self.writing_paused = False
+        self.drain_waiter = None
+        self.closed = asyncio.get_event_loop().create_future()
+        self.eof = False # the client shut down its sending side, what came in is still answered
+        self.transport = None
+        self.connection = None
+        self.worker = None
+
+    # transport callbacks
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.configure_transport(transport)
+        self.writer = TransportWriter(transport, self)
+        self.connection = self.server.AsyncConnection(
+            peername=transport.get_extra_info('peername'),
+            reader=None, writer=self.writer,
+            server=self.server
+        )
+        self.connection.read_frame = self.next_frame
+        self.worker = asyncio.get_event_loop().create_task(self.process_frames())
+        self.connection.handler = self.worker
+        self.connection.await_frame()
+
+    def get_buffer(self, sizehint):
+        pending = self.end - self.start
+        # NOTE room for the rest of the frame in steps (at most doubling what came in), the payload still lands contiguously
+        wanted = max(min(self.needed - pending, max(pending, self.max_reserve)), sizehint, self.min_read_size)
+        if len(self.buffer) - self.end < wanted:
+            self.reallocate(pending + wanted)
+        return memoryview(self.buffer)[self.end:]
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+        try:
+            self.parse_frames()
+        except FrameError as e:
+            self.server.logger.warning(f"Invalid request format from {self.connection.peername} | {e}")
+            self.transport.close()
+            return
+        if self.end > self.start: # part of a frame is in, the read deadline applies
+            self.connection.frame_progress()
+        elif self.frames: # whole frames only, no deadline until they're processed
+            self.connection.frame_complete()
+
+    def eof_received(self):
+        # NOTE a half-close isn't a drop, process_frames answers the frames already in then closes the transport
+        self.eof = True
+        self.frames_ready.set()
+        return True
+
+    def connection_lost(self, exc):
+        if self.connection:
+            self.connection.dropped()
+        if self.worker:
+            self.worker.cancel()
+        if self.connection:
+            self.connection.close()
+            self.server.release_connection(self.connection)
+        if not self.closed.done():
+            self.closed.set_result(None)
+        if self.drain_waiter and not self.drain_waiter.done():
+            self.drain_waiter.set_result(None)
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        if self.drain_waiter and not self.drain_waiter.done():
+            self.drain_waiter.set_result(None)
+
+    async def drain(self):
+        if self.transport.is_closing():
+            await asyncio.sleep(0) # same as StreamWriter, give connection_lost a chance to run
+            if self.closed.done():
+                raise ConnectionResetError("Connection lost")
+        if self.writing_paused:
+            if self.drain_waiter is None or self.drain_waiter.done(): # shared by concurrent (pipelined) writers
+                self.drain_waiter = asyncio.get_event_loop().create_future()
+            await self.drain_waiter
+
+    # receive buffer management
+
+    def reallocate(self, size:int):
+        pending = self.end - self.start
+        if self.exported or size > len(self.buffer):
+            # never resize or overwrite a buffer that still backs payload views, swap it instead
+            buffer = bytearray(max(size, len(self.buffer) * 2) if size > len(self.buffer) else len(self.buffer))
+            buffer[:pending] = self.buffer[self.start:self.end]
+            self.buffer = buffer
+        else: # compact in place
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+        self.start, self.end = 0, pending
+
+    def release(self, frame:Frame):
+        if isinstance(frame.payload, memoryview): # inflated frames no longer point into the buffer
+            frame.payload.release()
+        self.exported -= 1
+        if not self.exported and self.start == self.end:
+            self.start = self.end = 0 # buffer fully consumed, reuse it from the top
+
+    def parse_frames(self):
+        while True:
+            available = self.end - self.start
+            if not available:
+                self.needed = 0
+                if not self.exported:
+                    self.start = self.end = 0
+                return
+            if self.buffer[self.start] == FRAME_MAGIC: # v2 binary header
+                if available < FRAME_HEADER_SIZE:
+                    self.needed = FRAME_HEADER_SIZE
+                    return
+                flags, frame_type, length = unpack_header_from(self.buffer, self.start) # NOTE rejects lengths shorter than the extensions
+                header_size, version = FRAME_HEADER_SIZE, FRAME_VERSION
+            else: # legacy 5-digit header
+                if available < LEGACY_HEADER_SIZE:
+                    self.needed = LEGACY_HEADER_SIZE
+                    return
+                length = parse_legacy_header(self.buffer[self.start:self.start + LEGACY_HEADER_SIZE])
+                if length < 0:
+                    raise FrameError("InvalidFrame: malformed legacy header")
+                flags, frame_type, header_size, version = FLAGS_NONE, FRAME_REQUEST, LEGACY_HEADER_SIZE, 1
+            if length > self.server.max_frame_size: # before anything is reserved for it
+                raise FrameError(f"FrameTooLarge: {length} bytes exceeds max_frame_size ({self.server.max_frame_size})")
+            frame_size = header_size + length
+            if available < frame_size:
+                # reserve room for the whole frame so the payload lands contiguously
+                self.needed = frame_size
+                return
+            frame = Frame(None, version, frame_type, flags)
+            payload_start = read_extensions(frame, self.buffer, self.start + header_size)
+            frame.payload = memoryview(self.buffer)[payload_start:self.start + frame_size]
+            self.start += frame_size
+            self.exported += 1
+            self.connection.request_started = None
+            self.frame_received(frame)
+
+    def frame_received(self, frame:Frame):
+        self.frames.append(frame)
+        self.frames_ready.set()
+        if len(self.frames) >= self.max_queued_frames and not self.reading_paused:
+            self.reading_paused = True
+            self.transport.pause_reading()
+
+    async def next_frame(self):
+        # frames read by the running view itself (streamed request bodies), process_frames is parked on it meanwhile
+        while not self.frames:
+            if self.transport.is_closing() or self.eof:
+                return None
+            if self.end == self.start: # nothing of the next frame yet
+                self.connection.await_frame()
+            self.frames_ready.clear()
+            await self.frames_ready.wait()
+        frame = self.frames.popleft()
+        if self.reading_paused and len(self.frames) < self.max_queued_frames // 2:
+            self.reading_paused = False
+            self.transport.resume_reading()
+        payload = bytes(frame.payload) # the view may hold on to it, don't pin the receive buffer
+        self.release(frame)
+        frame.payload = payload
+        return frame
+
+    async def process_frames(self):
+        # unnumbered frames are processed in order, same as the StreamReader path
+        while True:
+            await self.frames_ready.wait()
+            while self.frames:
+                frame = self.frames.popleft()
+                try:
+                    if frame.payload:
+                        await self.server.dispatch_frame(frame, self.connection, self.release)
+                    else:
+                        self.release(frame)
+                except (OSError, ConnectionResetError):
+                    self.transport.close()
+                    return
+                except Exception as e:
+                    # unexpected error handling
+                    exception_details = traceback.format_exc()
+                    self.server.logger.error(f"Error while handling request from {self.connection.peername} on connection {self.connection}: {str(e)}\nTraceback: {exception_details}")
+                    print(f"UnexpectedError: Error while handling request from {self.connection.peername} on connection {self.connection}: {e}", exception_details, sep="\n")
+                    self.transport.close()
+                    return
+                if not self.frames and self.end == self.start: # nothing buffered, back to the idle deadline
+                    self.connection.await_frame()
+                if self.reading_paused and len(self.frames) < self.max_queued_frames // 2:
+                    self.reading_paused = False
+                    self.transport.resume_reading()
+            if self.eof:
+                await self.hang_up()
+                return
+            self.frames_ready.clear()
+
+    async def hang_up(self):
+        # client half-closed, the pipelined views still running answer before the transport is closed
+        if self.connection.tasks:
+            await asyncio.gather(*self.connection.tasks, return_exceptions=True)
+        if self.connection.outbox:
+            self.connection.flush()
+        self.transport.close()
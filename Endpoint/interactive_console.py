@@ -1,4 +1,5 @@
 import os
+import asyncio
 import traceback
 import sqlite3
 import logging
@@ -6,6 +7,12 @@ from Fluxon.Database.db_models_parser import ModelsParser, wipe_sqlite_database,
 from Endpoint.async_server import AsyncServer
 from Endpoint.server_utils import console_server_terminate
 
+def on_server_loop(shared_data:dict, function):
+    # runs `function` on the server's event loop (the session registry isn't thread safe) and waits for it
+    async def call():
+        return function()
+    return asyncio.run_coroutine_threadsafe(call(), shared_data["event_loop"]).result(timeout=10)
+
 def interactive_console(server:AsyncServer, shared_data:dict, logger:logging.Logger):
     # NOTE this function runs in a separate thread
     while True:
@@ -50,7 +57,25 @@ def interactive_console(server:AsyncServer, shared_data:dict, logger:logging.Log
                     conn.commit()
                     conn.close()
                     logger.info("[Fluxon-Console] Schema has been updated successfully")
-                    print(f"Schema updated successfully... ({"0"*(5-len(str(number)))+str(number)})")
+                    print(f"Schema updated successfully... ({'0'*(5-len(str(number)))+str(number)})")
+            elif command.lower() == "stats":
+                for name, value in server.stats_snapshot().items():
+                    print(f"{name}: {value}")
+            elif command.lower() == "sessions":
+                for name, value in on_server_loop(shared_data, server.sessions.report).items():
+                    print(f"{name}: {value}")
+            elif command.lower() == "resetstats":
+                server.stats.reset()
+                server.router.user_cache.stats.reset()
+                server.router.response_cache.stats.reset()
+                server.router.single_flight.stats.reset()
+                server.router.executors.stats.reset()
+                server.router.scheduler.stats.reset()
+                server.router.sessions.stats.reset()
+                server.router.sessions.store.stats.reset()
+                server.router.session_tokens.stats.reset()
+                server.router.chains = None # recompiled with fresh middleware timers
+                print("Stats reset...")
             else:
                 try: exec(command, locals())
                 except: traceback.print_exc()
@@ -1,12 +1,19 @@
 import os
+import time
+import socket
+import signal
 import asyncio
 import logging
 import threading
 import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+import Fluxon.Routing as Routing
 from Endpoint.async_server import AsyncServer
 from Endpoint.cloud_storage_server import CloudStorageServer
 from Endpoint.interactive_console import interactive_console
 from Fluxon.Database.db_core_interface import AsyncSQLiteDatabase
+from Fluxon.Endpoint.session_store import SQLiteSessionStore
 from Endpoint.server_utils import console_server_terminate
 from Endpoint.abstract_server import Server
 
@@ -19,6 +26,10 @@ class InvalidEventLoop(Exception):
     """Raised when an invalid event loop is provided."""
     pass
 
+class UnsupportedPlatform(Exception):
+    """Raised when worker mode is requested on a platform without fork/SO_REUSEPORT."""
+    pass
+
 # Lookup table for file types and their descriptions
 file_types_lookup = {
     # Text and Document Files
@@ -194,11 +205,10 @@ async def server_startup(server:Server, shared_data:dict):
         shared_data['logger'] = server.logger
         shared_data['cloud-storage'] = server.cloud_storage
         shared_data['event_loop'] = asyncio.get_running_loop() # main server event loop (on the main thread)
-        shared_data["session-connection"] = server.SESSION_CONNECTION_LOOKUP
+        shared_data["sessions"] = server.sessions
         shared_data["models"] = server.router.models
         shared_data["database-schema-dir"] = server.router.database_schema_dir
         shared_data["database-path"] = server.router.database_path
-        shared_data["session-user"] = server.router.SESSION_USER_LOOKUP
         # activate console in the background
         print("[Fluxon] Console activated...")
         active_console_thread = threading.Thread(target=interactive_console, args=(server, shared_data, server.logger), daemon=True)
@@ -207,10 +217,12 @@ async def server_startup(server:Server, shared_data:dict):
         server.database = AsyncSQLiteDatabase(shared_data["database-path"])
     await server.start_server()
 
-def run_server(server: Server):
+def run_server(server: Server, workers:int=1):
     # retrieve main logger
     logger = logging.getLogger("main_logger")
     server.set_logger(logger)
+    if workers > 1:
+        return run_workers(server, workers, logger)
     # run server
     if isinstance(server, AsyncServer):
         shared_data = dict() # for simple interactions between the server event loop and the console thread
@@ -226,3 +238,99 @@ def run_server(server: Server):
             traceback.print_exc()
             logger.error(f"Error while running the server: {e}")
             print(f"Error while running the server: {e}")
+
+# multi-process mode
+# NOTE every worker binds the same port with SO_REUSEPORT and the kernel spreads connections across them.
+# Sessions are signed with the shared private key, so any worker accepts them, and the session -> user map
+# lives in a shared session store (SQLite file, each worker caching its reads). Reverse requests only reach
+# receiver sockets held by the worker making them.
+
+def worker_startup(server:AsyncServer, worker_id:int):
+    logger = server.logger
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # the supervisor handles ctrl-c and stops workers with SIGTERM
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        server.worker_id = worker_id
+        # database connections can't cross a fork, every worker opens its own
+        server.router.load_database_api()
+        server.router.load_models()
+        if worker_id: # a single cloud storage server, run by the first worker
+            server.cloud_storage = None
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        shared_data = {"worker-id": worker_id}
+        asyncio.get_event_loop().run_until_complete(worker_server_startup(server, shared_data))
+    except Exception as e:
+        traceback.print_exc()
+        logger.error(f"[Fluxon-Worker-{worker_id}] Error while running the server: {e}")
+        print(f"[Fluxon-Worker-{worker_id}] Error while running the server: {e}")
+        os._exit(1)
+
+async def worker_server_startup(server:AsyncServer, shared_data:dict):
+    # same as server_startup minus the console (stdin stays with the supervisor)
+    if isinstance(server.cloud_storage, CloudStorageServer):
+        server.cloud_storage.set_logger(server.logger)
+        cloud_server_thread = threading.Thread(target=cloud_server_thread_startup, args=(server.cloud_storage, shared_data), daemon=True)
+        cloud_server_thread.start()
+    shared_data['main-server'] = server
+    shared_data['event_loop'] = asyncio.get_running_loop()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(server.stop_server()))
+    server.database = AsyncSQLiteDatabase(server.router.database_path)
+    await server.start_server()
+
+def spawn_worker(context, server:AsyncServer, worker_id:int):
+    process = context.Process(
+        target=worker_startup, args=(server, worker_id),
+        name=f"fluxon-worker-{worker_id}"
+    )
+    process.start()
+    return process
+
+def supervisor_terminate(signum, frame):
+    raise KeyboardInterrupt # SIGTERM stops the workers the same way ctrl-c does
+
+def run_workers(server:AsyncServer, workers:int, logger:logging.Logger, restart_delay:float=1.0):
+    if not hasattr(socket, "SO_REUSEPORT") or "fork" not in multiprocessing.get_all_start_methods():
+        logger.error("[Fluxon] UnsupportedPlatform | worker mode needs fork and SO_REUSEPORT")
+        raise UnsupportedPlatform(
+            "worker mode needs fork and SO_REUSEPORT (linux/bsd), run_server(server) runs a single process"
+        )
+    context = multiprocessing.get_context("fork")
+    temporary_store = None
+    if not Routing.SESSIONS.store.shared:
+        # every worker would only know the sessions it logged in itself, share them for this run
+        temporary_store = SQLiteSessionStore.temporary()
+        Routing.SESSIONS.use_store(temporary_store)
+    signal.signal(signal.SIGTERM, supervisor_terminate)
+    processes = {
+        worker_id: spawn_worker(context, server, worker_id)
+        for worker_id in range(workers)
+    }
+    logger.info(f"[Fluxon] Supervisor running {workers} workers on {server.host}:{server.port}")
+    print(f"[Fluxon] Supervisor running {workers} workers on {server.host}:{server.port}")
+    try:
+        # supervisor: restart workers that die, let the ones that exit cleanly go
+        while processes:
+            sentinels = {process.sentinel: worker_id for worker_id, process in processes.items()}
+            for sentinel in wait(list(sentinels)):
+                worker_id = sentinels[sentinel]
+                process = processes.pop(worker_id)
+                process.join()
+                if process.exitcode == 0:
+                    logger.info(f"[Fluxon] Worker {worker_id} exited")
+                    print(f"[Fluxon] Worker {worker_id} exited")
+                    continue
+                logger.error(f"[Fluxon] Worker {worker_id} crashed (exit code {process.exitcode}); restarting in {restart_delay} seconds")
+                print(f"[Fluxon] Worker {worker_id} crashed (exit code {process.exitcode}); restarting in {restart_delay} seconds")
+                time.sleep(restart_delay)
+                processes[worker_id] = spawn_worker(context, server, worker_id)
+    except KeyboardInterrupt:
+        print("[Fluxon] Server terminated... [KeyboardInterrupt]")
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+        if temporary_store is not None:
+            temporary_store.close(remove=True)
@@ -0,0 +1,184 @@
+import sys
+import time
+from collections import OrderedDict
+from time import perf_counter
+from Fluxon.Endpoint.session_store import SessionStore, LocalSessionStore
+from Fluxon.Endpoint.auth_context import SessionTokens
+from Fluxon.Metrics import Stats
+
+# Live sessions of a server: session -> user, user -> sessions and session -> connections, all O(1) both ways.
+# Replaces the bare SESSION_USER_LOOKUP / SESSION_CONNECTION_LOOKUP dicts, whose user -> session lookups
+# (reverse requests, login evicting the user's old sessions) scanned every session.
+# Sessions outlive their connections for `idle_ttl` seconds and logins end with the session id's expiry,
+# both enforced by `sweep`, which the server calls every tick with a bounded amount of work.
+
+class SessionRegistry:
+    """
+    The session <-> user maps live in a SessionStore (in-process by default, see use_store),
+    NOTE connections never leave their process, whatever the store.
+    """
+    def __init__(self, store:SessionStore=None, idle_ttl:float=1800, max_idle:int=100_000):
+        self.connections = dict() # session -> {connection: None}, insertion ordered (receiver socket first)
+        self.idle_ttl = idle_ttl # seconds a session without connections stays logged in, 0 logs it out right away
+        self.max_idle = max_idle # sessions without connections kept past that, the longest idle ones go first
+        self.idle = OrderedDict() # session -> (idle since, logged out when swept), longest idle first
+        self.stats = Stats()
+        self.use_store(store or LocalSessionStore())
+
+    def use_store(self, store:SessionStore):
+        """Switches to another session store, shared ones are seen by every worker process (SQLiteSessionStore)."""
+        self.store = store
+        store.subscribe(self.changed)
+
+    def changed(self, sessionid):
+        # a session logged in or out, maybe in another worker (None: any of them)
+        sessions = self.connections.values() if sessionid is None else [self.connections.get(sessionid, ())]
+        for connections in sessions:
+            for connection in connections:
+                connection.userid = None # resolved again by its next request (see Request.userid)
+
+    # session -> user
+
+    def user_of(self, sessionid):
+        return self.store.user_of(sessionid)
+
+    def sessions_for(self, userid) -> set:
+        return self.store.sessions_for(userid)
+
+    def session_of(self, userid):
+        """Any session the user is logged in with (their only one, login evicts the others), None if logged out."""
+        sessions = self.store.sessions_for(userid)
+        return next(iter(sessions)) if sessions else None
+
+    def login(self, sessionid, userid) -> set:
+        """
+        Logs `sessionid` in as `userid` until the session id expires, the user's other sessions are logged out.
+        Returns the evicted sessions.
+        """
+        return self.store.login(sessionid, userid, SessionTokens.expires_at(sessionid))
+
+    def logout(self, sessionid):
+        return self.store.logout(sessionid)
+
+    # session -> connections
+
+    def has_session(self, sessionid) -> bool:
+        return sessionid in self.connections
+
+    def connections_of(self, sessionid) -> list:
+        connections = self.connections.get(sessionid)
+        return list(connections) if connections else []
+
+    def first_connection(self, sessionid):
+        connections = self.connections.get(sessionid)
+        return next(iter(connections)) if connections else None
+
+    def add_connection(self, sessionid, connection):
+        connections = self.connections.get(sessionid)
+        if connections is None:
+            self.connections[sessionid] = {connection: None}
+            self.idle.pop(sessionid, None)
+        else:
+            connections[connection] = None
+
+    def remove_connection(self, sessionid, connection) -> bool:
+        """Detaches a closed connection, True when it was the session's last one."""
+        connections = self.connections.get(sessionid)
+        if connections is None or connections.pop(connection, False) is False:
+            return False
+        if connections:
+            return False
+        del self.connections[sessionid]
+        return True
+
+    def release(self, sessionid, logout:bool=True):
+        """
+        The session's last connection closed, it's logged out once idle for `idle_ttl` unless it connects again.
+        `logout` False only forgets it here (a shared store's session other workers may still serve).
+        """
+        if not self.idle_ttl:
+            if logout:
+                self.store.logout(sessionid)
+            return
+        self.idle[sessionid] = (time.monotonic(), logout)
+        self.idle.move_to_end(sessionid)
+
+    def release_restored(self, sessions) -> int:
+        """
+        Sessions logged in without a connection here (restored from a snapshot), released as if their last
+        connection just closed: logged out once idle for `idle_ttl`, or past `max_idle`, unless their client comes back.
+        """
+        sessions = [sessionid for sessionid in sessions if sessionid not in self.connections and sessionid not in self.idle]
+        if not self.idle_ttl:
+            self.store.logout_many(sessions)
+        else:
+            self.idle.update(dict.fromkeys(sessions, (time.monotonic(), True))) # NOTE the tuple is shared, it's never mutated
+        return len(sessions)
+
+    # expiry
+
+    def sweep(self, limit:int=1000) -> int:
+        """
+        Logs out up to `limit` sessions: idle past `idle_ttl` (or past `max_idle`), then expired ones.
+        NOTE never more than `limit` entries looked at, whatever the backlog, the rest waits for the next call
+        """
+        started = perf_counter()
+        now = time.monotonic()
+        logouts = []
+        swept = 0
+        while self.idle and swept < limit:
+            sessionid, (since, logout) = next(iter(self.idle.items()))
+            over_capacity = len(self.idle) > self.max_idle
+            if not over_capacity and since + self.idle_ttl > now: # the rest went idle later
+                break
+            del self.idle[sessionid]
+            if logout:
+                logouts.append(sessionid)
+            self.stats.incr("evicted_idle" if over_capacity else "expired_idle")
+            swept += 1
+        if logouts:
+            self.store.logout_many(logouts)
+        if swept < limit:
+            expired = self.store.purge_expired(time.time(), limit - swept)
+            self.stats.incr("expired_absolute", len(expired))
+            swept += len(expired)
+        self.stats.incr("sweeps")
+        self.stats.observe("sweep", perf_counter() - started)
+        return swept
+
+    def idle_backlog(self) -> int:
+        # idle sessions due for a logout, walked from the longest idle one up to the first that isn't due
+        now = time.monotonic()
+        due = max(0, len(self.idle) - self.max_idle)
+        for since, _ in self.idle.values():
+            if since + self.idle_ttl > now:
+                break
+            due += 1
+        return min(due, len(self.idle))
+
+    def memory_estimate(self) -> int:
+        """Rough bytes held by the registry and its store in this process."""
+        sample = len(next(iter(self.connections), "")) + sys.getsizeof("")
+        size = sys.getsizeof(self.connections) + sys.getsizeof(self.idle)
+        size += len(self.connections) * (sample + sys.getsizeof({}))
+        size += len(self.idle) * (sample + 64 + sys.getsizeof((0.0, True))) # OrderedDict node + tuple
+        return size + self.store.memory_estimate()
+
+    def report(self) -> dict:
+        """Sessions, memory & expiry backlog (console "sessions" command)."""
+        logged_in, users = self.store.counts()
+        return {
+            "connected": len(self.connections), "idle": len(self.idle), "logged_in": logged_in, "users": users,
+            "memory_estimate_kb": round(self.memory_estimate() / 1024, 1),
+            "idle_backlog": self.idle_backlog(), "expired_backlog": self.store.expiry_backlog(time.time()),
+            "idle_ttl": self.idle_ttl, "max_idle": self.max_idle, "store": type(self.store).__name__
+        }
+
+    def __len__(self):
+        return len(self.connections)
+
+    def snapshot(self) -> dict:
+        snapshot = self.store.snapshot()
+        snapshot.update(self.stats.snapshot())
+        snapshot.update(sessions=len(self.connections), idle=len(self.idle), store=type(self.store).__name__)
+        return snapshot
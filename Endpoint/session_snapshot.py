@@ -0,0 +1,192 @@
+import os
+import gc
+import mmap
+import time
+import struct
+import pathlib
+import logging
+from array import array
+from Fluxon.Endpoint.session_store import LocalSessionStore
+from Fluxon.Metrics import Stats
+
+# The session -> user map on disk, so a restart doesn't send every client back to login at once
+# (and all of them to the user table). Changes are appended to a journal every few seconds, a full snapshot
+# is written on stop_server (and whenever the journal outgrows `compact_bytes`).
+# On startup the snapshot is memory-mapped and bulk loaded, then the journal is replayed on top of it.
+# Snapshot layout: header, session ids joined by "\n", user ids (int64 array), expires (int64 array, 0 = none).
+# Journal records hold a session's state after the change (last one wins), not the change itself.
+# NOTE in-process sessions only (LocalSessionStore), a file-backed SQLiteSessionStore is on disk already
+
+MAGIC = b"FXSS"
+VERSION = 1
+HEADER = struct.Struct("<4sB3xQQ") # magic, version, sessions, bytes of session ids
+JOURNAL_RECORD = struct.Struct("<qqH") # user id (LOGGED_OUT), expires (0 = none), session id bytes
+LOGGED_OUT = -2**63
+
+class SnapshotError(Exception):
+    """Raised when a session snapshot can't be read."""
+    pass
+
+class SessionSnapshot:
+    def __init__(self, path, interval:float=5.0, compact_bytes:int=64 * 1024 * 1024):
+        self.path = pathlib.Path(path)
+        self.journal_path = self.path.with_name(self.path.name + ".journal")
+        self.old_journal_path = self.path.with_name(self.path.name + ".journal.old") # compaction in progress
+        self.interval = interval # seconds between journal flushes
+        self.compact_bytes = compact_bytes # journal size past which a full snapshot is written
+        self.store = None
+        self.dirty = set() # sessions changed since the last flush
+        self.stats = Stats()
+        self.logger = logging.getLogger("main_logger")
+
+    def attach(self, store) -> bool:
+        if not isinstance(store, LocalSessionStore):
+            self.logger.warning(f"[SessionSnapshot] {type(store).__name__} sessions aren't snapshotted, only in-process ones are")
+            return False
+        self.store = store
+        store.subscribe(self.changed)
+        return True
+
+    def changed(self, sessionid):
+        if sessionid is not None:
+            self.dirty.add(sessionid)
+
+    # journal
+
+    def flush(self) -> int:
+        """Appends the sessions changed since the last flush to the journal."""
+        if not self.dirty:
+            return 0
+        users, expires = self.store.users, self.store.expires
+        records = []
+        for sessionid in self.dirty:
+            encoded = sessionid.encode('utf-8')
+            userid = users.get(sessionid)
+            records.append(JOURNAL_RECORD.pack(
+                LOGGED_OUT if userid is None else userid, expires.get(sessionid) or 0, len(encoded)
+            ) + encoded)
+        with open(self.journal_path, "ab") as journal:
+            journal.write(b"".join(records))
+        count = len(self.dirty)
+        self.dirty.clear()
+        self.stats.incr("journaled", count)
+        return count
+
+    def journal_size(self) -> int:
+        try:
+            return self.journal_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def read_journal(path:pathlib.Path, states:dict):
+        # session -> (user id or None, expires or None), later records win
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return
+        offset = 0
+        while offset + JOURNAL_RECORD.size <= len(data):
+            userid, expires, size = JOURNAL_RECORD.unpack_from(data, offset)
+            offset += JOURNAL_RECORD.size
+            if offset + size > len(data): # torn write, the process died mid-flush
+                break
+            sessionid = data[offset:offset + size].decode('utf-8')
+            offset += size
+            states[sessionid] = (None if userid == LOGGED_OUT else userid, expires or None)
+
+    # snapshot
+
+    def capture(self):
+        """Copy of the store to snapshot (two dict copies, on the loop), the journal so far is set aside for it."""
+        self.flush()
+        if self.journal_path.exists():
+            if self.old_journal_path.exists(): # the last snapshot failed, that journal isn't in any snapshot yet
+                with open(self.old_journal_path, "ab") as old_journal:
+                    old_journal.write(self.journal_path.read_bytes())
+                self.journal_path.unlink()
+            else:
+                os.replace(self.journal_path, self.old_journal_path)
+        return dict(self.store.users), dict(self.store.expires)
+
+    def write(self, captured):
+        """Writes a captured state as the new snapshot (safe off the loop), replacing the old one atomically."""
+        users, expiries = captured
+        started = time.perf_counter()
+        userids = array('q', users.values())
+        expires = array('q', [expiries.get(sessionid, 0) for sessionid in users])
+        ids = "\n".join(users).encode('utf-8')
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        with open(temporary, "wb") as snapshot:
+            snapshot.write(HEADER.pack(MAGIC, VERSION, len(users), len(ids)))
+            snapshot.write(ids)
+            userids.tofile(snapshot)
+            expires.tofile(snapshot)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temporary, self.path)
+        self.old_journal_path.unlink(missing_ok=True)
+        self.stats.incr("snapshots")
+        self.stats.observe("snapshot_write", time.perf_counter() - started)
+        return len(users)
+
+    def save(self) -> int:
+        """Full snapshot right away (stop_server)."""
+        return self.write(self.capture())
+
+    def load(self) -> int:
+        """
+        Bulk loads the snapshot through a memory map, then replays the journals; expired sessions are left out.
+        Returns the sessions restored into the (empty) store.
+        """
+        started = time.perf_counter()
+        sessions, userids, expires = [], array('q'), array('q')
+        if self.path.exists() and self.path.stat().st_size:
+            with open(self.path, "rb") as snapshot, mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    if len(view) < HEADER.size or HEADER.unpack_from(view)[:2] != (MAGIC, VERSION):
+                        raise SnapshotError(f"{self.path} isn't a version {VERSION} session snapshot")
+                    _, _, count, ids_size = HEADER.unpack_from(view)
+                    if len(view) != HEADER.size + ids_size + 16 * count:
+                        raise SnapshotError(f"{self.path} is truncated")
+                    offset = HEADER.size
+                    if count:
+                        sessions = str(view[offset:offset + ids_size], 'utf-8').split("\n")
+                    offset += ids_size
+                    userids.frombytes(view[offset:offset + 8 * count])
+                    offset += 8 * count
+                    expires.frombytes(view[offset:offset + 8 * count])
+                finally:
+                    view.release()
+        states = dict()
+        self.read_journal(self.old_journal_path, states) # left by a compaction that didn't finish
+        self.read_journal(self.journal_path, states)
+        now = time.time()
+        count = len(self.store.users)
+        # NOTE a million new containers would set off full collections over and over, several times the load itself
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            rows = [
+                row for row in zip(sessions, userids, expires)
+                if not (row[2] and row[2] <= now) and row[0] not in states
+            ]
+            rows.extend(
+                (sessionid, userid, expiry or 0) for sessionid, (userid, expiry) in states.items()
+                if userid is not None and not (expiry and expiry <= now)
+            )
+            if rows:
+                self.store.restore(*zip(*rows))
+        finally:
+            if collecting:
+                gc.enable()
+        restored = len(self.store.users) - count
+        self.stats.incr("restored", restored)
+        self.stats.observe("load", time.perf_counter() - started)
+        return restored
+
+    def snapshot(self) -> dict:
+        snapshot = self.stats.snapshot()
+        snapshot.update(dirty=len(self.dirty), journal_bytes=self.journal_size(), path=str(self.path))
+        return snapshot
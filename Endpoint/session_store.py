@@ -0,0 +1,529 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import sqlite3
+import tempfile
+import threading
+from itertools import islice
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from Fluxon.Metrics import Stats
+
+# Where the session -> user map lives, behind the SessionRegistry.
+# LocalSessionStore keeps it in this process (single process servers), SQLiteSessionStore in a WAL database
+# file every worker process on the host opens, with a local read-through cache kept fresh by polling
+# the database's change log. Listeners (subscribe) are told about every session whose user changed,
+# whichever process changed it.
+# Sessions logged in with an id carrying an expiry (auth_context.SessionTokens) are purged past it, see purge_expired.
+
+MISSING = object()
+EXPIRY_BUCKET = 60 # seconds of session expiries per LocalSessionStore bucket
+
+class SessionStore:
+    """Session -> user map interface. `shared` stores are seen by every worker process."""
+    shared = False
+
+    def __init__(self):
+        self.listeners = []
+        self.stats = Stats()
+
+    def subscribe(self, listener):
+        """`listener(sessionid)` is called for every session logged in or out, sessionid None = any of them."""
+        self.listeners.append(listener)
+
+    def notify(self, sessionids):
+        for sessionid in sessionids:
+            for listener in self.listeners:
+                listener(sessionid)
+
+    def user_of(self, sessionid):
+        raise NotImplementedError
+
+    def sessions_for(self, userid) -> set:
+        raise NotImplementedError
+
+    def login(self, sessionid, userid, expires:int=None) -> set:
+        """
+        Logs `sessionid` in as `userid` until `expires` (unix seconds, None = no limit),
+        the user's other sessions are logged out. Returns the evicted sessions.
+        """
+        raise NotImplementedError
+
+    def logout(self, sessionid):
+        """Returns the user the session was logged in as, None if it wasn't."""
+        raise NotImplementedError
+
+    def logout_many(self, sessionids):
+        for sessionid in sessionids:
+            self.logout(sessionid)
+
+    def purge_expired(self, now:float, limit:int) -> list:
+        """Logs out up to `limit` sessions expired by `now` (unix seconds), returns them."""
+        raise NotImplementedError
+
+    def expiry_backlog(self, now:float) -> int:
+        """Sessions expired by `now` not purged yet."""
+        raise NotImplementedError
+
+    def counts(self) -> tuple:
+        """(logged in sessions, users)"""
+        raise NotImplementedError
+
+    def memory_estimate(self) -> int:
+        """Rough bytes held in this process."""
+        return 0
+
+    def snapshot(self) -> dict:
+        logged_in, users = self.counts()
+        snapshot = self.stats.snapshot()
+        snapshot.update(logged_in=logged_in, users=users)
+        return snapshot
+
+    def flush(self):
+        """Waits for the writes still in flight (stop_server)."""
+        pass
+
+    def close(self):
+        pass
+
+class LocalSessionStore(SessionStore):
+    def __init__(self):
+        super().__init__()
+        self.users = dict() # session -> user id (logged in sessions only)
+        self.sessions_of = dict() # user id -> set of sessions
+        # NOTE expiries are bucketed by the minute, purging walks buckets in order and logouts leave no garbage behind
+        self.expires = dict() # session -> expires, sessions logged in with one
+        self.buckets = dict() # expires // EXPIRY_BUCKET -> set of sessions
+        self.next_bucket = None # oldest bucket that may hold sessions
+
+    def user_of(self, sessionid):
+        return self.users.get(sessionid)
+
+    def sessions_for(self, userid) -> set:
+        return self.sessions_of.get(userid) or set()
+
+    def login(self, sessionid, userid, expires:int=None) -> set:
+        evicted = self.sessions_for(userid) - {sessionid}
+        for session in evicted:
+            self.drop(session)
+        self.drop(sessionid) # logged in as someone else before
+        self.users[sessionid] = userid
+        self.sessions_of[userid] = {sessionid}
+        if expires is not None:
+            self.track(sessionid, expires)
+        self.stats.incr("logins")
+        self.notify((*evicted, sessionid))
+        return evicted
+
+    def track(self, sessionid, expires:int):
+        self.expires[sessionid] = expires
+        bucket = expires // EXPIRY_BUCKET
+        sessions = self.buckets.get(bucket)
+        if sessions is None:
+            self.buckets[bucket] = {sessionid}
+            if self.next_bucket is None or bucket < self.next_bucket:
+                self.next_bucket = bucket
+        else:
+            sessions.add(sessionid)
+
+    def restore(self, sessions:list, userids, expires):
+        """
+        Bulk load of logins into an empty store, columns of sessions, user ids & expires (0 = none), a snapshot's.
+        NOTE no eviction & no notifications, the columns are expected to be a consistent state
+        """
+        self.users.update(zip(sessions, userids))
+        # one session per user (login evicts the others), grouped the slow way only if that doesn't hold
+        self.sessions_of.update({userid: {sessionid} for sessionid, userid in zip(sessions, userids)})
+        if len(self.sessions_of) != len(self.users):
+            self.sessions_of.clear()
+            for sessionid, userid in zip(sessions, userids):
+                self.sessions_of.setdefault(userid, set()).add(sessionid)
+        buckets = self.buckets
+        for sessionid, expiry in zip(sessions, expires):
+            if expiry:
+                self.expires[sessionid] = expiry
+                bucket = buckets.get(expiry // EXPIRY_BUCKET)
+                if bucket is None:
+                    buckets[expiry // EXPIRY_BUCKET] = {sessionid}
+                else:
+                    bucket.add(sessionid)
+        if buckets:
+            self.next_bucket = min(buckets)
+        self.stats.incr("restored", len(self.users))
+
+    def logout(self, sessionid):
+        userid = self.drop(sessionid)
+        if userid is not None:
+            self.stats.incr("logouts")
+            self.notify((sessionid,))
+        return userid
+
+    def drop(self, sessionid):
+        userid = self.users.pop(sessionid, None)
+        if userid is None:
+            return None
+        sessions = self.sessions_of.get(userid)
+        if sessions is not None:
+            sessions.discard(sessionid)
+            if not sessions:
+                del self.sessions_of[userid]
+        expires = self.expires.pop(sessionid, None)
+        if expires is not None:
+            bucket = self.buckets[expires // EXPIRY_BUCKET]
+            bucket.discard(sessionid)
+            if not bucket:
+                del self.buckets[expires // EXPIRY_BUCKET]
+        return userid
+
+    def due(self, now:float, limit:int) -> list:
+        """
+        Up to `limit` sessions expired by `now`, never more than `limit` sessions looked at.
+        Buckets of past minutes are due as a whole; the current minute's is only scanned when it fits in
+        what's left of `limit`, a bigger one (login burst) is purged once the minute has passed.
+        NOTE so expiries may be purged up to EXPIRY_BUCKET late, expired session ids are refused on connect anyway
+        """
+        due = []
+        last = int(now) // EXPIRY_BUCKET
+        bucket = self.next_bucket
+        while bucket is not None and bucket <= last and len(due) < limit:
+            sessions = self.buckets.get(bucket)
+            if not sessions:
+                pass
+            elif bucket < last:
+                due.extend(islice(sessions, limit - len(due)))
+            elif len(sessions) <= limit - len(due):
+                expires = self.expires
+                due.extend([sessionid for sessionid in sessions if expires[sessionid] <= now])
+            bucket += 1
+        return due
+
+    def purge_expired(self, now:float, limit:int) -> list:
+        purged = self.due(now, limit)
+        for sessionid in purged:
+            self.drop(sessionid)
+        # buckets left behind are empty now (the last one may keep sessions expiring later this minute)
+        last = int(now) // EXPIRY_BUCKET
+        while self.next_bucket is not None and self.next_bucket < last and self.next_bucket not in self.buckets:
+            self.next_bucket = self.next_bucket + 1 if self.buckets else None
+        if purged:
+            self.stats.incr("expired", len(purged))
+            self.notify(purged)
+        return purged
+
+    def expiry_backlog(self, now:float) -> int:
+        # NOTE past minutes' buckets only (one len per minute), the current one isn't scanned
+        last = int(now) // EXPIRY_BUCKET
+        if self.next_bucket is None:
+            return 0
+        return sum(len(self.buckets.get(bucket, ())) for bucket in range(self.next_bucket, last))
+
+    def counts(self) -> tuple:
+        return len(self.users), len(self.sessions_of)
+
+    def memory_estimate(self) -> int:
+        # containers + one session id string per entry, user ids are mostly small cached ints
+        sample = len(next(iter(self.users), "")) + sys.getsizeof("")
+        size = sys.getsizeof(self.users) + sys.getsizeof(self.sessions_of) + sys.getsizeof(self.expires) + sys.getsizeof(self.buckets)
+        size += len(self.sessions_of) * sys.getsizeof(set()) + len(self.buckets) * sys.getsizeof(set())
+        return size + len(self.users) * sample
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions in a SQLite database (WAL mode, so readers never wait on the writer) shared by processes on one host.
+    Lookups are answered from a local LRU cache, logged out sessions included. Every write also appends the
+    session to a change log; at most every `poll_interval` seconds (and only when another connection committed,
+    PRAGMA data_version) the new entries are read and their sessions dropped from the cache.
+    On a running event loop writes go through a thread of their own, the cache is updated right away and
+    listeners are told once the transaction committed; another worker holding the write lock never stalls the loop.
+    NOTE a process may answer from its cache for up to `poll_interval` after another one logged a session out
+    NOTE cold lookups still read on the caller's thread, WAL readers don't wait on writers
+    """
+    shared = True
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS sessions (sessionid TEXT PRIMARY KEY, userid INTEGER NOT NULL, expires INTEGER) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS sessions_userid ON sessions (userid)",
+        "CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires) WHERE expires IS NOT NULL",
+        "CREATE TABLE IF NOT EXISTS session_changes (version INTEGER PRIMARY KEY AUTOINCREMENT, sessionid TEXT NOT NULL, changed_at REAL NOT NULL)",
+    )
+
+    def __init__(self, path, poll_interval:float=0.05, cache_size:int=100_000, log_retention:float=300, busy_timeout:float=10):
+        super().__init__()
+        self.path = str(path)
+        self.poll_interval = poll_interval
+        self.cache_size = cache_size
+        self.log_retention = log_retention # seconds change log entries are kept, a process polling later starts over
+        self.cache = OrderedDict() # session -> user id, None for sessions not logged in
+        self.conn = None
+        self.pid = None # process that opened `conn`, a forked child opens its own
+        self.lock = threading.Lock() # the cloud storage server reads sessions from its own thread
+        self.busy_timeout = busy_timeout # seconds a write waits on another connection's lock
+        self.writer = None # thread running the write transactions (event loop callers), one per process
+        self.writer_pid = None
+        self.write_conn = None # the writer thread's own connection, a write waiting on the lock never holds `lock`
+        self.logger = logging.getLogger("main_logger")
+        self.version = 0 # last change log entry applied to the cache
+        self.data_version = None
+        self.next_poll = 0.0
+        self.writes = 0
+        self.connection() # creates the database before workers fork
+
+    @classmethod
+    def temporary(cls, **kwargs):
+        """Store in a fresh file of the temp directory, removed by close(remove=True)."""
+        descriptor, path = tempfile.mkstemp(prefix="fluxon-sessions-", suffix=".db")
+        os.close(descriptor)
+        return cls(path, **kwargs)
+
+    def open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL") # sessions don't need to survive a power cut
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        if self.pid != os.getpid():
+            conn = self.open()
+            self.conn, self.pid = conn, os.getpid()
+            self.cache.clear()
+            self.version = self.head(conn)
+            self.data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        return self.conn
+
+    @staticmethod
+    def head(conn:sqlite3.Connection) -> int:
+        # last change log version handed out, AUTOINCREMENT's counter (the log itself may have been pruned empty)
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'session_changes'").fetchone()
+        return row[0] if row else 0
+
+    # reads
+
+    def user_of(self, sessionid):
+        now = time.monotonic()
+        if now >= self.next_poll:
+            self.next_poll = now + self.poll_interval
+            self.poll()
+        self.stats.incr("lookups")
+        userid = self.cache.get(sessionid, MISSING)
+        if userid is not MISSING:
+            self.stats.incr("hits")
+            self.cache.move_to_end(sessionid)
+            return userid
+        with self.lock:
+            row = self.connection().execute("SELECT userid FROM sessions WHERE sessionid = ?", (sessionid,)).fetchone()
+        userid = row[0] if row else None
+        self.cache_put(sessionid, userid)
+        return userid
+
+    def cache_put(self, sessionid, userid):
+        if not self.cache_size:
+            return
+        self.cache[sessionid] = userid
+        self.cache.move_to_end(sessionid)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def sessions_for(self, userid) -> set:
+        with self.lock:
+            rows = self.connection().execute("SELECT sessionid FROM sessions WHERE userid = ?", (userid,)).fetchall()
+        return {row[0] for row in rows}
+
+    def poll(self):
+        """Applies the changes other processes committed since the last poll."""
+        with self.lock:
+            conn = self.connection()
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self.data_version: # nobody else committed
+                return
+            self.data_version = data_version
+            self.stats.incr("polls")
+            changes = conn.execute(
+                "SELECT version, sessionid FROM session_changes WHERE version > ? ORDER BY version", (self.version,)
+            ).fetchall()
+        if not changes:
+            return
+        if changes[0][0] != self.version + 1: # entries we never saw were pruned, start over
+            self.cache.clear()
+            self.stats.incr("resyncs")
+            self.version = changes[-1][0]
+            self.notify((None,))
+            return
+        self.version = changes[-1][0]
+        sessionids = {sessionid for _, sessionid in changes}
+        for sessionid in sessionids:
+            self.cache.pop(sessionid, None)
+        self.stats.incr("invalidations", len(sessionids))
+        self.notify(sessionids)
+
+    # writes, one transaction each so workers can't interleave them
+
+    def transaction(self, conn:sqlite3.Connection, change) -> tuple:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            head = self.head(conn)
+            changed = change(conn)
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO session_changes (sessionid, changed_at) VALUES (?, ?)",
+                [(sessionid, now) for sessionid in changed]
+            )
+            self.writes += 1
+            if not self.writes % 256:
+                conn.execute("DELETE FROM session_changes WHERE changed_at < ?", (now - self.log_retention,))
+            written = self.head(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return changed, head, written
+
+    def executor(self) -> ThreadPoolExecutor:
+        if self.writer_pid != os.getpid(): # a forked worker doesn't get its parent's thread
+            self.writer = ThreadPoolExecutor(1, thread_name_prefix="fluxon-sessions")
+            self.writer_pid = os.getpid()
+            self.write_conn = None
+        return self.writer
+
+    def background_transaction(self, change) -> tuple:
+        # writer thread
+        if self.write_conn is None:
+            self.write_conn = self.open()
+        return self.transaction(self.write_conn, change)
+
+    def write(self, change, committed, touched=()) -> list:
+        """
+        Runs `change(conn)` (returns the sessions it changed) in a write transaction, then `committed(changed)`.
+        On a running event loop the transaction goes to the writer thread and `committed` is called back on the loop,
+        None is returned; callers put what they expect in the cache beforehand, `touched` sessions are dropped from it on failure.
+        Otherwise it's all done right away and the changed sessions are returned.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            with self.lock:
+                result = self.transaction(self.connection(), change)
+            self.committed(result, committed)
+            return result[0]
+        future = loop.run_in_executor(self.executor(), self.background_transaction, change)
+        future.add_done_callback(lambda future: self.written(future, committed, touched))
+        return None
+
+    def committed(self, result:tuple, committed):
+        changed, head, written = result
+        if head == self.version: # no one else's changes in between, ours don't need polling back
+            self.version = written
+        committed(changed)
+
+    def written(self, future, committed, touched):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            for sessionid in touched: # read again from the database
+                self.cache.pop(sessionid, None)
+            self.stats.incr("failed_writes")
+            self.logger.error(f"[SQLiteSessionStore] Session write failed: {future.exception()}")
+            return
+        self.committed(future.result(), committed)
+
+    def flush(self):
+        if self.writer is not None and self.writer_pid == os.getpid():
+            self.writer.submit(int).result() # one thread, queued after every write in flight
+
+    def login(self, sessionid, userid, expires:int=None) -> set:
+        """NOTE on the event loop the evicted sessions are only known once the write commits, they're notified then"""
+        def change(conn):
+            evicted = {row[0] for row in conn.execute(
+                "SELECT sessionid FROM sessions WHERE userid = ? AND sessionid != ?", (userid, sessionid)
+            )}
+            conn.execute("DELETE FROM sessions WHERE userid = ? AND sessionid != ?", (userid, sessionid))
+            conn.execute("INSERT OR REPLACE INTO sessions (sessionid, userid, expires) VALUES (?, ?, ?)", (sessionid, userid, expires))
+            return [*evicted, sessionid]
+        def committed(changed):
+            for session in changed[:-1]:
+                self.cache_put(session, None)
+            self.notify(changed)
+        self.cache_put(sessionid, userid)
+        self.stats.incr("logins")
+        changed = self.write(change, committed, (sessionid,))
+        return set(changed[:-1]) if changed else set()
+
+    def logout(self, sessionid):
+        userid = self.cache.get(sessionid) # the database's on the synchronous path
+        def change(conn):
+            nonlocal userid
+            row = conn.execute("SELECT userid FROM sessions WHERE sessionid = ?", (sessionid,)).fetchone()
+            if row is None:
+                return []
+            conn.execute("DELETE FROM sessions WHERE sessionid = ?", (sessionid,))
+            userid = row[0]
+            return [sessionid]
+        def committed(changed):
+            if changed:
+                self.stats.incr("logouts")
+                self.notify(changed)
+        self.cache_put(sessionid, None)
+        self.write(change, committed, (sessionid,))
+        return userid
+
+    def drop_many(self, sessionids:list, stat:str) -> list:
+        def change(conn):
+            # only the ones still there get a change log entry
+            return [sessionid for sessionid in sessionids if conn.execute("DELETE FROM sessions WHERE sessionid = ?", (sessionid,)).rowcount]
+        def committed(changed):
+            if changed:
+                self.stats.incr(stat, len(changed))
+                self.notify(changed)
+        if not sessionids:
+            return []
+        for sessionid in sessionids:
+            self.cache_put(sessionid, None)
+        changed = self.write(change, committed, sessionids)
+        return sessionids if changed is None else changed
+
+    def logout_many(self, sessionids):
+        # one transaction for the lot
+        self.drop_many(list(sessionids), "logouts")
+
+    def purge_expired(self, now:float, limit:int) -> list:
+        with self.lock: # read first, every worker sweeps and most ticks there's nothing to purge
+            due = [row[0] for row in self.connection().execute(
+                "SELECT sessionid FROM sessions WHERE expires <= ? LIMIT ?", (int(now), limit)
+            )]
+        return self.drop_many(due, "expired")
+
+    def expiry_backlog(self, now:float) -> int:
+        with self.lock:
+            return self.connection().execute("SELECT COUNT(*) FROM sessions WHERE expires <= ?", (int(now),)).fetchone()[0]
+
+    def counts(self) -> tuple:
+        with self.lock:
+            return self.connection().execute("SELECT COUNT(*), COUNT(DISTINCT userid) FROM sessions").fetchone()
+
+    def memory_estimate(self) -> int:
+        # only the local cache, the sessions themselves are in the database file
+        sample = len(next(iter(self.cache), "")) + sys.getsizeof("")
+        return sys.getsizeof(self.cache) + len(self.cache) * (sample + 64) # + the OrderedDict's linked list node
+
+    def snapshot(self) -> dict:
+        snapshot = super().snapshot()
+        snapshot.update(cached=len(self.cache), hit_rate=self.stats.ratio("hits", "lookups"))
+        return snapshot
+
+    def close(self, remove:bool=False):
+        if self.writer is not None and self.writer_pid == os.getpid():
+            self.writer.shutdown(wait=True)
+            if self.write_conn is not None:
+                self.write_conn.close()
+        self.writer = self.writer_pid = self.write_conn = None
+        if self.conn is not None and self.pid == os.getpid():
+            self.conn.close()
+        self.conn = self.pid = None
+        if remove:
+            for suffix in ("", "-wal", "-shm"):
+                try: os.remove(self.path + suffix)
+                except FileNotFoundError: pass
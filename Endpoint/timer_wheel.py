@@ -0,0 +1,104 @@
+import asyncio
+import traceback
+import logging
+
+# Hashed timer wheel shared by every connection of a server (read, idle & request deadlines).
+# Arming a deadline is a couple of attribute writes: entries only move between slots when their
+# deadline gets closer. Pushed back deadlines are noticed lazily, when the old slot comes up,
+# so re-arming on every read costs nothing. Expired entries of a tick are reaped together.
+
+class TimerEntry:
+    __slots__ = ("callback", "expires", "reason", "tick")
+
+    def __init__(self, callback):
+        self.callback = callback # called with the reason once the deadline passes
+        self.expires = None # loop time, None when disarmed
+        self.reason = None
+        self.tick = None # slot tick the entry currently sits in
+
+class TimerWheel:
+    def __init__(self, resolution:float=0.5, slots:int=512):
+        self.resolution = resolution # seconds per tick, deadlines fire up to one tick late
+        self.slots = slots
+        self.wheel = [set() for _ in range(slots)]
+        self.size = 0
+        self.current_tick = None
+        self.loop = None
+        self.handle = None
+        self.logger = logging.getLogger("main_logger")
+
+    def tick_of(self, when:float) -> int:
+        return int(when / self.resolution)
+
+    def now(self) -> float:
+        if self.loop is None: # bound to the loop of the first caller
+            self.loop = asyncio.get_running_loop()
+            self.current_tick = self.tick_of(self.loop.time())
+        return self.loop.time()
+
+    def arm(self, entry:TimerEntry, timeout:float, reason:str):
+        if timeout is None:
+            return self.disarm(entry)
+        entry.expires = self.now() + timeout
+        entry.reason = reason
+        tick = self.tick_of(entry.expires)
+        if entry.tick is not None and entry.tick <= tick:
+            return # lazy, re-slotted when its current slot comes up
+        self.insert(entry, tick)
+        if self.handle is None:
+            self.handle = self.loop.call_later(self.resolution, self.advance)
+
+    def disarm(self, entry:TimerEntry):
+        entry.expires = None # lazy, dropped when its slot comes up
+
+    def cancel(self, entry:TimerEntry):
+        # connection closed, drop the entry right away
+        entry.expires = None
+        if entry.tick is not None:
+            self.wheel[entry.tick % self.slots].discard(entry)
+            entry.tick = None
+            self.size -= 1
+
+    def insert(self, entry:TimerEntry, tick:int):
+        if entry.tick is not None:
+            self.wheel[entry.tick % self.slots].discard(entry)
+        else:
+            self.size += 1
+        entry.tick = max(tick, self.current_tick + 1)
+        self.wheel[entry.tick % self.slots].add(entry)
+
+    def advance(self):
+        self.handle = None
+        now = self.loop.time()
+        now_tick = self.tick_of(now)
+        expired = []
+        # NOTE a late loop only walks each slot once, whatever the gap
+        for tick in range(self.current_tick + 1, min(now_tick, self.current_tick + self.slots) + 1):
+            self.current_tick = tick # pushed back entries land after the slot being walked
+            bucket = self.wheel[tick % self.slots]
+            if not bucket:
+                continue
+            for entry in [entry for entry in bucket if entry.tick <= now_tick]: # the rest belongs to a later lap
+                bucket.discard(entry)
+                entry.tick = None
+                self.size -= 1
+                if entry.expires is None:
+                    continue
+                if entry.expires > now: # pushed back since it was slotted
+                    self.insert(entry, self.tick_of(entry.expires))
+                else:
+                    expired.append(entry)
+        self.current_tick = now_tick
+        for entry in expired:
+            reason, entry.expires = entry.reason, None
+            try:
+                entry.callback(reason)
+            except Exception as e:
+                self.logger.error(f"[TimerWheel] Deadline callback failed: {e}\nTraceback: {traceback.format_exc()}")
+        if self.size:
+            self.handle = self.loop.call_later(self.resolution, self.advance)
+
+    def close(self):
+        if self.handle:
+            self.handle.cancel()
+            self.handle = None
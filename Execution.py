@@ -0,0 +1,272 @@
+import time
+import asyncio
+import inspect
+import logging
+from datetime import datetime
+from collections import defaultdict, deque
+from collections.abc import Coroutine
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from Fluxon.Metrics import Stats
+
+# Where sync views run, opted into per view with the run_in decorator.
+# "loop" (default) calls the view on the event loop thread, "thread" and "process" hand it to a bounded pool
+# so a blocking or CPU-bound view doesn't freeze every other connection.
+# When views run is up to the ViewScheduler: per-view concurrency limits and priority classes (schedule decorator).
+# NOTE keep this module free of server imports, Routing.py depends on it
+
+LOOP = "loop"
+THREAD = "thread"
+PROCESS = "process"
+POLICIES = (LOOP, THREAD, PROCESS)
+
+# priority classes, most urgent first
+INTERACTIVE = "interactive"
+NORMAL = "normal"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, NORMAL, BULK)
+
+def run_in(policy:str):
+    """
+    View decorator, picks where a sync view runs: "loop", "thread" or "process".
+    Thread views get the usual request but run off the loop (no request.body, it's read on the loop).
+    Process views get a DetachedRequest (payload, session, user id, user), their payload and response must pickle
+    and the view must be a module level function.
+    Both get their user looked up on the loop before they run, flag them with needs_user(False) to skip it.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"ExecutionPolicyError: unknown policy '{policy}', expected one of {', '.join(POLICIES)}")
+    def decorator(view):
+        view.execution = policy
+        return view
+    return decorator
+
+class DetachedRequest:
+    """Picklable stand-in of a Request for process views."""
+    __slots__ = ("payload", "sessionid", "userid", "user", "received_at")
+
+    def __init__(self, payload, sessionid:str, userid, user, received_at:float):
+        self.payload = payload
+        self.sessionid = sessionid
+        self.userid = userid
+        self.user = user
+        self.received_at = received_at
+
+    @property
+    def body(self):
+        return None
+
+    @property
+    def timestamp(self) -> str:
+        received_at = datetime.fromtimestamp(self.received_at)
+        return f"{received_at:%Y-%m-%d %H:%M:%S}.{received_at.microsecond // 1000:03}"
+
+    @classmethod
+    def of(cls, request, with_user:bool):
+        # the user is looked up on the loop beforehand when the view reads it (see Setup.respond)
+        return cls(request.payload, request.sessionid, request.userid, request.user if with_user else None, request.received_at)
+
+def run_view(view, request):
+    # runs in the pool, returns when it started so the loop can tell queueing from running
+    # NOTE wall clock, the monotonic clocks of two processes aren't comparable
+    return time.time(), view(request)
+
+class ViewExecutors:
+    """Thread & process pools of offloaded views (created on first use, so each worker process gets its own)."""
+    def __init__(self, thread_workers:int=8, process_workers:int=2, loop_budget:float=0.1):
+        self.workers = {THREAD: thread_workers, PROCESS: process_workers}
+        self.loop_budget = loop_budget # seconds a sync view may hold the loop before a warning, None disables it
+        self.pools = dict()
+        self.inflight = {THREAD: 0, PROCESS: 0} # submitted calls not completed yet
+        self.stats = Stats()
+        self.over_budget = set() # views already warned about
+        self.logger = logging.getLogger("main_logger")
+
+    def pool(self, policy:str):
+        pool = self.pools.get(policy)
+        if pool is None:
+            if policy == THREAD:
+                pool = ThreadPoolExecutor(self.workers[THREAD], thread_name_prefix="fluxon-view")
+            else:
+                pool = ProcessPoolExecutor(self.workers[PROCESS])
+            self.pools[policy] = pool
+        return pool
+
+    def queue_depth(self, policy:str) -> int:
+        # calls past the pool size wait for a worker
+        return max(0, self.inflight[policy] - self.workers[policy])
+
+    def wrap(self, view_name:str, view, policy:str, needs_user:bool=False):
+        """Call chain terminal of a sync view, None when it runs on the loop and there's nothing to watch."""
+        if inspect.iscoroutinefunction(view) or inspect.isasyncgenfunction(view):
+            if policy != LOOP:
+                self.logger.warning(f"[ViewExecutors] Async view '{view_name}' already runs on the loop, '{policy}' policy ignored")
+            return None
+        if policy == LOOP:
+            return self.watched(view_name, view) if self.loop_budget else None
+        return self.offloaded(view_name, view, policy, needs_user)
+
+    def watched(self, view_name:str, view):
+        async def loop_view(request):
+            started = time.perf_counter()
+            response = view(request)
+            elapsed = time.perf_counter() - started
+            if isinstance(response, Coroutine): # only the sync part holds the loop
+                response = await response
+            if elapsed > self.loop_budget:
+                self.stats.incr(f"over_budget|{view_name}")
+                if view_name not in self.over_budget: # once per view, the counter keeps track of the rest
+                    self.over_budget.add(view_name)
+                    self.logger.warning(
+                        f"[ViewExecutors] Sync view '{view_name}' held the event loop for {elapsed * 1000:.1f} ms "
+                        f"(budget {self.loop_budget * 1000:.0f} ms), consider @run_in('thread') or @run_in('process')"
+                    )
+            return response
+        return loop_view
+
+    def offloaded(self, view_name:str, view, policy:str, needs_user:bool):
+        async def pooled_view(request):
+            loop = asyncio.get_running_loop()
+            argument = DetachedRequest.of(request, needs_user) if policy == PROCESS else request
+            self.inflight[policy] += 1
+            self.stats.incr(f"{policy}_calls")
+            depth = self.queue_depth(policy)
+            if depth > self.stats.counters[f"{policy}_max_queue_depth"]:
+                self.stats.counters[f"{policy}_max_queue_depth"] = depth
+            submitted = time.time()
+            try:
+                started, response = await loop.run_in_executor(self.pool(policy), run_view, view, argument)
+            finally:
+                self.inflight[policy] -= 1
+            completed = time.time()
+            self.stats.observe(f"{policy}_wait", max(0.0, started - submitted))
+            self.stats.observe(f"{policy}_run", max(0.0, completed - started))
+            return response
+        return pooled_view
+
+    def snapshot(self) -> dict:
+        snapshot = self.stats.snapshot()
+        for policy in (THREAD, PROCESS):
+            snapshot[f"{policy}_inflight"] = self.inflight[policy]
+            snapshot[f"{policy}_queue_depth"] = self.queue_depth(policy)
+        return snapshot
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.pools.clear()
+
+class SchedulePolicy:
+    __slots__ = ("priority", "concurrency")
+
+    def __init__(self, priority:str=NORMAL, concurrency:int=None):
+        self.priority = priority
+        self.concurrency = concurrency # calls of the view running at once, None = no limit of its own
+
+DEFAULT_SCHEDULE = SchedulePolicy()
+
+def schedule(priority:str=NORMAL, concurrency:int=None):
+    """
+    View decorator, priority class ("interactive", "normal" or "bulk") and concurrency limit of a view.
+    Calls past the limit, or past the server wide max_active_calls, wait their turn; queued calls are admitted
+    most urgent class first as running ones complete.
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"SchedulingError: unknown priority '{priority}', expected one of {', '.join(PRIORITIES)}")
+    if concurrency is not None and concurrency < 1:
+        raise ValueError("SchedulingError: concurrency should be at least 1")
+    def decorator(view):
+        view.schedule = SchedulePolicy(priority, concurrency)
+        return view
+    return decorator
+
+class ViewScheduler:
+    """
+    Admits view calls under per-view limits and a server wide one (`max_active`, None = unbounded).
+    NOTE a queued call only ever waits on a full limit: whenever a slot frees up the queues are walked
+    (interactive, normal then bulk, in arrival order within a class) and whatever fits is admitted.
+    """
+    def __init__(self, max_active:int=None):
+        self.max_active = max_active
+        self.active = 0
+        self.view_active = defaultdict(int) # view name -> running calls
+        self.queues = {priority: deque() for priority in PRIORITIES} # (future, view name, policy, queued at)
+        self.stats = Stats()
+
+    def has_room(self, view_name:str, policy:SchedulePolicy) -> bool:
+        if self.max_active is not None and self.active >= self.max_active:
+            return False
+        return policy.concurrency is None or self.view_active[view_name] < policy.concurrency
+
+    def admit(self, view_name:str):
+        self.active += 1
+        self.view_active[view_name] += 1
+
+    async def acquire(self, view_name:str, policy:SchedulePolicy):
+        self.stats.incr(f"{policy.priority}_calls")
+        if self.has_room(view_name, policy): # nothing queued could take this slot, see the class NOTE
+            self.admit(view_name)
+            return
+        self.stats.incr(f"{policy.priority}_queued")
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (waiter, view_name, policy, time.perf_counter())
+        self.queues[policy.priority].append(entry)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled(): # admitted right before the caller went away
+                self.release(view_name)
+            elif entry in self.queues[policy.priority]:
+                self.queues[policy.priority].remove(entry)
+            raise
+
+    def release(self, view_name:str):
+        self.active -= 1
+        self.view_active[view_name] -= 1
+        if not self.view_active[view_name]:
+            del self.view_active[view_name]
+        self.admit_queued()
+
+    def admit_queued(self):
+        for priority in PRIORITIES:
+            queue = self.queues[priority]
+            if not queue:
+                continue
+            waiting = deque()
+            while queue:
+                if self.max_active is not None and self.active >= self.max_active:
+                    queue.extendleft(reversed(waiting))
+                    return
+                entry = queue.popleft()
+                waiter, view_name, policy, queued_at = entry
+                if waiter.done(): # cancelled
+                    continue
+                if not self.has_room(view_name, policy): # its view is at its limit, the next one may fit
+                    waiting.append(entry)
+                    continue
+                self.admit(view_name)
+                self.stats.observe(f"{priority}_queue_time", time.perf_counter() - queued_at)
+                waiter.set_result(None)
+            queue.extend(waiting)
+
+    def wrap(self, view_name:str, view, policy:SchedulePolicy):
+        """
+        Call chain layer admitting the view's calls (inside the single-flight and response cache ones).
+        NOTE a streaming view holds its slot until it returns its generator, not while the stream is sent
+        """
+        async def scheduled_view(request):
+            await self.acquire(view_name, policy)
+            try:
+                response = view(request)
+                if isinstance(response, Coroutine):
+                    response = await response
+                return response
+            finally:
+                self.release(view_name)
+        return scheduled_view
+
+    def snapshot(self) -> dict:
+        snapshot = self.stats.snapshot()
+        snapshot.update(active=self.active, max_active=self.max_active)
+        for priority in PRIORITIES:
+            snapshot[f"{priority}_waiting"] = len(self.queues[priority])
+        return snapshot
@@ -0,0 +1,49 @@
+from collections import defaultdict
+
+# Lightweight in-process counters and timers (server stats, console "stats" command)
+
+class Timer:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds:float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "avg_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3)
+        }
+
+class Stats:
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.timers = defaultdict(Timer)
+
+    def incr(self, name:str, amount:int=1):
+        self.counters[name] += amount
+
+    def observe(self, name:str, seconds:float):
+        self.timers[name].observe(seconds)
+
+    def ratio(self, numerator:str, denominator:str) -> float:
+        denominator = self.counters.get(denominator, 0)
+        return round(self.counters.get(numerator, 0) / denominator, 4) if denominator else 0.0
+
+    def snapshot(self) -> dict:
+        snapshot = dict(self.counters)
+        snapshot.update({name: timer.snapshot() for name, timer in self.timers.items()})
+        return snapshot
+
+    def reset(self):
+        self.counters.clear()
+        self.timers.clear()
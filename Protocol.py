@@ -0,0 +1,208 @@
+import struct
+import json
+
+# Wire framing shared by the endpoints and the client interface.
+# NOTE keep this module free of server imports, Connect.py depends on it
+
+# legacy frames: 5 ascii digits (payload length) followed by the payload
+LEGACY_HEADER_SIZE = 5
+LEGACY_MAX_PAYLOAD = 99999
+
+# v2 frames: fixed-width binary header followed by the payload
+FRAME_MAGIC = 0xFB # never an ascii digit, so a v2 header can't be mistaken for a legacy one
+FRAME_VERSION = 2
+FRAME_HEADER = struct.Struct("!BBBBI") # magic | version | flags | frame type | payload length
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+MAX_FRAME_PAYLOAD = 0xFFFFFFFF
+
+# frame types
+FRAME_REQUEST = 1
+FRAME_RESPONSE = 2
+FRAME_REVERSE = 3 # server-side requests pushed to receiver sockets
+FRAME_HANDSHAKE = 4
+FRAME_BUSY = 5 # load shed, the payload is a uint32 retry-after delay in milliseconds
+FRAME_BATCH = 6 # `session|calls`, calls is a codec encoded list of [view, payload] pairs, answered with one response frame
+FRAME_BODY = 7 # one chunk of a streamed request body, FLAG_END on the last one
+
+# frame flags (bit field)
+FLAGS_NONE = 0
+FLAG_REQUEST_ID = 0x01 # a uint32 request id follows the header (pipelined requests)
+FLAG_RAW = 0x02 # payload was serialized by the view itself, the codec is skipped on both ends
+FLAG_COMPRESSED = 0x04 # payload is compressed with the connection's negotiated compression
+FLAG_STREAM = 0x08 # response frame is one item of a streaming view, more frames follow (on a request, its body follows in FRAME_BODY frames)
+FLAG_END = 0x10 # with FLAG_STREAM, end of the stream (empty body, or the error that ended it)
+FLAG_DEADLINE = 0x20 # a uint32 deadline follows the header extensions before it, milliseconds the client still waits for the response
+
+# optional header extensions, present in this order when their flag is set (counted in the payload length)
+REQUEST_ID = struct.Struct("!I")
+MAX_REQUEST_ID = 0xFFFFFFFF
+DEADLINE = struct.Struct("!I") # relative, the two ends' clocks aren't comparable
+MAX_DEADLINE = 0xFFFFFFFF
+
+RETRY_AFTER = struct.Struct("!I") # FRAME_BUSY payload
+
+class FrameError(Exception):
+    """Raised when a frame can't be encoded or decoded."""
+    pass
+
+class Frame:
+    __slots__ = ("version", "frame_type", "flags", "payload", "request_id", "deadline")
+
+    def __init__(self, payload, version:int=1, frame_type:int=FRAME_REQUEST, flags:int=FLAGS_NONE, request_id:int=None, deadline:int=None):
+        self.payload = payload
+        self.version = version
+        self.frame_type = frame_type
+        self.flags = flags
+        self.request_id = request_id
+        self.deadline = deadline # milliseconds, from when the frame was sent
+
+    def __repr__(self):
+        return f"Frame(v{self.version}, type={self.frame_type}, flags={self.flags:#04x}, id={self.request_id}, {len(self.payload)} bytes)"
+
+def legacy_frame(payload:bytes) -> bytes:
+    if len(payload) > LEGACY_MAX_PAYLOAD:
+        raise FrameError(
+            f"FrameTooLarge: {len(payload)} bytes can't fit in a legacy frame (max {LEGACY_MAX_PAYLOAD}), negotiate frame_version {FRAME_VERSION}"
+        )
+    return str(len(payload)).zfill(LEGACY_HEADER_SIZE).encode('utf-8') + payload
+
+def pack_header(length:int, frame_type:int=FRAME_RESPONSE, flags:int=FLAGS_NONE) -> bytes:
+    if length > MAX_FRAME_PAYLOAD:
+        raise FrameError(f"FrameTooLarge: {length} bytes exceeds the frame limit ({MAX_FRAME_PAYLOAD})")
+    return FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, flags, frame_type, length)
+
+def pack_extensions(flags:int, request_id:int=None, deadline:int=None) -> tuple[int, bytes]:
+    extensions = b''
+    if request_id is not None:
+        flags |= FLAG_REQUEST_ID
+        extensions += REQUEST_ID.pack(request_id)
+    if deadline is not None:
+        flags |= FLAG_DEADLINE
+        extensions += DEADLINE.pack(min(max(deadline, 0), MAX_DEADLINE))
+    return flags, extensions
+
+def extensions_size(flags:int) -> int:
+    size = 0
+    if flags & FLAG_REQUEST_ID:
+        size += REQUEST_ID.size
+    if flags & FLAG_DEADLINE:
+        size += DEADLINE.size
+    return size
+
+def read_extensions(frame:Frame, buffer, offset:int=0) -> int:
+    """Fills the frame's extension fields from `buffer`, returns the offset right after them."""
+    if frame.flags & FLAG_REQUEST_ID:
+        frame.request_id, = REQUEST_ID.unpack_from(buffer, offset)
+        offset += REQUEST_ID.size
+    if frame.flags & FLAG_DEADLINE:
+        frame.deadline, = DEADLINE.unpack_from(buffer, offset)
+        offset += DEADLINE.size
+    return offset
+
+def pack_frame(payload:bytes, frame_type:int=FRAME_RESPONSE, flags:int=FLAGS_NONE, request_id:int=None, deadline:int=None) -> bytes:
+    flags, extensions = pack_extensions(flags, request_id, deadline)
+    return pack_header(len(extensions) + len(payload), frame_type, flags) + extensions + payload
+
+def frame_message(payload:bytes, version:int, frame_type:int=FRAME_RESPONSE, flags:int=FLAGS_NONE, request_id:int=None, deadline:int=None) -> bytes:
+    """Frames `payload` for a peer speaking the given frame version (legacy frames carry no extension)."""
+    if version >= FRAME_VERSION:
+        return pack_frame(payload, frame_type, flags, request_id, deadline)
+    return legacy_frame(payload)
+
+def unpack_header(header) -> tuple[int, int, int]:
+    """Returns (flags, frame_type, length) from a v2 header, raises FrameError on a malformed one."""
+    magic, version, flags, frame_type, length = FRAME_HEADER.unpack(header)
+    if magic != FRAME_MAGIC:
+        raise FrameError(f"InvalidFrame: bad magic byte {magic:#04x}")
+    if version != FRAME_VERSION:
+        raise FrameError(f"InvalidFrame: unsupported frame version {version}")
+    if length < extensions_size(flags):
+        raise FrameError("InvalidFrame: truncated header extensions")
+    return flags, frame_type, length
+
+def unpack_header_from(buffer, offset:int=0) -> tuple[int, int, int]:
+    """Same as unpack_header, reads the header in place (no slicing of the receive buffer)."""
+    magic, version, flags, frame_type, length = FRAME_HEADER.unpack_from(buffer, offset)
+    if magic != FRAME_MAGIC:
+        raise FrameError(f"InvalidFrame: bad magic byte {magic:#04x}")
+    if version != FRAME_VERSION:
+        raise FrameError(f"InvalidFrame: unsupported frame version {version}")
+    if length < extensions_size(flags):
+        raise FrameError("InvalidFrame: truncated header extensions")
+    return flags, frame_type, length
+
+def split_request(request, search_limit:int=1024):
+    """
+    Splits `view|session|data` into its three fields.
+    Works on bytes and memoryview; for a memoryview the data field stays a view (no copy).
+    """
+    if not isinstance(request, memoryview):
+        return request.split(b"|", 2)
+    head = bytes(request[:search_limit])
+    fields = head.split(b"|", 2)
+    if len(fields) < 3: # separators beyond the search window
+        return bytes(request).split(b"|", 2)
+    offset = len(fields[0]) + len(fields[1]) + 2
+    return fields[0], fields[1], request[offset:]
+
+def parse_legacy_header(header) -> int:
+    """Returns the payload length of a legacy 5-digit header, -1 if it isn't one."""
+    if len(header) != LEGACY_HEADER_SIZE or not bytes(header).isdigit():
+        return -1
+    return int(header)
+
+def negotiate_frame_version(options) -> int:
+    """Picks the frame version for a connection from the `_` handshake options."""
+    if isinstance(options, dict):
+        requested = options.get("frame_version", 1)
+        if isinstance(requested, int) and requested >= FRAME_VERSION:
+            return FRAME_VERSION
+    return 1
+
+def handshake_options(**options) -> bytes:
+    return json.dumps(options).encode('utf-8')
+
+# blocking helpers (client side)
+
+def recv_exactly(sock, size:int, buffer_size_limit:int=65536):
+    chunks = []
+    received = 0
+    while received < size:
+        chunk = sock.recv(min(size - received, buffer_size_limit))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        received += len(chunk)
+    return b''.join(chunks)
+
+def recv_frame(sock, buffer_size_limit:int=65536):
+    """Reads one frame (legacy or v2) from a blocking socket, None if the connection closed."""
+    first_byte = sock.recv(1)
+    if not first_byte:
+        return None
+    if first_byte[0] == FRAME_MAGIC:
+        rest = recv_exactly(sock, FRAME_HEADER_SIZE - 1)
+        if rest is None:
+            return None
+        flags, frame_type, length = unpack_header(first_byte + rest)
+        frame = Frame(b'', FRAME_VERSION, frame_type, flags)
+        extensions_length = extensions_size(flags)
+        if extensions_length:
+            extensions = recv_exactly(sock, extensions_length)
+            if extensions is None:
+                return None
+            read_extensions(frame, extensions)
+        frame.payload = recv_exactly(sock, length - extensions_length, buffer_size_limit)
+        if frame.payload is None:
+            return None
+        return frame
+    rest = recv_exactly(sock, LEGACY_HEADER_SIZE - 1)
+    if rest is None:
+        return None
+    length = parse_legacy_header(first_byte + rest)
+    if length < 0:
+        raise FrameError("InvalidFrame: malformed legacy header")
+    payload = recv_exactly(sock, length, buffer_size_limit)
+    if payload is None:
+        return None
+    return Frame(payload, 1, FRAME_RESPONSE)
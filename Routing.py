@@ -1,10 +1,16 @@
 from Fluxon.Cloud.AuthorizationModels import RoleBasedAccessControl
 from Fluxon.Database.db_core_interface import DatabaseAPI
 from Fluxon.Database.Models import Field
-from Fluxon.Endpoint.auth_context import generate_signed_sessionid, AuthenticatedUser
+from Fluxon.Endpoint.auth_context import generate_signed_sessionid, SessionTokens, AuthenticatedUser, UserCache
+from Fluxon.Endpoint.session_registry import SessionRegistry
+from Fluxon.Endpoint.session_store import SessionStore
+from Fluxon.Endpoint.session_snapshot import SessionSnapshot
 from Fluxon.Security import Secrets
 from collections.abc import Coroutine
 from Fluxon.Database.Models import MODELS_INFO
+from Fluxon.Metrics import Stats
+from Fluxon.Caching import ResponseCache, SingleFlight
+from Fluxon.Execution import ViewExecutors, ViewScheduler, LOOP, THREAD, PROCESS, DEFAULT_SCHEDULE
 import asyncio
 import traceback
 import pathlib
@@ -13,70 +19,118 @@ import logging
 import time
 from datetime import datetime
 
-SESSION_USER_LOOKUP = dict()
+logger = logging.getLogger("main_logger")
+SESSIONS = SessionRegistry() # live sessions: session <-> user, session -> connections
+SESSION_TOKENS = SessionTokens() # signs & verifies session ids, keyed with the server's private key by Setup
+USER_CACHE = UserCache() # user id -> AuthenticatedUser, saves the user lookup of logged in sessions
+RESPONSE_CACHE = ResponseCache() # encoded responses of views decorated with Caching.cache_response
+SINGLE_FLIGHT = SingleFlight() # in-flight executions of views decorated with Caching.single_flight
+VIEW_EXECUTORS = ViewExecutors() # pools of sync views decorated with Execution.run_in
+VIEW_SCHEDULER = ViewScheduler() # concurrency limits & priority classes (Execution.schedule)
 authorized_user_model: DatabaseAPI # Global variable to hold the authorized user model (hand-wavy I know but it works)
 
 def dynamic_views_loading(module):
     functions = {name: obj for name, obj in inspect.getmembers(module) if inspect.isfunction(obj)}
     return functions
 
+UNRESOLVED = object() # lazy Request fields not computed yet
+
 class Request:
+    # NOTE one of these per request, keep it lean: timestamp, userid & user are computed on first access
+    __slots__ = ("connection", "server", "payload", "body", "sessionid", "received_at", "deadline", "_timestamp", "_userid", "_user")
+
     @staticmethod
     async def _analyze_user_query(query):
         if isinstance(query, Coroutine): # for async database APIs
-            return Request._analyze_user_query(await query)
+            return await Request._analyze_user_query(await query)
         elif isinstance(query, list):
             return AuthenticatedUser(*query[0])
         else:
             return False
 
+    def _user_query(self):
+        return authorized_user_model.Check(
+            where=f"id = {self.userid}",
+            fetch=1,
+            columns=['id', 'username', 'email']
+        )
+
     async def _find_user(self):
         try:
             if self.userid:
-                self.user = await Request._analyze_user_query(
-                    authorized_user_model.Check(
-                        where=f"id = {self.userid}",
-                        fetch=1,
-                        columns=['id', 'username', 'email']
-                    )
-                )
+                user = USER_CACHE.get(self.userid)
+                if user is None:
+                    generation = USER_CACHE.generation
+                    user = await Request._analyze_user_query(self._user_query())
+                    if user:
+                        USER_CACHE.put(self.userid, user, generation)
+                self._user = user
             else:
-                self.user = None
+                self._user = None
         except Exception as e:
             traceback.print_exc()
             raise RuntimeError(
                 f"{e}: Invalid AuthenticatedUser Model | AuthenticatedUser model should have 'username' and 'email' fields, and the default 'id' AutoField as the primary key"
             ) from e
 
-    async def _auth(self):
+    def _bind_session(self):
         if not self.connection.sessionid:
-            if self.sessionid:
-                if self.sessionid in self.connection.server.SESSION_CONNECTION_LOOKUP:
-                    if self.connection in self.connection.server.SESSION_CONNECTION_LOOKUP[self.sessionid]:
-                        self.connection.sessionid = self.sessionid
-                    else:
-                        self.connection.server.SESSION_CONNECTION_LOOKUP[self.sessionid].append(self.connection)
-                        self.connection.sessionid = self.sessionid
-                else:
-                    self.sessionid = generate_signed_sessionid(self.connection, self.connection.server.router.private_key)
+            # NOTE the signature is checked before anything is looked up, forged or expired ids get a fresh session
+            if self.sessionid and SESSION_TOKENS.verify(self.sessionid):
+                # issued by this process, another worker or before a restart, all the same
+                SESSIONS.add_connection(self.sessionid, self.connection)
+                self.connection.sessionid = self.sessionid
             else:
-                self.sessionid = generate_signed_sessionid(self.connection, self.connection.server.router.private_key)
-        if self.connection.sessionid in SESSION_USER_LOOKUP:
-            self.connection.userid = SESSION_USER_LOOKUP[self.connection.sessionid]
-            self.userid = SESSION_USER_LOOKUP[self.connection.sessionid]
-        else:
-            self.userid = None
-            self.connection.userid = None
+                self.sessionid = generate_signed_sessionid(self.connection, SESSION_TOKENS)
+
+    async def _auth(self):
+        self._bind_session()
         # figure authenticated user
         await self._find_user()
 
+    @property
+    def userid(self):
+        if self._userid is UNRESOLVED:
+            self._userid = SESSIONS.user_of(self.connection.sessionid)
+            self.connection.userid = self._userid
+        return self._userid
+
+    @property
+    def user(self):
+        if self._user is UNRESOLVED: # resolved before the view runs unless it can be looked up here (see uses_user)
+            if not self.userid:
+                self._user = None
+            elif (user := USER_CACHE.get(self.userid)) is not None:
+                self._user = user
+            else:
+                generation = USER_CACHE.generation
+                query = self._user_query()
+                if isinstance(query, Coroutine):
+                    query.close()
+                    raise RuntimeError("request.user needs an async database lookup here, flag the view with @needs_user() or use `await request.get_user()`")
+                self._user = AuthenticatedUser(*query[0]) if isinstance(query, list) else False
+                if self._user:
+                    USER_CACHE.put(self.userid, self._user, generation)
+        return self._user
+
+    async def get_user(self):
+        if self._user is UNRESOLVED:
+            await self._find_user()
+        return self._user
+
+    @property
+    def timestamp(self) -> str:
+        if self._timestamp is None:
+            received_at = datetime.fromtimestamp(self.received_at)
+            self._timestamp = f"{received_at:%Y-%m-%d %H:%M:%S}.{received_at.microsecond // 1000:03}"
+        return self._timestamp
+
     def login(self, id_):
         if self.connection.sessionid:
-            session_removed = [session for session, user_id in SESSION_USER_LOOKUP.items() if user_id == id_]
-            for session in session_removed:
-                del SESSION_USER_LOOKUP[session]
             if type(id_) == int:
-                SESSION_USER_LOOKUP[self.connection.sessionid] = id_
+                SESSIONS.login(self.connection.sessionid, id_) # the user's other sessions are logged out
+                USER_CACHE.invalidate(id_) # fresh row for the new session
+                self._userid = self._user = UNRESOLVED
                 return True
             else:
                 raise TypeError(
@@ -86,13 +140,144 @@ class Request:
             print(" - Failed to login [INVALID SESSION]")
             return False
 
+    def derive(self, payload):
+        # same session and authenticated user, another payload (batch calls share one authentication)
+        request = Request.__new__(Request)
+        for name in Request.__slots__:
+            setattr(request, name, getattr(self, name))
+        request.payload = payload
+        return request
+
     def __init__(self, payload:dict, connection, sessionid:str):
         self.connection = connection
         self.server = connection.server
-        self.timestamp = f"{datetime.now():%Y-%m-%d %H:%M:%S}.{datetime.now().microsecond // 1000:03}"
         self.payload = payload
+        self.body = None
         self.sessionid = sessionid
-        print(f"{self.timestamp} - request received from {self.connection.peername[0]}:{self.connection.peername[1]}")
+        self.received_at = time.time()
+        self.deadline = None # time.monotonic() the client stops waiting at (frames flagged with a deadline), the view is cancelled past it
+        self._timestamp = None
+        self._userid = self._user = UNRESOLVED
+        logger.debug("request received from %s:%s", connection.peername[0], connection.peername[1])
+
+VIEWS_USING_USER = dict() # view -> whether it reads request.user
+
+USER_NAMES = frozenset(("user", "get_user"))
+
+def needs_user(needed:bool=True):
+    """
+    View (or middleware) decorator, whether the user is looked up before it runs.
+    Flag the views reading request.user, uses_user only guesses for the others.
+    """
+    def decorator(view):
+        view.needs_user = needed
+        return view
+    return decorator
+
+def references_user(code, namespace:dict, seen:set, depth:int=3) -> bool:
+    # names & strings (getattr) the code references, its nested functions, and up to `depth` levels of the module's functions it calls
+    if code in seen:
+        return False
+    seen.add(code)
+    if not USER_NAMES.isdisjoint(code.co_names) or not USER_NAMES.isdisjoint(const for const in code.co_consts if isinstance(const, str)):
+        return True
+    if any(references_user(const, namespace, seen, depth) for const in code.co_consts if inspect.iscode(const)):
+        return True
+    if depth:
+        for name in code.co_names:
+            helper = namespace.get(name)
+            if inspect.isfunction(helper) and references_user(helper.__code__, helper.__globals__, seen, depth - 1):
+                return True
+    return False
+
+def function_references_user(function, seen:set) -> bool:
+    code = getattr(function, "__code__", None)
+    if code is None: # not a plain function, assume it does
+        return True
+    if references_user(code, function.__globals__, seen):
+        return True
+    # decorated views: the function they wrap (functools.wraps) or hold in their closure
+    inner = [getattr(function, "__wrapped__", None)]
+    for cell in function.__closure__ or ():
+        try:
+            inner.append(cell.cell_contents)
+        except ValueError: # empty cell
+            pass
+    return any(inspect.isfunction(candidate) and function_references_user(candidate, seen) for candidate in inner)
+
+def uses_user(view) -> bool:
+    """
+    Whether the user is looked up before a view (or middleware) runs, as flagged with needs_user.
+    Unflagged ones are guessed once from their code, see references_user.
+    NOTE a view the guess misses has request.user look the user up on the fly, sync database APIs only
+    (it raises with async ones, flag the view or use `await request.get_user()`)
+    """
+    needed = getattr(view, "needs_user", None)
+    if needed is not None:
+        return bool(needed)
+    try:
+        return VIEWS_USING_USER[view]
+    except KeyError:
+        pass
+    VIEWS_USING_USER[view] = using = function_references_user(view, set())
+    return using
+
+# middleware
+
+class Middleware:
+    __slots__ = ("function", "name", "views", "exclude")
+
+    def __init__(self, function, name:str, views=None, exclude=()):
+        self.function = function # async (request, call_next) -> response
+        self.name = name
+        self.views = set(views) if views is not None else None # None = every view
+        self.exclude = set(exclude)
+
+    def applies_to(self, view_name:str, view) -> bool:
+        if self.views is not None and view_name not in self.views:
+            return False
+        if view_name in self.exclude:
+            return False
+        skipped = getattr(view, "skip_middleware", None)
+        return skipped is None or bool(skipped) and self.name not in skipped
+
+def skip_middleware(*names):
+    """View decorator, the view opts out of the named middlewares (all of them when no name is given)."""
+    def decorator(view):
+        view.skip_middleware = frozenset(names)
+        return view
+    return decorator
+
+class CompiledView:
+    __slots__ = ("function", "chain", "needs_user", "layers")
+
+    def __init__(self, function, chain, needs_user:bool, layers:list):
+        self.function = function
+        self.chain = chain # async (request) -> response, None when no middleware applies (the view is called directly)
+        self.needs_user = needs_user # the view or one of its middlewares reads request.user
+        self.layers = layers # middleware names, outermost first
+
+def timed_view(view, timer):
+    async def call_view(request):
+        started = time.perf_counter()
+        try:
+            response = view(request)
+            if isinstance(response, Coroutine):
+                response = await response
+            return response
+        finally:
+            timer.observe(time.perf_counter() - started)
+    return call_view
+
+def timed_layer(middleware, call_next, timer):
+    # NOTE the timer includes the inner layers, middleware_report subtracts them
+    async def layer(request):
+        started = time.perf_counter()
+        try:
+            return await middleware(request, call_next)
+        finally:
+            timer.observe(time.perf_counter() - started)
+    return layer
 
 def analyze_roles(cloud_auth_model):
     subclasses = []
@@ -112,19 +297,138 @@ class InvalidDatabaseAPI(Exception):
     pass
 
 class Setup:
-    async def respond(self, view, payload, connection, sessionid):
-        if view in self.mapping:
+    # middleware (Setup.use), compiled into one flat call chain per view on the first request
+    middlewares = ()
+    chains: dict = None # view name -> CompiledView
+    middleware_stats: Stats = None
+    sessions = SESSIONS
+    session_tokens = SESSION_TOKENS
+    session_snapshot: SessionSnapshot = None
+    response_cache = RESPONSE_CACHE
+    single_flight = SINGLE_FLIGHT
+    executors = VIEW_EXECUTORS
+    scheduler = VIEW_SCHEDULER
+
+    def use(self, middleware, name:str=None, views=None, exclude=()):
+        """
+        Registers a middleware, `async def middleware(request, call_next)` returning the response.
+        `await call_next(request)` runs the rest of the chain (not calling it short-circuits the view).
+        Middlewares run in registration order, first one outermost, on every view or only on `views`;
+        views in `exclude` or decorated with skip_middleware don't go through it at all.
+        """
+        self.middlewares = (*self.middlewares, Middleware(middleware, name or middleware.__name__, views, exclude))
+        self.chains = None
+
+    def compile_chains(self) -> dict:
+        self.middleware_stats = Stats()
+        chains = dict()
+        for view_name, function in self.mapping.items():
+            layers = [middleware for middleware in self.middlewares if middleware.applies_to(view_name, function)]
+            policy = getattr(function, "execution", LOOP)
+            # NOTE pool views get the user looked up on the loop unless flagged needs_user(False): a process view can't
+            # look it up itself, a thread view would query from the pool on the loop's database connection
+            with_user = uses_user(function) or policy in (THREAD, PROCESS) and getattr(function, "needs_user", None) is None
+            reads_user = with_user or any(uses_user(middleware.function) for middleware in layers)
+            view = chain = self.executors.wrap(view_name, function, policy, with_user)
+            if getattr(function, "schedule", None) is not None or self.scheduler.max_active is not None:
+                view = chain = self.scheduler.wrap(view_name, view or function, getattr(function, "schedule", DEFAULT_SCHEDULE))
+            if getattr(function, "single_flight", None) is not None:
+                view = chain = self.single_flight.wrap(view_name, view or function, function.single_flight)
+            if getattr(function, "response_cache", None) is not None: # innermost, middlewares still run on hits
+                view = chain = self.response_cache.wrap(view_name, view or function, function.response_cache)
+            if layers:
+                chain = timed_view(view or function, self.middleware_stats.timers[f"{view_name}|view"])
+                for middleware in reversed(layers):
+                    chain = timed_layer(middleware.function, chain, self.middleware_stats.timers[f"{view_name}|{middleware.name}"])
+            chains[view_name] = CompiledView(function, chain, reads_user, [middleware.name for middleware in layers])
+        self.chains = chains
+        return chains
+
+    def compiled(self, view:str) -> CompiledView:
+        compiled = self.chains.get(view) if self.chains is not None else None
+        if compiled is None and view in self.mapping: # first request, or mapping changed since
+            compiled = self.compile_chains()[view]
+        return compiled
+
+    def invalidate(self, *tags):
+        """Drops the cached responses stored under any of `tags` (all of them without tags), for write paths."""
+        self.response_cache.invalidate(*tags)
+
+    def middleware_report(self) -> dict:
+        """Time spent in each middleware itself (inner layers and the view excluded), across every view."""
+        report = dict()
+        timers = self.middleware_stats.timers if self.middleware_stats else {}
+        for view_name, compiled in (self.chains or {}).items():
+            names = compiled.layers + ["view"]
+            for name, inner in zip(compiled.layers, names[1:]):
+                timer = timers.get(f"{view_name}|{name}")
+                if timer is None or not timer.count:
+                    continue
+                inner_timer = timers.get(f"{view_name}|{inner}")
+                count, total = report.get(name, (0, 0.0))
+                report[name] = (count + timer.count, total + timer.total - (inner_timer.total if inner_timer else 0.0))
+        return {
+            name: {"count": count, "total_ms": round(total * 1000, 3), "avg_ms": round(total * 1000 / count, 3)}
+            for name, (count, total) in report.items()
+        }
+
+    async def respond(self, view, payload, connection, sessionid, body=None, deadline:float=None):
+        compiled = self.compiled(view)
+        if compiled is not None:
             request = Request(
                 payload, connection, sessionid
             )
-            await request._auth()
-            response = self.mapping[view](request)
+            request.body = body # streamed request body (async iterator of chunks), None for plain requests
+            request.deadline = deadline
+            request._bind_session()
+            if compiled.needs_user: # only pay for the user lookup when the view reads it
+                await request._find_user()
+            if compiled.chain is not None:
+                return await compiled.chain(request)
+            response = compiled.function(request)
             if isinstance(response, Coroutine):
                 return await response
             return response
         else:
             return {"response": f"view '{view}' not found"}
 
+    async def respond_batch(self, calls:list, connection, sessionid, concurrency:int=8, deadline:float=None):
+        """
+        Runs a batch of [view, payload] calls concurrently (at most `concurrency` at a time), the session is authenticated once.
+        Returns one item per call, {"response": ...} or {"error": ...}, a failing call doesn't fail the batch.
+        """
+        request = Request(None, connection, sessionid)
+        request.deadline = deadline
+        request._bind_session()
+        views = [self.compiled(item[0]) for item in calls if isinstance(item, (list, tuple)) and item and isinstance(item[0], str)]
+        if any(compiled is not None and compiled.needs_user for compiled in views):
+            await request._find_user()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(item):
+            if not (isinstance(item, (list, tuple)) and len(item) == 2 and isinstance(item[0], str)):
+                return {"error": "InvalidCall: batch calls should be [view, payload] pairs"}
+            view, payload = item
+            compiled = self.compiled(view)
+            if compiled is None:
+                return {"error": f"view '{view}' not found"}
+            async with semaphore:
+                try:
+                    if compiled.chain is not None:
+                        response = await compiled.chain(request.derive(payload))
+                    else:
+                        response = compiled.function(request.derive(payload))
+                    if isinstance(response, Coroutine):
+                        response = await response
+                    elif inspect.isasyncgen(response): # streaming view, a batch item holds its whole output
+                        response = [item async for item in response]
+                    return {"response": response}
+                except Exception as e:
+                    self.logger.error(f"Batch call to '{view}' failed on connection {connection}: {e}\nTraceback: {traceback.format_exc()}")
+                    return {"error": f"{type(e).__name__}: {e}"}
+
+        return await asyncio.gather(*(call(item) for item in calls))
+
     def get_server_private_key(self): # deprecated/incomplete
         try:
             with open(self.secrets.secrets_dir / "server_private_key.pem") as private_key_file:
@@ -160,6 +464,9 @@ class Setup:
                     attrib.Insert = table.Insert
                     attrib.Update = table.Update
                     attrib.Delete = table.Delete
+                    if attrib is self.authorized_user_model: # keep cached users in sync with their rows
+                        attrib.Update = USER_CACHE.invalidating(table.Update)
+                        attrib.Delete = USER_CACHE.invalidating(table.Delete)
                     
                     # Load field names safely
                     missing_fields = []
@@ -216,7 +523,31 @@ class Setup:
             database_api:DatabaseAPI,
             # cloud setup args
             cloud_folder:pathlib.Path=None,
-            cloud_auth_model:RoleBasedAccessControl=None
+            cloud_auth_model:RoleBasedAccessControl=None,
+            # authenticated users cache (0 disables it)
+            user_cache_size:int=10000,
+            user_cache_ttl:float=60,
+            # view response cache (Caching.cache_response), bytes
+            response_cache_bytes:int=64*1024*1024,
+            # offloaded sync views (Execution.run_in), pool sizes & how long a sync view may hold the loop (None disables the warning)
+            thread_pool_size:int=8,
+            process_pool_size:int=2,
+            loop_budget:float=0.1,
+            # view calls running at once across every view (Execution.schedule), None = unbounded
+            max_active_calls:int=None,
+            # where the session -> user map lives (Endpoint.session_store), None = in this process
+            # (worker mode switches to a temporary SQLiteSessionStore unless a shared store is given)
+            session_store:SessionStore=None,
+            # seconds a session id stays valid after it's issued (its login ends with it)
+            session_ttl:float=7*24*3600,
+            # seconds a session without connections stays logged in (0 = logged out with its last connection),
+            # & how many such sessions are kept at most
+            session_idle_ttl:float=1800,
+            max_idle_sessions:int=100_000,
+            # sessions file kept across restarts (Endpoint.session_snapshot), None disables it,
+            # & seconds between journal flushes
+            session_snapshot_path:pathlib.Path=None,
+            session_snapshot_interval:float=5
     ):
         # start an event loop and set it to the current thread
         self._event_loop = asyncio.new_event_loop()
@@ -225,7 +556,19 @@ class Setup:
         self.logs_path = logs_dir
         self.initiate_logger()
         # server setup
-        self.SESSION_USER_LOOKUP = SESSION_USER_LOOKUP
+        self.user_cache = USER_CACHE
+        self.user_cache.max_size = user_cache_size
+        self.user_cache.ttl = user_cache_ttl
+        self.response_cache.max_bytes = response_cache_bytes
+        self.executors.workers.update(thread=thread_pool_size, process=process_pool_size)
+        self.executors.loop_budget = loop_budget
+        self.scheduler.max_active = max_active_calls
+        if session_store is not None:
+            self.sessions.use_store(session_store)
+        self.sessions.idle_ttl = session_idle_ttl
+        self.sessions.max_idle = max_idle_sessions
+        if session_snapshot_path is not None:
+            self.session_snapshot = SessionSnapshot(session_snapshot_path, session_snapshot_interval)
         self.generate_signed_sessionid = generate_signed_sessionid
         if isinstance(secrets, Secrets):
             self.secrets = secrets
@@ -236,6 +579,8 @@ class Setup:
                 f'[Security] Secrets should be a Fluxon.Security.Secrets object not {type(secrets).__name__}'
             )
         self.get_server_private_key() # NOTE this shit deprecated
+        self.session_tokens.use_key(self.private_key)
+        self.session_tokens.ttl = session_ttl
         self.mapping = mapping
         # database
         self.database_schema_dir = database_schema_dir
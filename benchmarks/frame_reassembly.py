@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import tracemalloc
+from time import perf_counter
+from Fluxon.Endpoint.async_server import AsyncServer
+from Fluxon.Endpoint.frame_protocol import FrameProtocol
+from Fluxon.Protocol import pack_frame, FRAME_REQUEST
+
+# Frame reassembly: StreamReader path (AsyncServer.receive_request) vs BufferedProtocol path (FrameProtocol)
+# Both paths are fed the same byte stream in socket-sized chunks, no network involved.
+
+PAYLOAD_SIZES = [512, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024]
+CHUNK_SIZE = 65536
+TOTAL_BYTES = 64 * 1024 * 1024 # per payload size
+
+def build_stream(payload_size):
+    frame = pack_frame(b"benchmark_test||" + b"x" * (payload_size - 16), FRAME_REQUEST)
+    count = max(1, TOTAL_BYTES // len(frame))
+    return frame * count, count
+
+def make_connection(server):
+    return server.AsyncConnection(peername=("127.0.0.1", 0), reader=None, writer=None, server=server)
+
+class _CountingProtocol(FrameProtocol):
+    """FrameProtocol without a transport, frames are counted and released right away."""
+    def __init__(self, server):
+        super().__init__(server)
+        self.connection = make_connection(server)
+        self.received = 0
+
+    def frame_received(self, frame):
+        self.received += 1
+        self.release(frame)
+
+async def stream_reader_path(server, stream, count):
+    reader = asyncio.StreamReader(limit=2 ** 32)
+    async def feed():
+        for offset in range(0, len(stream), CHUNK_SIZE):
+            reader.feed_data(stream[offset:offset + CHUNK_SIZE]) # stands in for sock.recv
+            await asyncio.sleep(0)
+        reader.feed_eof()
+    start_time = perf_counter()
+    feeder = asyncio.create_task(feed())
+    connection = make_connection(server)
+    received = 0
+    while received < count:
+        frame = await server.receive_request(reader, ("127.0.0.1", 0), connection=connection)
+        if frame is None:
+            break
+        received += 1
+    await feeder
+    return perf_counter() - start_time, received
+
+async def buffered_protocol_path(server, stream, count):
+    protocol = _CountingProtocol(server)
+    source = memoryview(stream)
+    start_time = perf_counter()
+    offset = 0
+    while offset < len(stream):
+        buffer = protocol.get_buffer(CHUNK_SIZE)
+        nbytes = min(len(buffer), CHUNK_SIZE, len(stream) - offset)
+        buffer[:nbytes] = source[offset:offset + nbytes] # stands in for sock.recv_into
+        protocol.buffer_updated(nbytes)
+        offset += nbytes
+    return perf_counter() - start_time, protocol.received
+
+async def measure(path, server, stream, count):
+    tracemalloc.start()
+    elapsed, received = await path(server, stream, count)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, received, peak
+
+async def main():
+    """Run the reassembly benchmark for every payload size."""
+    # never started, only its parsing paths are used (16 MiB payloads + header extensions, past the default max_frame_size)
+    server = AsyncServer(port=0, secure=False, host="127.0.0.1", max_frame_size=32 * 1024 * 1024)
+    server.set_logger(logging.getLogger("benchmark"))
+    print("Starting frame reassembly benchmark...")
+    for payload_size in PAYLOAD_SIZES:
+        stream, count = build_stream(payload_size)
+        for name, path in (("StreamReader", stream_reader_path), ("BufferedProtocol", buffered_protocol_path)):
+            elapsed, received, peak = await measure(path, server, stream, count)
+            print(f"{name} | payload {payload_size} bytes:")
+            print(f"  Frames reassembled: {received}/{count}")
+            print(f"  Throughput: {len(stream) / elapsed / 1024 / 1024:.1f} MB/s")
+            print(f"  Peak traced allocations: {peak / 1024:.1f} KB")
+
+asyncio.run(main())
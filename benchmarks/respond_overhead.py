@@ -0,0 +1,80 @@
+import os
+import sys
+import asyncio
+import logging
+from types import SimpleNamespace
+from time import perf_counter
+from datetime import datetime
+from collections.abc import Coroutine
+import Fluxon.Routing as Routing
+from Fluxon.Routing import Setup, Request, SESSIONS
+
+# Setup.respond overhead per call: the eager Request (timestamp, print, user lookup on every call)
+# vs the slotted one with lazy fields. Views are trivial so only the per-request bookkeeping is measured.
+# The session is logged in, so the eager path pays for a user lookup even when the view ignores it.
+# NOTE stdout goes to /dev/null during the runs, printing to a real terminal costs the eager path a lot more
+
+CALLS = 200_000
+SESSIONID = "benchmark-session"
+
+class _UserModel:
+    """Stands in for the AuthenticatedUser model, an async lookup that doesn't hit a database."""
+    @staticmethod
+    async def Check(where, fetch, columns):
+        return [(1, "benchmark", "benchmark@example.com")]
+
+class EagerRequest(Request):
+    """Request as it was before the lazy fields, kept here for comparison."""
+    def __init__(self, payload, connection, sessionid):
+        super().__init__(payload, connection, sessionid)
+        self._timestamp = f"{datetime.now():%Y-%m-%d %H:%M:%S}.{datetime.now().microsecond // 1000:03}"
+        print(f"{self.timestamp} - request received from {self.connection.peername[0]}:{self.connection.peername[1]}")
+
+async def eager_respond(setup, view, payload, connection, sessionid):
+    if view in setup.mapping:
+        request = EagerRequest(payload, connection, sessionid)
+        await request._auth()
+        response = setup.mapping[view](request)
+        if isinstance(response, Coroutine):
+            return await response
+        return response
+    return {"response": f"view '{view}' not found"}
+
+def ping(request):
+    return {"pong": request.payload}
+
+def whoami(request):
+    return {"username": request.user.username}
+
+async def measure(respond, setup, view, connection):
+    start_time = perf_counter()
+    for call in range(CALLS):
+        await respond(setup, view, call, connection, SESSIONID)
+    return (perf_counter() - start_time) / CALLS
+
+async def main():
+    """Run the respond overhead benchmark for a view ignoring the user and one reading it."""
+    setup = Setup.__new__(Setup) # skip secrets/models/database loading, the views don't use them
+    setup.mapping = {"ping": ping, "whoami": whoami}
+    Routing.authorized_user_model = _UserModel
+    logging.getLogger("main_logger").setLevel(logging.INFO)
+    connection = SimpleNamespace(
+        server=SimpleNamespace(sessions=SESSIONS, worker_id=None),
+        peername=("127.0.0.1", 0), sessionid=SESSIONID, userid=None
+    )
+    SESSIONS.login(SESSIONID, 1)
+    print(f"Starting Setup.respond overhead benchmark ({CALLS} calls per run)...")
+    for view in ("ping", "whoami"):
+        stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+        try:
+            eager = await measure(eager_respond, setup, view, connection)
+            lean = await measure(Setup.respond, setup, view, connection)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        print(f"View '{view}':")
+        print(f"  Eager Request: {eager * 1e6:.2f} us/call")
+        print(f"  Lean Request: {lean * 1e6:.2f} us/call")
+        print(f"  Speedup: {eager / lean:.2f}x")
+
+asyncio.run(main())
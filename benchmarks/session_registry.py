@@ -0,0 +1,61 @@
+import uuid
+import random
+from time import perf_counter
+from Fluxon.Endpoint.session_registry import SessionRegistry
+
+# User -> session lookups and logins at 10k/100k/1M live sessions: the bare session -> user dict
+# (linear scans, as get_session_by_userid and Request.login did) vs the indexed SessionRegistry.
+# NOTE the dict scans are timed on a few calls only, they're O(sessions) each
+
+SIZES = (10_000, 100_000, 1_000_000)
+LOOKUPS = 10_000
+SCANS = 20
+
+class _Connection:
+    pass
+
+def populate(size):
+    sessions = [str(uuid.UUID(int=random.getrandbits(128))) for _ in range(size)]
+    lookup = dict()
+    registry = SessionRegistry()
+    for userid, sessionid in enumerate(sessions):
+        lookup[sessionid] = userid
+        registry.add_connection(sessionid, _Connection())
+        registry.login(sessionid, userid)
+    return sessions, lookup, registry
+
+def scan_session_by_userid(lookup, userid):
+    if userid in lookup.values():
+        for key, value in lookup.items():
+            if value == userid:
+                return key
+    return None
+
+def scan_login(lookup, sessionid, userid):
+    for session in [session for session, user_id in lookup.items() if user_id == userid]:
+        del lookup[session]
+    lookup[sessionid] = userid
+
+def measure(function, calls):
+    start_time = perf_counter()
+    for call in calls:
+        function(*call)
+    return (perf_counter() - start_time) / len(calls)
+
+def main():
+    """Run the session registry benchmark for every size."""
+    print(f"Starting session registry benchmark ({LOOKUPS} indexed calls, {SCANS} scanning calls per run)...")
+    for size in SIZES:
+        sessions, lookup, registry = populate(size)
+        users = [random.randrange(size) for _ in range(LOOKUPS)]
+        # NOTE the user logs in again with the session they already have, both maps keep their size
+        logins = [(sessions[userid], userid) for userid in users]
+        scan_lookup = measure(lambda userid: scan_session_by_userid(lookup, userid), [(userid,) for userid in users[:SCANS]])
+        indexed_lookup = measure(lambda userid: registry.session_of(userid), [(userid,) for userid in users])
+        scan_logins = measure(lambda sessionid, userid: scan_login(lookup, sessionid, userid), logins[:SCANS])
+        indexed_logins = measure(lambda sessionid, userid: registry.login(sessionid, userid), logins)
+        print(f"{size} sessions:")
+        print(f"  Session by user id: scan {scan_lookup * 1e6:.2f} us, indexed {indexed_lookup * 1e6:.2f} us ({scan_lookup / indexed_lookup:.0f}x)")
+        print(f"  Login: scan {scan_logins * 1e6:.2f} us, indexed {indexed_logins * 1e6:.2f} us ({scan_logins / indexed_logins:.0f}x)")
+
+main()
@@ -0,0 +1,65 @@
+import os
+import time
+import pickle
+import tempfile
+from time import perf_counter
+from Fluxon.Endpoint.session_store import LocalSessionStore
+from Fluxon.Endpoint.session_snapshot import SessionSnapshot
+from Fluxon.Endpoint.auth_context import SessionTokens
+
+# Warm restart with 1M logged in sessions: writing the snapshot on stop_server, restoring it on startup
+# (memory-mapped bulk load into an empty store), and the journal of changes in between.
+# A pickle of the session -> user dict is timed alongside for reference (no user -> sessions index, no expiries).
+
+SESSIONS = 1_000_000
+CHANGES = 10_000
+
+def main():
+    """Run the session snapshot benchmark."""
+    print(f"Starting session snapshot benchmark ({SESSIONS} sessions, {CHANGES} journaled changes)...")
+    tokens = SessionTokens("benchmark-key")
+    store = LocalSessionStore()
+    sessions = [tokens.issue() for _ in range(SESSIONS)]
+    store.restore(sessions, range(SESSIONS), [SessionTokens.expires_at(sessionid) for sessionid in sessions])
+    directory = tempfile.mkdtemp(prefix="fluxon-snapshot-")
+    path = os.path.join(directory, "sessions.snapshot")
+    snapshot = SessionSnapshot(path)
+    snapshot.attach(store)
+    try:
+        start_time = perf_counter()
+        captured = snapshot.capture()
+        capture_time = perf_counter() - start_time
+        start_time = perf_counter()
+        snapshot.write(captured)
+        write_time = perf_counter() - start_time
+        print(f"  Snapshot: {os.path.getsize(path) / 2**20:.1f} MiB, capture {capture_time * 1e3:.0f} ms (on the loop), write {write_time * 1e3:.0f} ms")
+        for userid, sessionid in enumerate(sessions[:CHANGES]): # half log out, half log in again
+            if userid % 2:
+                store.logout(sessionid)
+            else:
+                store.login(sessionid, SESSIONS + userid, SessionTokens.expires_at(sessionid))
+        start_time = perf_counter()
+        snapshot.flush()
+        print(f"  Journal flush: {CHANGES} changes in {(perf_counter() - start_time) * 1e3:.1f} ms")
+        restored_store = LocalSessionStore()
+        restored = SessionSnapshot(path)
+        restored.attach(restored_store)
+        start_time = perf_counter()
+        count = restored.load()
+        print(f"  Restore: {count} sessions in {(perf_counter() - start_time) * 1e3:.0f} ms (snapshot + journal replay)")
+        assert restored_store.users == store.users
+        pickle_path = os.path.join(directory, "sessions.pickle")
+        start_time = perf_counter()
+        with open(pickle_path, "wb") as file:
+            pickle.dump(store.users, file, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle_write = perf_counter() - start_time
+        start_time = perf_counter()
+        with open(pickle_path, "rb") as file:
+            pickle.load(file)
+        print(f"  Pickled dict (reference): write {pickle_write * 1e3:.0f} ms, load {(perf_counter() - start_time) * 1e3:.0f} ms")
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+main()
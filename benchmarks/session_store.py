@@ -0,0 +1,58 @@
+import os
+import time
+import uuid
+import random
+import multiprocessing
+from time import perf_counter
+from Fluxon.Endpoint.session_store import LocalSessionStore, SQLiteSessionStore
+
+# Session -> user lookups through the session stores: in-process dict vs the shared SQLite store
+# on a cache hit and on a miss, then how long a logout in another process takes to reach this one's cache.
+
+SESSIONS = 100_000
+LOOKUPS = 100_000
+
+def populate(store, sessions):
+    for userid, sessionid in enumerate(sessions):
+        store.login(sessionid, userid)
+
+def measure(store, sessions):
+    start_time = perf_counter()
+    for sessionid in sessions:
+        store.user_of(sessionid)
+    return (perf_counter() - start_time) / len(sessions)
+
+def logout_elsewhere(path, sessionid):
+    # a forked "worker" with a connection of its own
+    store = SQLiteSessionStore(path)
+    store.logout(sessionid)
+    store.close()
+
+def main():
+    """Run the session store benchmark."""
+    print(f"Starting session store benchmark ({SESSIONS} sessions, {LOOKUPS} lookups per run)...")
+    sessions = [str(uuid.UUID(int=random.getrandbits(128))) for _ in range(SESSIONS)]
+    lookups = [random.choice(sessions) for _ in range(LOOKUPS)]
+    local = LocalSessionStore()
+    populate(local, sessions)
+    print(f"  Local store: {measure(local, lookups) * 1e6:.2f} us/lookup")
+    shared = SQLiteSessionStore.temporary(cache_size=SESSIONS)
+    try:
+        start_time = perf_counter()
+        populate(shared, sessions)
+        print(f"  SQLite store logins: {(perf_counter() - start_time) / SESSIONS * 1e6:.2f} us/login")
+        shared.cache.clear()
+        print(f"  SQLite store, cold cache: {measure(shared, lookups) * 1e6:.2f} us/lookup")
+        print(f"  SQLite store, warm cache: {measure(shared, lookups) * 1e6:.2f} us/lookup")
+        victim = lookups[0]
+        process = multiprocessing.get_context("fork").Process(target=logout_elsewhere, args=(shared.path, victim))
+        process.start()
+        process.join()
+        logged_out = perf_counter()
+        while shared.user_of(victim) is not None:
+            time.sleep(0.001)
+        print(f"  Logout in another process seen after {(perf_counter() - logged_out) * 1e3:.1f} ms (poll interval {shared.poll_interval * 1e3:.0f} ms)")
+    finally:
+        shared.close(remove=True)
+
+main()
@@ -0,0 +1,63 @@
+import time
+import uuid
+import random
+from time import perf_counter
+from Fluxon.Endpoint.session_registry import SessionRegistry
+from Fluxon.Endpoint.auth_context import SessionTokens
+
+# Session expiry at 1M sessions: the incremental sweep (bounded batch per tick) vs one full pass over every
+# session, as a stop-the-world collector would do it. Half the sessions are idle past their ttl.
+# What matters is the longest a single tick holds the event loop.
+
+SESSIONS = 1_000_000
+BATCH = 1000
+
+class _Connection:
+    pass
+
+def populate():
+    tokens = SessionTokens("benchmark-key")
+    registry = SessionRegistry(idle_ttl=60, max_idle=SESSIONS)
+    sessions = [tokens.issue() if not index % 1000 else f"{uuid.UUID(int=random.getrandbits(128))}" for index in range(SESSIONS)]
+    for userid, sessionid in enumerate(sessions):
+        connection = _Connection()
+        registry.add_connection(sessionid, connection)
+        registry.login(sessionid, userid)
+        registry.remove_connection(sessionid, connection)
+        registry.release(sessionid)
+    # the first half went idle long ago
+    long_ago = time.monotonic() - 3600
+    for sessionid in sessions[:SESSIONS // 2]:
+        registry.idle[sessionid] = (long_ago, True)
+    return registry
+
+def full_pass(registry):
+    now = time.monotonic()
+    due = [sessionid for sessionid, (since, _) in registry.idle.items() if since + registry.idle_ttl <= now]
+    for sessionid in due:
+        del registry.idle[sessionid]
+    registry.store.logout_many(due)
+    return len(due)
+
+def main():
+    """Run the session sweep benchmark."""
+    print(f"Starting session sweep benchmark ({SESSIONS} sessions, {SESSIONS // 2} expired, batch {BATCH})...")
+    registry = populate()
+    start_time = perf_counter()
+    swept = full_pass(registry)
+    print(f"  Full pass: {swept} sessions in one {(perf_counter() - start_time) * 1e3:.1f} ms pause")
+    registry = populate()
+    ticks = swept = 0
+    longest = 0.0
+    while True:
+        start_time = perf_counter()
+        count = registry.sweep(BATCH)
+        longest = max(longest, perf_counter() - start_time)
+        if not count:
+            break
+        ticks += 1
+        swept += count
+    print(f"  Incremental: {swept} sessions over {ticks} ticks, longest tick {longest * 1e3:.2f} ms")
+    print(f"  Memory estimate after the sweep: {registry.memory_estimate() / 2**20:.1f} MiB, {len(registry.idle)} idle sessions left")
+
+main()
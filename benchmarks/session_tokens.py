@@ -0,0 +1,32 @@
+import time
+import uuid
+from time import perf_counter
+from Fluxon.Endpoint.auth_context import SessionTokens
+
+# Session id verification: a full HMAC check, a recently verified id (LRU hit) and the early rejections
+# of unsigned and expired ids, which never compute the HMAC.
+
+CALLS = 200_000
+
+def measure(tokens, token):
+    start_time = perf_counter()
+    for _ in range(CALLS):
+        tokens.verify(token)
+    return (perf_counter() - start_time) / CALLS
+
+def main():
+    """Run the session token benchmark."""
+    print(f"Starting session token benchmark ({CALLS} verifications per run)...")
+    tokens = SessionTokens("benchmark-key", cache_size=0)
+    token = tokens.issue()
+    issued = int(time.time()) - 3600
+    body = f"{uuid.uuid4()}.{issued:x}.{issued + 60:x}"
+    expired = f"{body}.{tokens.sign(body)}"
+    unsigned = str(uuid.uuid4())
+    print(f"  HMAC check: {measure(tokens, token) * 1e6:.2f} us")
+    tokens.cache_size = 10000
+    print(f"  Recently verified: {measure(tokens, token) * 1e6:.2f} us")
+    print(f"  Unsigned, rejected: {measure(tokens, unsigned) * 1e6:.2f} us")
+    print(f"  Expired, rejected: {measure(tokens, expired) * 1e6:.2f} us")
+
+main()
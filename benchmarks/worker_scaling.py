@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import json
+import socket
+import tempfile
+import logging
+import multiprocessing
+from Fluxon.Routing import Setup
+from Fluxon.Endpoint.auth_context import generate_signed_sessionid
+from Endpoint.async_server import AsyncServer # same module server_utils checks against
+from Endpoint.server_utils import run_server
+from Fluxon.Protocol import pack_frame, recv_frame, FRAME_REQUEST, FRAME_HANDSHAKE, FRAME_VERSION, handshake_options
+
+# Requests/sec on loopback with run_server(server, workers=N), N = 1..cpu count
+# Every client process keeps a window of pipelined requests in flight on its own connection.
+# NOTE clients share the machine with the workers, keep CLIENTS around the core count
+
+HOST = "127.0.0.1"
+PORT = 8090
+CLIENTS = os.cpu_count() * 2
+WINDOW = 32 # pipelined requests in flight per client
+DURATION = 5 # seconds per worker count
+
+def benchmark_test(request):
+    # a bit of CPU per request, so the event loop and not the kernel is the bottleneck
+    rows = [{"id": i, "name": f"user{i}", "score": i * 1.5} for i in range(50)]
+    return {"rows": rows, "total": sum(row["score"] for row in rows)}
+
+def serve(workers):
+    setup = Setup.__new__(Setup) # skip secrets/models/database loading, the view doesn't use them
+    setup.mapping = {"benchmark_test": benchmark_test}
+    setup.private_key = "benchmark-key"
+    setup.session_tokens.use_key(setup.private_key)
+    setup.generate_signed_sessionid = generate_signed_sessionid
+    setup.load_database_api = setup.load_models = lambda: None
+    setup.models = setup.database_schema_dir = None
+    setup.database_path = os.path.join(tempfile.gettempdir(), "fluxon_worker_scaling.sqlite3")
+    logging.getLogger("main_logger").setLevel(logging.ERROR)
+    server = AsyncServer(port=PORT, secure=False, setup=setup, host=HOST)
+    server.cloud_storage = None
+    sys.stdout = open(os.devnull, "w") # request logging would dominate the measurement
+    run_server(server, workers=workers)
+
+def client(deadline, results):
+    sock = socket.create_connection((HOST, PORT))
+    sock.sendall(pack_frame(handshake_options(frame_version=FRAME_VERSION, codecs=["json"]), FRAME_HANDSHAKE))
+    recv_frame(sock)
+    request = b"benchmark_test||" + json.dumps({}).encode()
+    for request_id in range(WINDOW):
+        sock.sendall(pack_frame(request, FRAME_REQUEST, request_id=request_id))
+    completed = 0
+    while time.time() < deadline:
+        frame = recv_frame(sock)
+        if frame is None:
+            break
+        completed += 1
+        sock.sendall(pack_frame(request, FRAME_REQUEST, request_id=frame.request_id))
+    results.put(completed)
+    sock.close()
+
+def wait_for_server(timeout=10):
+    started = time.time()
+    while time.time() - started < timeout:
+        try:
+            socket.create_connection((HOST, PORT)).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def main():
+    """Run the scaling benchmark for 1 to cpu count workers."""
+    context = multiprocessing.get_context("fork")
+    print(f"Starting worker scaling benchmark ({CLIENTS} clients, window {WINDOW}, {DURATION}s per run)...")
+    baseline = None
+    for workers in range(1, os.cpu_count() + 1):
+        server_process = context.Process(target=serve, args=(workers,))
+        server_process.start()
+        if not wait_for_server():
+            print("Server failed to start")
+            server_process.terminate()
+            return
+        time.sleep(0.5) # let every worker bind
+        results = context.Queue()
+        deadline = time.time() + DURATION
+        clients = [context.Process(target=client, args=(deadline, results)) for _ in range(CLIENTS)]
+        for process in clients:
+            process.start()
+        completed = sum(results.get() for _ in clients)
+        for process in clients:
+            process.join()
+        server_process.terminate() # SIGTERM, the supervisor stops its workers
+        server_process.join()
+        requests_per_second = completed / DURATION
+        baseline = baseline or requests_per_second
+        print(f"Workers: {workers}")
+        print(f"  Requests/sec: {requests_per_second:.0f}")
+        print(f"  Scaling: {requests_per_second / baseline:.2f}x")
+
+if __name__ == "__main__":
+    main()
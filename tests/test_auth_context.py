@@ -0,0 +1,29 @@
+from Fluxon.Endpoint.auth_context import SessionTokens
+
+def test_verify_issued_token():
+    tokens = SessionTokens("test-key")
+    token = tokens.issue()
+    assert tokens.verify(token)
+    assert SessionTokens("test-key").verify(token) # no lookup, another worker sharing the key accepts it
+    assert not SessionTokens("other-key").verify(token)
+
+def test_verify_rejects_forged_and_malformed():
+    tokens = SessionTokens("test-key")
+    uuid, issued, expires, signature = tokens.issue().split(".")
+    forged = f"{uuid}.{issued}.{int(expires, 16) + 3600:x}.{signature}"
+    assert not tokens.verify(forged)
+    assert not tokens.verify("not-a-token")
+    assert not tokens.verify(None)
+    stats = tokens.stats.snapshot()
+    assert stats["rejected_forged"] == 1 and stats["rejected_unsigned"] == 2
+
+def test_verify_rejects_expired():
+    tokens = SessionTokens("test-key", ttl=-1)
+    token = tokens.issue()
+    assert SessionTokens.expires_at(token) is not None
+    assert not tokens.verify(token)
+    assert token not in tokens.verified
+
+def test_verify_without_key():
+    tokens = SessionTokens()
+    assert not tokens.verify(SessionTokens("test-key").issue())
@@ -0,0 +1,129 @@
+import pytest
+from Fluxon.Endpoint import session_registry
+from Fluxon.Endpoint.session_registry import SessionRegistry
+from Fluxon.Endpoint.auth_context import SessionTokens
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class Connection:
+    userid = None
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_registry.time, "monotonic", clock)
+    return clock
+
+def test_connections():
+    registry = SessionRegistry()
+    first, second = Connection(), Connection()
+    registry.add_connection("a", first)
+    registry.add_connection("a", second)
+    assert registry.first_connection("a") is first
+    assert registry.remove_connection("a", first) is False
+    assert registry.remove_connection("a", first) is False # already gone
+    assert registry.remove_connection("a", second) is True
+    assert not registry.has_session("a")
+
+def test_login_resets_connected_users():
+    registry = SessionRegistry()
+    connection = Connection()
+    registry.add_connection("a", connection)
+    connection.userid = 1
+    registry.login("a", 1)
+    assert connection.userid is None # resolved again by its next request
+    assert registry.session_of(1) == "a"
+
+def test_sweep_logs_out_past_idle_ttl(clock):
+    registry = SessionRegistry(idle_ttl=60)
+    for session in ("a", "b"):
+        registry.login(session, session)
+    registry.release("a")
+    clock.now += 30
+    registry.release("b")
+    assert registry.sweep() == 0
+    clock.now += 31
+    assert registry.sweep() == 1
+    assert registry.user_of("a") is None and registry.user_of("b") == "b"
+    clock.now += 30
+    assert registry.sweep() == 1
+    assert registry.store.counts() == (0, 0)
+
+def test_reconnect_cancels_idle_logout(clock):
+    registry = SessionRegistry(idle_ttl=60)
+    registry.login("a", 1)
+    registry.release("a")
+    registry.add_connection("a", Connection())
+    clock.now += 120
+    assert registry.sweep() == 0
+    assert registry.user_of("a") == 1
+
+def test_release_without_logout_only_forgets(clock):
+    registry = SessionRegistry(idle_ttl=60)
+    registry.login("a", 1)
+    registry.release("a", logout=False)
+    clock.now += 120
+    assert registry.sweep() == 1
+    assert registry.user_of("a") == 1
+
+def test_zero_idle_ttl_logs_out_right_away():
+    registry = SessionRegistry(idle_ttl=0)
+    registry.login("a", 1)
+    registry.release("a")
+    assert registry.user_of("a") is None and not registry.idle
+
+def test_sweep_evicts_past_max_idle(clock):
+    registry = SessionRegistry(idle_ttl=60, max_idle=2)
+    for i in range(5):
+        registry.login(f"s{i}", i)
+        registry.release(f"s{i}")
+    assert registry.idle_backlog() == 3
+    assert registry.sweep() == 3
+    assert list(registry.idle) == ["s3", "s4"] # longest idle went first
+    assert registry.stats.snapshot()["evicted_idle"] == 3
+
+def test_sweep_is_bounded(clock):
+    registry = SessionRegistry(idle_ttl=60)
+    for i in range(25):
+        registry.login(f"s{i}", i)
+        registry.release(f"s{i}")
+    clock.now += 61
+    assert [registry.sweep(10) for _ in range(4)] == [10, 10, 5, 0]
+
+def test_sweep_purges_expired_tokens(clock):
+    tokens = SessionTokens("test-key", ttl=-120) # issued expired, in a past minute's bucket
+    registry = SessionRegistry(idle_ttl=60)
+    expired = tokens.issue()
+    registry.login(expired, 1)
+    registry.login("plain", 2) # no expiry in its id
+    assert registry.sweep() == 1
+    assert registry.user_of(expired) is None and registry.user_of("plain") == 2
+
+def test_release_restored(clock):
+    registry = SessionRegistry(idle_ttl=60)
+    registry.store.restore(["a", "b", "c"], [1, 2, 3], [0, 0, 0])
+    registry.add_connection("a", Connection())
+    registry.login("c", 3)
+    registry.release("c")
+    assert registry.release_restored(["a", "b", "c"]) == 1 # connected and already idle sessions kept as they are
+    clock.now += 61
+    assert registry.sweep() == 2
+    assert registry.user_of("a") == 1 and registry.user_of("b") is None
+
+def test_release_restored_zero_idle_ttl():
+    registry = SessionRegistry(idle_ttl=0)
+    registry.store.restore(["a", "b"], [1, 2], [0, 0])
+    registry.add_connection("a", Connection())
+    assert registry.release_restored(["a", "b"]) == 1
+    assert registry.user_of("a") == 1 and registry.user_of("b") is None
+
+def test_report():
+    registry = SessionRegistry()
+    registry.login("a", 1)
+    report = registry.report()
+    assert report["logged_in"] == 1 and report["idle_backlog"] == 0 and report["expired_backlog"] == 0
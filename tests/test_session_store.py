@@ -0,0 +1,163 @@
+import asyncio
+import pytest
+from Fluxon.Endpoint.session_store import LocalSessionStore, SQLiteSessionStore, EXPIRY_BUCKET
+
+NOW = 1_000_000 * EXPIRY_BUCKET # start of a minute's bucket
+
+@pytest.fixture
+def sqlite_store():
+    store = SQLiteSessionStore.temporary(poll_interval=0)
+    yield store
+    store.close(remove=True)
+
+def notified(store):
+    changes = []
+    store.subscribe(changes.append)
+    return changes
+
+# LocalSessionStore
+
+def test_login_evicts_the_users_other_sessions():
+    store = LocalSessionStore()
+    changes = notified(store)
+    assert store.login("a", 1) == set()
+    assert store.login("b", 1) == {"a"}
+    assert store.user_of("a") is None and store.user_of("b") == 1
+    assert store.sessions_for(1) == {"b"}
+    assert changes == ["a", "a", "b"]
+
+def test_login_as_another_user_leaves_no_garbage():
+    store = LocalSessionStore()
+    store.login("a", 1, expires=NOW + 10)
+    store.login("a", 2)
+    assert store.sessions_for(1) == set() and store.sessions_for(2) == {"a"}
+    assert store.counts() == (1, 1)
+    assert not store.expires and not store.buckets
+
+def test_logout():
+    store = LocalSessionStore()
+    store.login("a", 1, expires=NOW + 10)
+    assert store.logout("a") == 1
+    assert store.logout("a") is None
+    assert store.counts() == (0, 0)
+    assert not store.buckets
+
+def test_purge_expired_current_minute():
+    store = LocalSessionStore()
+    store.login("early", 1, expires=NOW + 5)
+    store.login("late", 2, expires=NOW + 50)
+    assert store.purge_expired(NOW + 10, 100) == ["early"]
+    assert store.user_of("late") == 2
+    assert store.purge_expired(NOW + 10, 100) == []
+    assert store.purge_expired(NOW + 50, 100) == ["late"]
+    assert not store.buckets and not store.expires
+
+def test_purge_expired_past_minutes_whole():
+    store = LocalSessionStore()
+    for i in range(10):
+        store.login(f"s{i}", i, expires=NOW + i)
+    store.login("next", 100, expires=NOW + EXPIRY_BUCKET + 30)
+    later = NOW + 2 * EXPIRY_BUCKET
+    purged = store.purge_expired(later, 4) + store.purge_expired(later, 4) + store.purge_expired(later, 4)
+    assert sorted(purged[:10]) == sorted(f"s{i}" for i in range(10))
+    assert purged[10:] == ["next"]
+    assert store.counts() == (0, 0)
+    assert store.next_bucket is None
+
+def test_purge_expired_skips_oversized_current_bucket():
+    # a login burst in the current minute isn't scanned past `limit`, it goes as a whole once the minute passed
+    store = LocalSessionStore()
+    for i in range(20):
+        store.login(f"s{i}", i, expires=NOW + 1)
+    assert store.due(NOW + 30, 10) == []
+    assert store.purge_expired(NOW + 30, 10) == []
+    assert len(store.purge_expired(NOW + EXPIRY_BUCKET, 10)) == 10
+    assert len(store.purge_expired(NOW + EXPIRY_BUCKET, 10)) == 10
+    assert store.counts() == (0, 0)
+
+def test_due_never_exceeds_limit():
+    store = LocalSessionStore()
+    for i in range(50):
+        store.login(f"s{i}", i, expires=NOW + (i % 5) * EXPIRY_BUCKET)
+    assert len(store.due(NOW + 10 * EXPIRY_BUCKET, 7)) == 7
+    assert store.counts() == (50, 50) # due doesn't drop anything
+
+def test_expiry_backlog_counts_past_minutes():
+    store = LocalSessionStore()
+    for i in range(5):
+        store.login(f"old{i}", i, expires=NOW + i)
+    store.login("current", 10, expires=NOW + EXPIRY_BUCKET + 1)
+    store.login("future", 11, expires=NOW + 5 * EXPIRY_BUCKET)
+    assert store.expiry_backlog(NOW + EXPIRY_BUCKET + 30) == 5
+    assert store.expiry_backlog(NOW + 10 * EXPIRY_BUCKET) == 7
+    store.purge_expired(NOW + 10 * EXPIRY_BUCKET, 100)
+    assert store.expiry_backlog(NOW + 10 * EXPIRY_BUCKET) == 0
+
+def test_restore():
+    store = LocalSessionStore()
+    store.restore(["a", "b", "c"], [1, 2, 2], [NOW + 1, 0, NOW + 2])
+    assert store.sessions_for(2) == {"b", "c"}
+    assert store.counts() == (3, 2)
+    assert sorted(store.purge_expired(NOW + 10, 100)) == ["a", "c"]
+    assert store.user_of("b") == 2
+
+# SQLiteSessionStore
+
+def test_sqlite_login_logout(sqlite_store):
+    changes = notified(sqlite_store)
+    assert sqlite_store.login("a", 1) == set()
+    assert sqlite_store.login("b", 1) == {"a"}
+    assert sqlite_store.user_of("a") is None and sqlite_store.user_of("b") == 1
+    assert sqlite_store.logout("b") == 1
+    assert sqlite_store.logout("b") is None
+    assert sqlite_store.counts() == (0, 0)
+    assert changes == ["a", "a", "b", "b"]
+
+def test_sqlite_purge_expired(sqlite_store):
+    for i in range(5):
+        sqlite_store.login(f"s{i}", i, expires=NOW + i)
+    sqlite_store.login("later", 10, expires=NOW + 100)
+    assert sqlite_store.expiry_backlog(NOW + 10) == 5
+    assert sorted(sqlite_store.purge_expired(NOW + 10, 3) + sqlite_store.purge_expired(NOW + 10, 3)) == [f"s{i}" for i in range(5)]
+    assert sqlite_store.user_of("s0") is None and sqlite_store.user_of("later") == 10
+
+def test_sqlite_sees_other_connections_writes(sqlite_store):
+    other = SQLiteSessionStore(sqlite_store.path, poll_interval=0)
+    try:
+        sqlite_store.login("a", 1)
+        assert other.user_of("a") == 1
+        sqlite_store.logout("a")
+        assert other.user_of("a") is None # dropped from its cache by the change log
+    finally:
+        other.close()
+
+def test_sqlite_version_follows_pruned_log(sqlite_store):
+    sqlite_store.login("a", 1)
+    sqlite_store.conn.execute("DELETE FROM session_changes") # pruned, the sequence keeps counting
+    reopened = SQLiteSessionStore(sqlite_store.path, poll_interval=0)
+    try:
+        assert reopened.version == sqlite_store.version == 1
+        sqlite_store.login("b", 2)
+        assert sqlite_store.version == 2
+        reopened.poll()
+        assert reopened.version == 2 and reopened.stats.snapshot().get("resyncs", 0) == 0
+    finally:
+        reopened.close()
+
+async def settle(store):
+    # writes in flight committed and their callbacks run
+    await asyncio.get_running_loop().run_in_executor(None, store.flush)
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+def test_sqlite_writes_off_the_loop(sqlite_store):
+    changes = notified(sqlite_store)
+    async def main():
+        assert sqlite_store.login("a", 1) == set() # evictions are only known once committed
+        assert sqlite_store.user_of("a") == 1 # cached right away
+        await settle(sqlite_store)
+        sqlite_store.login("b", 1)
+        await settle(sqlite_store)
+    asyncio.run(main())
+    assert sorted(changes) == ["a", "a", "b"]
+    assert sqlite_store.sessions_for(1) == {"b"}